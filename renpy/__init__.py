@@ -159,6 +159,9 @@ type_blacklist = (
 
 name_blacklist = {
     "renpy.loadsave.autosave_not_running",
+    "renpy.loadsave.background_save_not_running",
+    "renpy.persistent.write_queue",
+    "renpy.persistent.write_thread",
     "renpy.python.unicode_re",
     "renpy.python.string_re",
     "renpy.python.store_dicts",
@@ -167,8 +170,10 @@ name_blacklist = {
     "renpy.text.text.VERT_REVERSE",
     "renpy.savelocation.scan_thread_condition",
     "renpy.savelocation.disk_lock",
+    "renpy.inotify.libc",
     "renpy.character.TAG_RE",
     "renpy.display.im.cache",
+    "renpy.display.diskcache.lock",
     "renpy.display.render.blit_lock",
     "renpy.display.render.IDENTITY",
     "renpy.loader.auto_lock",
@@ -311,6 +316,7 @@ def import_all():
     import renpy.arguments # @UnresolvedImport
 
     import renpy.log
+    import renpy.startup
 
     import renpy.display
 
@@ -321,6 +327,7 @@ def import_all():
     import renpy.preferences
 
     # Adds in the Ren'Py loader.
+    import renpy.inotify
     import renpy.loader
 
     import renpy.pyanalysis
@@ -334,6 +341,7 @@ def import_all():
     import renpy.loadsave
     import renpy.savelocation  # @UnresolvedImport
     import renpy.persistent
+    import renpy.savestats
     import renpy.scriptedit
     import renpy.parser
     import renpy.python
@@ -387,6 +395,7 @@ def import_all():
     import renpy.display.transition # core, layout @UnresolvedImport
     import renpy.display.movetransition # core @UnresolvedImport
     import renpy.display.im
+    import renpy.display.diskcache
     import renpy.display.imagelike
     import renpy.display.image # core, behavior, im, imagelike @UnresolvedImport
     import renpy.display.video
@@ -114,10 +114,18 @@ class ArgumentParser(argparse.ArgumentParser):
             "--keep-orphan-rpyc", action="store_true",
             help="Prevents the compile command from deleting orphan rpyc files.")
 
+        self.add_argument(
+            "--rpyc-compression", action="store", type=int, default=None, metavar="LEVEL",
+            help="The zlib compression level (0-9) used when writing .rpyc files. Defaults to 1, which is fast. Use 9 for release builds.")
+
         self.add_argument(
             "--lint", action="store_true", dest="lint",
             help=argparse.SUPPRESS)
 
+        self.add_argument(
+            "--trace-startup", action="store", dest="trace_startup", default=None, metavar="FILE",
+            help="Writes a trace of startup, in the Chrome trace event format, to FILE.")
+
         dump = self.add_argument_group("JSON dump arguments", description="Ren'Py can dump information about the game to a JSON file. These options let you select the file, and choose what is dumped.")
         dump.add_argument("--json-dump", action="store", metavar="FILE", help="The name of the JSON file.")
         dump.add_argument("--json-dump-private", action="store_true", default=False, help="Include private names. (Names beginning with _.)")
@@ -255,6 +263,7 @@ def pre_init():
     register_command("compile", compile)
     register_command("rmpersistent", rmpersistent)
     register_command("quit", quit)
+    register_command("startup-benchmark", renpy.startup.benchmark)
 
 
 def post_init():
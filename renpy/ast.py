@@ -414,6 +414,15 @@ class Node(object):
         else:
             return [ ]
 
+    def predict_weights(self, successors):
+        """
+        Given `successors`, the list of nodes returned by predict, returns
+        a list giving the relative likelihood that each will be executed
+        after this node.
+        """
+
+        return [ 1.0 ] * len(successors)
+
     def scry(self):
         """
         Called to return an object with some general, user-definable information
@@ -1471,6 +1480,25 @@ class Menu(Node):
 
         return rv
 
+    def predict_weights(self, successors):
+
+        # Choices are weighted by the number of times they've been chosen,
+        # plus one so that new choices are still predicted.
+        chosen = renpy.game.persistent._chosen or { }  # @UndefinedVariable
+
+        rv = [ ]
+
+        for label, _condition, block in self.items:
+            if not block:
+                continue
+
+            if renpy.config.say_menu_text_filter:
+                label = renpy.config.say_menu_text_filter(label)
+
+            rv.append(1.0 + chosen.get((self.name, label), 0))
+
+        return rv
+
     def scry(self):
         rv = Node.scry(self)
         rv._next = None
@@ -63,6 +63,10 @@ rollback_enabled = True
 # If the rollback is longer than this, we may trim it.
 rollback_length = 128
 
+# If not None, the number of bytes the rollback log may use before it is
+# trimmed.
+rollback_size = None
+
 # If set to True, clicking while in rollback will keep the roll forward
 # buffer if the data has not changed.
 keep_rollback_data = False
@@ -93,6 +97,26 @@ savedir = None
 # live in the image cache at once.
 image_cache_size = 16
 
+# If not None, the size of the image cache, in megabytes. This takes
+# precedence over image_cache_size.
+image_cache_size_mb = None
+
+# If not None, the size of the textures loaded from images in the image
+# cache, in megabytes. If None, this is the same as the size of the image
+# cache.
+image_cache_texture_size_mb = None
+
+# The size of the disk cache for the results of image manipulators, in
+# megabytes. If None or 0, the disk cache is not used.
+image_disk_cache_size_mb = 128
+
+# Should chains of image manipulators be combined when they're loaded?
+optimize_image_manipulators = True
+
+# The number of threads that preload images. If None, this is chosen
+# based on the number of processors.
+image_preload_threads = None
+
 # The number of statements we will analyze when doing predictive
 # loading. Please note that this is a total number of statements in a
 # BFS along all paths, rather than the depth along any particular
@@ -126,6 +150,14 @@ searchpath = [ ]
 # Only useful for debugging Ren'Py, don't document.
 force_archives = False
 
+# If True, archives are memory-mapped once when indexed, and files are
+# read out of the map.
+mmap_archives = ("RENPY_MMAP_ARCHIVES" in os.environ)
+
+# If True, script files without init code are loaded when they are first
+# used, rather than at startup.
+lazy_script = ("RENPY_LAZY_SCRIPT" in os.environ)
+
 # Used to control the software mouse cursor.
 mouse = None
 
@@ -484,6 +516,13 @@ voice_tag_callback = None
 # A list of callbacks that can be used to add JSON to save files.
 save_json_callbacks = [ ]
 
+# If True, the FileSave action writes saves in a background thread.
+save_in_background = True
+
+# The size, in bytes, the persistent journal can grow to before the
+# persistent data is written out in full.
+persistent_journal_size = 256 * 1024
+
 # The duration of a longpress, in seconds.
 longpress_duration = .5
 
@@ -542,6 +581,11 @@ transition_screens = True
 # of statement identifiers that should be predicted.
 predict_statements_callback = None
 
+# A function that's called with the filename and line number of a
+# statement, and the likelihood of each statement that can follow it, and
+# returns new likelihoods or None.
+predict_weights_callback = None
+
 # Should we use hardware video on platforms that support it?
 hw_video = True
 
@@ -2732,7 +2732,7 @@ class Interface(object):
                 # Check for autoreload.
                 if renpy.loader.needs_autoreload:
                     renpy.loader.needs_autoreload = False
-                    renpy.exports.reload_script()
+                    renpy.exports.autoreload_script()
 
                 # Redraw the screen.
                 if (self.force_redraw or
@@ -2765,6 +2765,9 @@ class Interface(object):
 
                     renpy.config.frames += 1
 
+                    if renpy.config.frames == 1:
+                        renpy.startup.first_frame()
+
                     # If profiling is enabled, report the profile time.
                     if renpy.config.profile or self.profile_once:
                         new_time = get_time()
@@ -2895,6 +2898,10 @@ class Interface(object):
 
                 renpy.persistent.check_update()
 
+                # Use idle time to prepare for a save.
+                if not (needs_redraw or self.event_peek()) and renpy.loadsave.mark_idle():
+                    continue
+
                 if needs_redraw or self.mouse_move or renpy.display.video.playing():
                     ev = self.event_poll()
                 else:
@@ -2937,6 +2944,7 @@ class Interface(object):
                     for i in renpy.config.periodic_callbacks:
                         i()
 
+                    renpy.loadsave.report_background_saves()
                     renpy.audio.audio.periodic()
                     renpy.display.tts.periodic()
                     continue
@@ -0,0 +1,339 @@
+# Copyright 2004-2015 Tom Rothamel <pytom@bishoujo.us>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# This file contains the disk cache for image manipulators. The results of
+# image manipulators that are expensive to compute are stored, as raw RGBA
+# pixels, in the cache/images directory. The files are keyed on the image
+# manipulator, the contents of the image files it uses, and the version of
+# Ren'Py.
+
+import pygame_sdl2 as pygame
+import renpy.display
+
+import hashlib
+import os
+import struct
+import threading
+
+# The directory the cache files are stored in, relative to the gamedir.
+DIRECTORY = "cache/images"
+
+# The magic number at the start of each cache file.
+MAGIC = "RPI1"
+
+# The header of a cache file - the magic number, width, and height.
+HEADER = struct.Struct("<4sII")
+
+# Images that take less time than this to load, in seconds, aren't stored,
+# as it would take about as long to read them from disk.
+MIN_TIME = 0.01
+
+# A lock that must be held when accessing the index.
+lock = threading.Lock()
+
+# A map from the name of a cache file to an [ mtime, size ] list, or None
+# if the cache directory hasn't been scanned yet.
+index = None
+
+# The total size of the files in the cache, in bytes.
+total_size = 0
+
+
+class Uncacheable(Exception):
+    """
+    Raised when an image manipulator can't be stored in the disk cache.
+    """
+
+
+def enabled():
+    return bool(renpy.config.image_disk_cache_size_mb) and not renpy.game.less_memory
+
+
+def encode(o):
+    """
+    Returns a string that uniquely identifies `o`, a part of the identity of
+    an image manipulator. Raises Uncacheable if `o` can't be encoded in a
+    way that will be stable from session to session.
+    """
+
+    if isinstance(o, renpy.display.im.ImageBase):
+
+        # Subclasses defined by the game might not have the state they
+        # load from in their identity.
+        if type(o).__module__ != "renpy.display.im":
+            raise Uncacheable()
+
+        return "<" + ",".join(encode(i) for i in o.identity) + ">"
+
+    if isinstance(o, (tuple, list)):
+        return "(" + ",".join(encode(i) for i in o) + ")"
+
+    if (o is None) or isinstance(o, (basestring, bool, int, long, float)):
+        return repr(o)
+
+    raise Uncacheable()
+
+
+def image_files(o, files):
+    """
+    Adds the names of the image files that `o`, an image manipulator, loads
+    to `files`.
+
+    The images are found in the fields of the image manipulators, rather
+    than their identities, as an identity can hold a filename that was
+    passed to the image manipulator before it was converted to an image.
+    """
+
+    if isinstance(o, renpy.display.im.Image):
+        files.add(o.filename)
+        return
+
+    for v in vars(o).itervalues():
+
+        if isinstance(v, renpy.display.im.ImageBase):
+            image_files(v, files)
+
+        elif isinstance(v, (tuple, list)):
+            for i in v:
+                if isinstance(i, renpy.display.im.ImageBase):
+                    image_files(i, files)
+
+
+def key(image):
+    """
+    Returns the key that `image` is stored under in the disk cache, or None
+    if it shouldn't be stored in the disk cache.
+    """
+
+    # Images loaded from files can be decoded about as fast as they can be
+    # read from the cache.
+    if isinstance(image, (renpy.display.im.Image, renpy.display.im.ZipFileImage)):
+        return None
+
+    if not enabled():
+        return None
+
+    try:
+        s = encode(image)
+    except Uncacheable:
+        return None
+
+    files = set()
+    image_files(image, files)
+
+    # Manipulators can change between versions of Ren'Py.
+    md5 = hashlib.md5(renpy.version + "\0" + s)
+
+    for fn in sorted(files):
+        h = renpy.loader.get_hash(fn)
+
+        # The file is missing, and so the image might be replaced by
+        # config.missing_image_callback.
+        if not h:
+            return None
+
+        md5.update("\0%s\0%d" % (fn.encode("utf-8") if isinstance(fn, unicode) else fn, h))
+
+    return md5.hexdigest()
+
+
+def filename(key):
+    return renpy.loader.get_path(DIRECTORY + "/" + key + ".rpi")
+
+
+def scan():
+    """
+    Builds the index, if it hasn't been built yet. This must be called with
+    the lock held.
+    """
+
+    global index
+    global total_size
+
+    if index is not None:
+        return
+
+    index = { }
+    total_size = 0
+
+    dn = os.path.dirname(filename("x"))
+
+    try:
+        names = os.listdir(dn)
+    except:
+        return
+
+    for i in names:
+        if not i.endswith(".rpi"):
+            continue
+
+        try:
+            st = os.stat(os.path.join(dn, i))
+        except:
+            continue
+
+        index[i] = [ st.st_mtime, st.st_size ]
+        total_size += st.st_size
+
+
+def load(key):
+    """
+    Returns the surface stored under `key`, or None if it's not in the disk
+    cache.
+    """
+
+    fn = filename(key)
+    name = os.path.basename(fn)
+
+    with lock:
+        scan()
+
+        if name not in index:
+            return None
+
+    try:
+        with open(fn, "rb") as f:
+            magic, width, height = HEADER.unpack(f.read(HEADER.size))
+
+            if magic != MAGIC:
+                raise Exception("Bad magic number.")
+
+            data = f.read(width * height * 4)
+
+        if len(data) != width * height * 4:
+            raise Exception("Truncated cache file.")
+
+        surf = pygame.image.fromstring(data, (width, height), "RGBA")
+        rv = renpy.display.pgrender.copy_surface(surf)
+
+    except:
+        remove(name)
+        return None
+
+    # Move the file to the end of the LRU order.
+    with lock:
+        entry = index.get(name, None)
+
+    if entry is not None:
+        try:
+            os.utime(fn, None)
+            entry[0] = os.stat(fn).st_mtime
+        except:
+            pass
+
+    return rv
+
+
+def save(key, surf, load_time):
+    """
+    Stores `surf` under `key`, if it took `load_time` seconds to produce.
+    Then removes the least recently used files until the cache fits in
+    config.image_disk_cache_size_mb.
+    """
+
+    if load_time < MIN_TIME:
+        return
+
+    fn = filename(key)
+    name = os.path.basename(fn)
+    tmp = fn + ".new"
+
+    width, height = surf.get_size()
+
+    try:
+        data = pygame.image.tostring(surf, "RGBA")
+
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, width, height))
+            f.write(data)
+
+        try:
+            os.rename(tmp, fn)
+        except:
+            os.unlink(fn)
+            os.rename(tmp, fn)
+
+        st = os.stat(fn)
+
+    except:
+        try:
+            os.unlink(tmp)
+        except:
+            pass
+
+        return
+
+    global total_size
+
+    with lock:
+        scan()
+
+        old = index.get(name, None)
+        if old is not None:
+            total_size -= old[1]
+
+        index[name] = [ st.st_mtime, st.st_size ]
+        total_size += st.st_size
+
+    cleanout()
+
+
+def remove(name):
+    """
+    Removes the cache file `name`.
+    """
+
+    global total_size
+
+    with lock:
+        entry = index.pop(name, None)
+
+        if entry is not None:
+            total_size -= entry[1]
+
+    try:
+        os.unlink(os.path.join(os.path.dirname(filename("x")), name))
+    except:
+        pass
+
+
+def cleanout():
+    """
+    Removes the least recently used files until the cache fits in
+    config.image_disk_cache_size_mb.
+    """
+
+    limit = int(renpy.config.image_disk_cache_size_mb * 1024 * 1024)
+
+    with lock:
+        if total_size <= limit:
+            return
+
+        entries = sorted((v[0], k, v[1]) for k, v in index.iteritems())
+
+    size = total_size
+
+    for _mtime, name, entry_size in entries:
+        if size <= limit:
+            break
+
+        remove(name)
+        size -= entry_size
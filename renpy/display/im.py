@@ -25,6 +25,8 @@
 
 import renpy.display
 
+import copy
+import heapq
 import math
 import zipfile
 import cStringIO
@@ -44,13 +46,69 @@ class CacheEntry(object):
         # The pygame surface corresponding to the cached object.
         self.surf = surf
 
-        # The size of this image.
+        # The size of this image's surface, in bytes.
         w, h = surf.get_size()
-        self.size = w * h
+        self.size = w * h * surf.get_bytesize()
+
+        # The size of the texture that has been loaded from this image, in
+        # bytes, or 0 if no texture has been loaded.
+        self.texture_size = 0
 
         # The time when this cache entry was last used.
         self.time = 0
 
+        # The previous and next entries in the LRU list, or None if this
+        # entry isn't in the list.
+        self.prev = None
+        self.next = None
+
+
+class LRU(object):
+    """
+    The head of a circular, doubly-linked list of cache entries. Entries
+    are moved to the end of the list when they're used, so the list is
+    ordered from least to most recently used, and the least recently used
+    entry can be found without sorting.
+    """
+
+    def __init__(self):
+        self.prev = self
+        self.next = self
+
+    def append(self, ce):
+        """
+        Adds `ce` to the end of the list.
+        """
+
+        tail = self.prev
+
+        ce.prev = tail
+        ce.next = self
+        tail.next = ce
+        self.prev = ce
+
+    def remove(self, ce):
+        """
+        Removes `ce` from the list.
+        """
+
+        ce.prev.next = ce.next
+        ce.next.prev = ce.prev
+        ce.prev = None
+        ce.next = None
+
+    def oldest(self):
+        """
+        Returns the least recently used entry, or None if the list is
+        empty.
+        """
+
+        if self.next is self:
+            return None
+
+        return self.next
+
+
 # This is the singleton image cache.
 class Cache(object):
 
@@ -63,18 +121,35 @@ class Cache(object):
         # A map from Image object to CacheEntry.
         self.cache = { }
 
-        # A list of Image objects that we want to preload.
+        # The cache entries, from least to most recently used.
+        self.lru = LRU()
+
+        # A heap of (priority, serial, image) tuples, giving the Image
+        # objects that we want to preload. Images with a lower priority
+        # are loaded first, and images with the same priority in the order
+        # they were requested.
         self.preloads = [ ]
 
+        # The serial number of the next image to be preloaded.
+        self.preload_serial = 0
+
+        # A map from image to the thread that is loading it. Other threads
+        # wait for that thread to finish, rather than loading it again.
+        self.loading = { }
+
         # False if this is not the first preload in this tick.
         self.first_preload_in_tick = True
 
         # The total size of the current generation of images.
         self.size_of_current_generation = 0
 
-        # The total size of everything in the cache.
+        # The total size of the surfaces in the cache, in bytes.
         self.total_cache_size = 0
 
+        # The total size of the textures loaded from images in the cache,
+        # in bytes.
+        self.total_texture_size = 0
+
         # A lock that must be held when updating the cache.
         self.lock = threading.Condition()
 
@@ -91,13 +166,20 @@ class Cache(object):
         # Images that we tried, and failed, to preload.
         self.preload_blacklist = set()
 
-        # The size of the cache, in pixels.
+        # The size of the cache, in bytes of surfaces.
         self.cache_limit = 0
 
-        # The preload thread.
-        self.preload_thread = threading.Thread(target=self.preload_thread_main, name="preloader")
-        self.preload_thread.setDaemon(True)
-        self.preload_thread.start()
+        # The size of the cache, in bytes of textures.
+        self.texture_limit = 0
+
+        # A lock that must be held when a preload thread loads a texture.
+        self.texture_lock = threading.Lock()
+
+        # The preload threads. The first preload thread also preloads
+        # pinned images. More threads are started by init.
+        self.preload_threads = [ ]
+
+        self.preload_thread = self.start_preload_thread()
 
         # Have we been added this tick?
         self.added = set()
@@ -118,7 +200,36 @@ class Cache(object):
         by the game-maker.
         """
 
-        self.cache_limit = renpy.config.image_cache_size * renpy.config.screen_width * renpy.config.screen_height
+        if renpy.config.image_cache_size_mb is not None:
+            self.cache_limit = int(renpy.config.image_cache_size_mb * 1024 * 1024)
+        else:
+            self.cache_limit = 4 * renpy.config.image_cache_size * renpy.config.screen_width * renpy.config.screen_height
+
+        if renpy.config.image_cache_texture_size_mb is not None:
+            self.texture_limit = int(renpy.config.image_cache_texture_size_mb * 1024 * 1024)
+        else:
+            self.texture_limit = self.cache_limit
+
+        threads = renpy.config.image_preload_threads
+
+        if threads is None:
+            threads = min(max(cpu_count() - 1, 1), 4)
+
+        while self.keep_preloading and len(self.preload_threads) < threads:
+            self.start_preload_thread()
+
+    def start_preload_thread(self):
+        """
+        Starts a preload thread, and returns it.
+        """
+
+        t = threading.Thread(target=self.preload_thread_main, name="preloader")
+        t.setDaemon(True)
+
+        self.preload_threads.append(t)
+        t.start()
+
+        return t
 
     def quit(self): #@ReservedAssignment
         if not self.preload_thread.isAlive():
@@ -126,9 +237,10 @@ class Cache(object):
 
         with self.preload_lock:
             self.keep_preloading = False
-            self.preload_lock.notify()
+            self.preload_lock.notifyAll()
 
-        self.preload_thread.join()
+        for t in self.preload_threads:
+            t.join()
 
         self.clear()
 
@@ -141,9 +253,11 @@ class Cache(object):
         self.preloads = [ ]
         self.pin_cache = { }
         self.cache = { }
+        self.lru = LRU()
         self.first_preload_in_tick = True
         self.size_of_current_generation = 0
         self.total_cache_size = 0
+        self.total_texture_size = 0
 
         self.added.clear()
 
@@ -156,6 +270,7 @@ class Cache(object):
         with self.lock:
             self.time += 1
             self.preloads = [ ]
+            self.preload_serial = 0
             self.first_preload_in_tick = True
             self.size_of_current_generation = 0
             self.added.clear()
@@ -174,7 +289,9 @@ class Cache(object):
     # This returns the pygame surface corresponding to the provided
     # image. It also takes care of updating the age of images in the
     # cache to be current, and maintaining the size of the current
-    # generation of images.
+    # generation of images. If texture is true, a texture will be
+    # loaded from the surface, and is counted against the texture
+    # budget.
     def get(self, image, predict=False, texture=False):
 
         if not isinstance(image, ImageBase):
@@ -189,6 +306,9 @@ class Cache(object):
         ce = self.cache.get(image, None)
 
         # Otherwise, we load the image ourselves.
+        if ce is None:
+            ce = self.claim(image)
+
         if ce is None:
 
             try:
@@ -197,45 +317,122 @@ class Cache(object):
                 else:
                     if not predict:
                         with renpy.game.ExceptionInfo("While loading %r:", image):
-                            surf = image.load()
+                            surf = self.load(image)
                     else:
-                        surf = image.load()
+                        surf = self.load(image)
 
             except:
+                with self.lock:
+                    self.loading.pop(image, None)
+                    self.lock.notifyAll()
+
                 raise
 
             with self.lock:
 
-                ce = CacheEntry(image, surf)
+                self.loading.pop(image, None)
+                self.lock.notifyAll()
+
+                # Another thread may have loaded the image while we were.
+                old = self.cache.get(image, None)
+
+                if old is not None:
+                    ce = old
+
+                else:
+                    ce = CacheEntry(image, surf)
+                    ce.time = self.time
 
-                if image not in self.cache:
                     self.total_cache_size += ce.size
+                    self.size_of_current_generation += ce.size
 
-                self.cache[image] = ce
+                    self.cache[image] = ce
+                    self.lru.append(ce)
 
-                # Indicate that this surface had changed.
-                renpy.display.render.mutated_surface(ce.surf)
+                    # Indicate that this surface had changed.
+                    renpy.display.render.mutated_surface(ce.surf)
 
-                if renpy.config.debug_image_cache:
-                    if predict:
-                        renpy.display.ic_log.write("Added %r (%.02f%%)", ce.what, 100.0 * self.total_cache_size / self.cache_limit)
-                    else:
-                        renpy.display.ic_log.write("Total Miss %r", ce.what)
+                    if renpy.config.debug_image_cache:
+                        if predict:
+                            renpy.display.ic_log.write("Added %r (%.02f%%)", ce.what, 100.0 * self.total_cache_size / self.cache_limit)
+                        else:
+                            renpy.display.ic_log.write("Total Miss %r", ce.what)
+
+        # Move it into the current generation, and to the end of the
+        # LRU list. This only takes the lock the first time an entry is
+        # used in a generation.
+        if (ce.time != self.time) or (texture and not ce.texture_size):
+
+            with self.lock:
+
+                # Skip entries that have been killed by another thread.
+                if ce.prev is not None:
 
+                    if ce.time != self.time:
+                        ce.time = self.time
+                        self.size_of_current_generation += ce.size
 
-        # Move it into the current generation. This isn't protected by
-        # a lock, so in certain circumstances we could have an
-        # inaccurate size - but that will be cured at the end of the
-        # current generation.
+                        self.lru.remove(ce)
+                        self.lru.append(ce)
 
-        if ce.time != self.time:
-            ce.time = self.time
-            self.size_of_current_generation += ce.size
+                    if texture and not ce.texture_size:
+                        w, h = ce.surf.get_size()
+                        ce.texture_size = w * h * 4
+                        self.total_texture_size += ce.texture_size
 
         # Done... return the surface.
         return ce.surf
 
 
+    def load(self, image):
+        """
+        Loads `image`, from the disk cache if it's been stored there. If
+        not, the loaded image is offered to the disk cache.
+        """
+
+        key = renpy.display.diskcache.key(image)
+
+        if key is None:
+            return optimize(image).load()
+
+        surf = renpy.display.diskcache.load(key)
+
+        if surf is not None:
+
+            if renpy.config.debug_image_cache:
+                renpy.display.ic_log.write("Disk cache %r", image)
+
+            return surf
+
+        start = time.time()
+        surf = optimize(image).load()
+
+        renpy.display.diskcache.save(key, surf, time.time() - start)
+
+        return surf
+
+    def claim(self, image):
+        """
+        Called before this thread loads `image`. If another thread is loading
+        the image, waits for it to finish. Returns the cache entry for the
+        image if it's now in the cache, or None if this thread should load
+        it.
+        """
+
+        me = threading.current_thread()
+
+        with self.lock:
+
+            while self.loading.get(image, me) is not me:
+                self.lock.wait()
+
+            ce = self.cache.get(image, None)
+
+            if ce is None:
+                self.loading[image] = me
+
+            return ce
+
     # This kills off a given cache entry.
     def kill(self, ce):
 
@@ -247,6 +444,9 @@ class Cache(object):
         renpy.display.draw.mutated_surface(ce.surf)
 
         self.total_cache_size -= ce.size
+        self.total_texture_size -= ce.texture_size
+
+        self.lru.remove(ce)
         del self.cache[ce.what]
 
         if renpy.config.debug_image_cache:
@@ -259,14 +459,16 @@ class Cache(object):
         bigger and we don't want to continue preloading.
         """
 
-        # If we're within the limit, return.
-        if self.total_cache_size <= self.cache_limit:
-            return True
-
         # If we're outside the cache limit, we need to go and start
-        # killing off some of the entries until we're back inside it.
+        # killing off the least recently used entries until we're back
+        # inside it.
 
-        for ce in sorted(self.cache.itervalues(), key=lambda a : a.time):
+        while (self.total_cache_size > self.cache_limit) or (self.total_texture_size > self.texture_limit):
+
+            ce = self.lru.oldest()
+
+            if ce is None:
+                break
 
             if ce.time == self.time:
                 # If we're bigger than the limit, and there's nothing
@@ -276,10 +478,6 @@ class Cache(object):
             # Otherwise, kill off the given cache entry.
             self.kill(ce)
 
-            # If we're in the limit, we're done.
-            if self.total_cache_size <= self.cache_limit:
-                break
-
         return True
 
     def preload_texture(self, im):
@@ -288,11 +486,14 @@ class Cache(object):
         into the GPU.
         """
 
-        surf = self.get(im, predict=True)
-        renpy.display.draw.load_texture(surf)
+        surf = self.get(im, predict=True, texture=True)
+
+        with self.texture_lock:
+            renpy.display.draw.load_texture(surf)
 
     # Called to report that a given image would like to be preloaded.
-    def preload_image(self, im):
+    # Images with a lower priority are preloaded first.
+    def preload_image(self, im, priority=0):
 
         if not isinstance(im, ImageBase):
             return
@@ -308,7 +509,8 @@ class Cache(object):
                 self.preload_texture(im)
                 in_cache = True
             else:
-                self.preloads.append(im)
+                heapq.heappush(self.preloads, (priority, self.preload_serial, im))
+                self.preload_serial += 1
                 in_cache = False
 
         if not in_cache:
@@ -347,28 +549,37 @@ class Cache(object):
                     if not self.cleanout():
 
                         if renpy.config.debug_image_cache:
-                            for i in self.preloads:
+                            for _priority, _serial, i in sorted(self.preloads):
                                 renpy.display.ic_log.write("Overfull %r", i)
 
                         self.preloads = [ ]
 
                         break
 
-                try:
-                    image = self.preloads.pop(0)
+                    # The preloads are cleared by tick, so check again.
+                    if not self.preloads:
+                        break
 
-                    if image not in self.preload_blacklist:
-                        try:
-                            self.preload_texture(image)
-                        except:
-                            self.preload_blacklist.add(image)
-                except:
-                    pass
+                    _priority, _serial, image = heapq.heappop(self.preloads)
+
+                    # Another thread is loading the image.
+                    if image in self.loading:
+                        continue
+
+                if image not in self.preload_blacklist:
+                    try:
+                        self.preload_texture(image)
+                    except:
+                        self.preload_blacklist.add(image)
 
             with self.lock:
                 self.cleanout()
 
-            # If we have time, preload pinned images.
+            # If we have time, preload pinned images. Only the first preload
+            # thread does this.
+            if threading.current_thread() is not self.preload_thread:
+                continue
+
             if self.keep_preloading and not renpy.game.less_memory:
 
                 workset = set(renpy.store._cache_pin_set)
@@ -398,7 +609,9 @@ class Cache(object):
                     try:
                         surf = image.load()
                         self.pin_cache[image] = surf
-                        renpy.display.draw.load_texture(surf)
+
+                        with self.texture_lock:
+                            renpy.display.draw.load_texture(surf)
                     except:
                         self.preload_blacklist.add(image)
 
@@ -407,7 +620,7 @@ class Cache(object):
         if not renpy.config.developer:
             return
 
-        preload = (threading.current_thread() is self.preload_thread)
+        preload = (threading.current_thread() in self.preload_threads)
 
         self.load_log.insert(0, (time.time(), filename, preload))
 
@@ -416,6 +629,17 @@ class Cache(object):
 
 
 
+def cpu_count():
+    """
+    Returns the number of processors, or 1 if that can't be determined.
+    """
+
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except:
+        return 1
+
 # The cache object.
 cache = Cache()
 
@@ -475,7 +699,7 @@ class ImageBase(renpy.display.core.Displayable):
 
     def render(self, w, h, st, at):
 
-        im = cache.get(self)
+        im = cache.get(self, texture=True)
         texture = renpy.display.draw.load_texture(im)
 
         w, h = im.get_size()
@@ -554,20 +778,30 @@ class Image(ImageBase):
             return [ self.filename ]
 
 class ZipFileImage(ImageBase):
+    """
+    An image loaded from `filename` inside the zip file `zipfilename`. If
+    `data` is given, it's the contents of that file, and the zip file isn't
+    opened.
+    """
 
-    def __init__(self, zipfilename, filename, mtime=0, **properties):
+    def __init__(self, zipfilename, filename, mtime=0, data=None, **properties):
         super(ZipFileImage, self).__init__(zipfilename, filename, mtime, **properties)
 
         self.zipfilename = zipfilename
         self.filename = filename
+        self.data = data
 
     def load(self):
         try:
-            zf = zipfile.ZipFile(self.zipfilename, 'r')
-            data = zf.read(self.filename)
+            data = self.data
+
+            if data is None:
+                zf = zipfile.ZipFile(self.zipfilename, 'r')
+                data = zf.read(self.filename)
+                zf.close()
+
             sio = cStringIO.StringIO(data)
             rv = renpy.display.pgrender.load_image(sio, self.filename)
-            zf.close()
             return rv
         except:
             return renpy.display.pgrender.surface((2, 2), True)
@@ -1587,6 +1821,206 @@ def image(arg, loose=False, **properties):
         raise Exception("Could not construct image from argument.")
 
 
+################################################################################
+# Optimization of image manipulator trees.
+
+# The image manipulators that change each pixel without looking at the
+# pixels around it. Each has its child in the image field, and as the
+# second element of its identity.
+COLOR_OPS = ( Map, Recolor, Twocolor, MatrixColor )
+
+def replace_image(im, child):
+    """
+    Returns a copy of `im`, a color operation, that operates on `child`.
+    """
+
+    rv = copy.copy(im)
+    rv.image = child
+    rv.identity = im.identity[:1] + (child,) + im.identity[2:]
+
+    return rv
+
+def linmap_lut(mul):
+    """
+    Returns a lookup table that does what renpy.display.module.linmap does
+    to a channel with `mul`.
+    """
+
+    mul = int(mul)
+    return "".join(chr((i * mul >> 8) & 255) for i in range(256))
+
+def color_luts(im):
+    """
+    Returns a tuple of red, green, blue, and alpha lookup tables that do
+    what the color operation `im` does, or None if `im` can't be done
+    with lookup tables.
+    """
+
+    if type(im) is Map:
+        rv = (im.rmap, im.gmap, im.bmap, im.amap)
+
+        for i in rv:
+            if not isinstance(i, str) or len(i) != 256:
+                return None
+
+        return rv
+
+    elif type(im) is Recolor:
+        return tuple(linmap_lut(i) for i in (im.rmul, im.gmul, im.bmul, im.amul))
+
+    elif type(im) is Twocolor:
+        white = im.white
+        black = im.black
+
+        # This follows renpy.display.module.twomap.
+        if black[0] == 0 and black[1] == 0 and black[2] == 0:
+            return tuple(linmap_lut(i + 1) for i in white[:4])
+
+        return (
+            ramp(black[0], white[0]),
+            ramp(black[1], white[1]),
+            ramp(black[2], white[2]),
+            ramp(0, white[3]),
+            )
+
+    return None
+
+def color_matrix(im):
+    """
+    Returns an im.matrix that does what the color operation `im` does,
+    or None if `im` can't be done with a matrix.
+    """
+
+    if type(im) is MatrixColor:
+        return matrix(im.matrix)
+
+    elif type(im) is Recolor:
+        return matrix(im.rmul / 256.0, 0, 0, 0, 0,
+                      0, im.gmul / 256.0, 0, 0, 0,
+                      0, 0, im.bmul / 256.0, 0, 0,
+                      0, 0, 0, im.amul / 256.0, 0)
+
+    elif type(im) is Twocolor:
+        wr, wg, wb, wa = im.white[:4]
+        br, bg, bb = im.black[:3]
+
+        return matrix((wr - br) / 255.0, 0, 0, 0, br / 255.0,
+                      0, (wg - bg) / 255.0, 0, 0, bg / 255.0,
+                      0, 0, (wb - bb) / 255.0, 0, bb / 255.0,
+                      0, 0, 0, wa / 255.0, 0)
+
+    return None
+
+def matrix_in_range(m):
+    """
+    Returns true if the im.matrix `m` maps every color with components
+    between 0.0 and 1.0 to a color with components in that range. When
+    this is true, the matrix can be multiplied with the one applied after
+    it, as the result is never clamped in between.
+    """
+
+    for row in range(0, 4):
+        coefficients = m[row * 5:row * 5 + 4]
+        offset = m[row * 5 + 4]
+
+        low = offset + sum(i for i in coefficients if i < 0)
+        high = offset + sum(i for i in coefficients if i > 0)
+
+        if low < -0.0001 or high > 1.0001:
+            return False
+
+    return True
+
+def fuse(im):
+    """
+    Given `im`, a color operation applied to the result of a second color
+    operation, returns a single color operation that does what both do,
+    or None if they can't be combined.
+    """
+
+    inner = im.image
+
+    outer_luts = color_luts(im)
+    inner_luts = color_luts(inner)
+
+    if outer_luts is not None and inner_luts is not None:
+        luts = [ "".join(o[ord(c)] for c in i) for o, i in zip(outer_luts, inner_luts) ]
+        return Map(inner.image, *luts)
+
+    outer_matrix = color_matrix(im)
+    inner_matrix = color_matrix(inner)
+
+    if outer_matrix is not None and inner_matrix is not None and matrix_in_range(inner_matrix):
+        return MatrixColor(inner.image, inner_matrix * outer_matrix)
+
+    return None
+
+def optimize_step(im):
+    """
+    Returns an image manipulator that is a simpler version of `im`, or None
+    if `im` can't be simplified.
+    """
+
+    t = type(im)
+
+    # Crop before changing colors, so fewer pixels are changed.
+    if t is Crop and type(im.image) in COLOR_OPS:
+
+        chain = [ ]
+        child = im.image
+
+        while type(child) in COLOR_OPS:
+            chain.append(child)
+            child = child.image
+
+        rv = Crop(child, im.x, im.y, im.w, im.h)
+
+        for i in reversed(chain):
+            rv = replace_image(i, rv)
+
+        return rv
+
+    # Combine chains of color operations into one operation.
+    if t in COLOR_OPS and type(im.image) in COLOR_OPS:
+        return fuse(im)
+
+    # Scale once, rather than twice. This is only done when the second
+    # scale doesn't enlarge the image, as scaling an image down and then
+    # back up is used to blur or pixelate it.
+    if t is Scale and type(im.image) is Scale and im.image.bilinear == im.bilinear:
+        if im.width <= im.image.width and im.height <= im.image.height:
+            return Scale(im.image.image, im.width, im.height, im.bilinear)
+
+    if t is FactorScale and type(im.image) is Scale and im.image.bilinear == im.bilinear:
+        width = int(im.image.width * im.width)
+        height = int(im.image.height * im.height)
+
+        if width <= im.image.width and height <= im.image.height:
+            return Scale(im.image.image, width, height, im.bilinear)
+
+    return None
+
+def optimize(im):
+    """
+    Returns an image manipulator that produces nearly the same image as
+    `im`, but makes fewer passes over the pixels and allocates fewer
+    intermediate surfaces. The children of the result
+    are loaded through the cache, and so are optimized when they're
+    loaded.
+    """
+
+    if not renpy.config.optimize_image_manipulators:
+        return im
+
+    while True:
+        rv = optimize_step(im)
+
+        if rv is None:
+            return im
+
+        im = rv
+
+
 def load_image(im):
     """
     :doc: udd_utility
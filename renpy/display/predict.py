@@ -34,6 +34,11 @@ predicted = set()
 # A flag that indicates if we're currently predicting.
 predicting = False
 
+# The priority given to images that are preloaded. Images with a lower
+# priority are loaded first. This is set by Context.predict for each
+# statement that is predicted.
+priority = 0
+
 # A list of (screen name, argument dict) tuples, giving the screens we'd
 # like to predict.
 screens = [ ]
@@ -59,6 +64,14 @@ def screen(_screen_name, *args, **kwargs):
     screens.append((_screen_name, args, kwargs))
 
 
+def preload(im):
+    """
+    Preloads `im` with the current priority.
+    """
+
+    renpy.display.im.cache.preload_image(im, priority)
+
+
 def reset():
     global image
     image = renpy.display.im.cache.get
@@ -91,7 +104,10 @@ def prediction_coroutine(root_widget):
 
     # Set up the image prediction method.
     global image
-    image = renpy.display.im.cache.preload_image
+    global priority
+
+    image = preload
+    priority = 0
 
     predicting = True
 
@@ -113,6 +129,10 @@ def prediction_coroutine(root_widget):
         yield True
         predicting = True
 
+    # Everything predicted from here on is about to be needed, so it
+    # shouldn't have the priority of the last statement.
+    priority = 0
+
     # If there's a parent context, predict we'll be returning to it
     # shortly. Otherwise, call the functions in
     # config.predict_callbacks.
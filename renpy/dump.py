@@ -113,6 +113,8 @@ def dump(error):
     # Labels.
     label = location["label"] = { }
 
+    renpy.game.script.load_all_lazy()
+
     for name, n in renpy.game.script.namemap.iteritems():
         filename = n.filename
         line = n.linenumber
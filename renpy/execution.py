@@ -22,6 +22,7 @@
 # This file contains code responsible for managing the execution of a
 # renpy object, as well as the context object.
 
+import heapq
 import sys
 import time
 
@@ -71,6 +72,30 @@ class PredictInfo(renpy.object.Object):
     Not used anymore, but needed for backwards compatibility.
     """
 
+def predict_weights(node, successors):
+    """
+    Returns a list giving the probability that each of `successors` will
+    be executed after `node`, taking config.predict_weights_callback into
+    account.
+    """
+
+    weights = node.predict_weights(successors)
+
+    if renpy.config.predict_weights_callback is not None:
+        rv = renpy.config.predict_weights_callback(node.filename, node.linenumber, list(weights))
+
+        # A list that doesn't have a weight for each successor is ignored.
+        if (rv is not None) and (len(rv) == len(successors)):
+            weights = rv
+
+    total = float(sum(weights))
+
+    if total <= 0:
+        return [ 0.0 ] * len(successors)
+
+    return [ i / total for i in weights ]
+
+
 class Context(renpy.object.Object):
     """
     This is the context object which stores the current context
@@ -573,6 +598,12 @@ class Context(renpy.object.Object):
         Performs image prediction, calling the given callback with each
         images that we predict to be loaded, in the rough order that
         they will be potentially loaded.
+
+        Statements are predicted in order of their priority, which is the
+        number of statements between the current statement and them,
+        divided by the likelihood they will be reached. While a statement
+        is being predicted, renpy.display.predict.priority is set to its
+        priority.
         """
 
         if not self.current:
@@ -583,7 +614,8 @@ class Context(renpy.object.Object):
 
         old_images = self.images
 
-        # A worklist of (node, images, return_stack) tuples.
+        # A heap of (priority, serial, node, images, return_stack, depth,
+        # likelihood) tuples.
         nodes = [ ]
 
         # The set of nodes we've seen. (We only consider each node once.)
@@ -600,28 +632,43 @@ class Context(renpy.object.Object):
             if node in seen:
                 continue
 
-            nodes.append((node, self.images, self.return_stack))
+            nodes.append((0.0, len(nodes), node, self.images, self.return_stack, 0, 1.0))
             seen.add(node)
 
+        serial = len(nodes)
+
         # Predict statements.
-        for i in range(0, renpy.config.predict_statements):
+        for _i in range(0, renpy.config.predict_statements):
 
-            if i >= len(nodes):
+            if not nodes:
                 break
 
-            node, images, return_stack = nodes[i]
+            priority, _serial, node, images, return_stack, depth, likelihood = heapq.heappop(nodes)
 
             self.images = renpy.display.image.ShownImageInfo(images)
             self.predict_return_stack = return_stack
 
+            renpy.display.predict.priority = priority
+
             try:
 
-                for n in node.predict():
+                successors = node.predict()
+                weights = predict_weights(node, successors)
+
+                for n, weight in zip(successors, weights):
                     if n is None:
                         continue
 
+                    if weight <= 0:
+                        continue
+
                     if n not in seen:
-                        nodes.append((n, self.images, self.predict_return_stack))
+                        n_likelihood = likelihood * weight
+                        n_priority = (depth + 1) / n_likelihood
+
+                        heapq.heappush(nodes, (n_priority, serial, n, self.images, self.predict_return_stack, depth + 1, n_likelihood))
+                        serial += 1
+
                         seen.add(n)
 
             except:
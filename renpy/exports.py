@@ -90,7 +90,7 @@ import renpy.audio.music as music
 from renpy.statements import register as register_statement
 from renpy.text.extras import check_text_tags
 
-from renpy.memory import profile_memory, diff_memory, profile_rollback
+from renpy.memory import profile_memory, diff_memory, profile_rollback, get_rollback_size
 
 from renpy.text.textsupport import TAG as TEXT_TAG, TEXT as TEXT_TEXT, PARAGRAPH as TEXT_PARAGRAPH, DISPLAYABLE as TEXT_DISPLAYABLE
 
@@ -153,7 +153,7 @@ def public_api():
     image_exists, has_image
     get_available_image_tags, get_available_image_attributes
     load_image, load_surface
-    profile_memory, diff_memory, profile_rollback
+    profile_memory, diff_memory, profile_rollback, get_rollback_size
     TEXT_TAG
     TEXT_TEXT
     TEXT_PARAGRAPH
@@ -1448,6 +1448,8 @@ def get_all_labels():
         if isinstance(i, basestring):
             rv.append(i)
 
+    rv.extend(renpy.game.script.lazy_labels)
+
     return renpy.python.RevertableSet(rv)
 
 
@@ -1493,6 +1495,12 @@ def utter_restart():
     raise renpy.game.UtterRestartException()
 
 
+# Extensions of files that can be reloaded without reloading the script.
+asset_reload_extensions = (
+    ".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tga",
+    ".ogg", ".opus", ".mp3", ".mp2", ".wav", ".flac",
+    )
+
 def reload_script():
     """
     :doc: other
@@ -1504,6 +1512,33 @@ def reload_script():
     renpy.game.call_in_new_context("_save_reload_game")
 
 
+def autoreload_script():
+    """
+    :undocumented:
+
+    Called when autoreload has seen files change. If the only changes were
+    to existing image and audio files, discards the images that have been
+    loaded and restarts the current interaction, which is much faster than
+    reloading the script. Otherwise, reloads the script.
+
+    Files that are created, deleted, or renamed need the full reload, so
+    that the images defined at init time and the list of files are
+    rebuilt.
+    """
+
+    changed = renpy.loader.get_changed_files()
+
+    def asset_modified(fn, existed, exists):
+        return existed and exists and fn.lower().endswith(asset_reload_extensions)
+
+    if changed and all(asset_modified(*i) for i in changed):
+        free_memory()
+        restart_interaction()
+        return
+
+    reload_script()
+
+
 def quit(relaunch=False, status=0): #@ReservedAssignment
     """
     :doc: other
@@ -0,0 +1,134 @@
+# Copyright 2004-2015 Tom Rothamel <pytom@bishoujo.us>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# This contains a binding to Linux's inotify, through ctypes. It's used by
+# autoreload to watch the game directory, and by the save locations to
+# watch the save directories.
+
+import os
+import sys
+import errno
+import struct
+
+import renpy
+
+# Constants from sys/inotify.h.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# The header of an inotify event - wd, mask, cookie, and name length.
+EVENT = struct.Struct("iIII")
+
+# The C library, or None if it hasn't been loaded yet.
+libc = None
+
+
+class Inotify(object):
+    """
+    An inotify file descriptor, which can be passed to select. This raises
+    an exception if inotify isn't available.
+    """
+
+    def __init__(self):
+        global libc
+
+        if not renpy.linux and not renpy.android:
+            raise Exception("inotify is only supported on Linux.")
+
+        if libc is None:
+            import ctypes
+            import ctypes.util
+
+            lib = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+            lib.inotify_add_watch.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+            lib.inotify_add_watch.restype = ctypes.c_int
+
+            libc = lib
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+        if self.fd < 0:
+            raise OSError("inotify_init1 failed.")
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, directory, mask):
+        """
+        Watches `directory` for the events in `mask`. Returns the watch
+        descriptor, or a negative number if the directory can't be watched.
+        """
+
+        if isinstance(directory, unicode):
+            directory = directory.encode(sys.getfilesystemencoding() or "utf-8")
+
+        return libc.inotify_add_watch(self.fd, directory, mask)
+
+    def read(self):
+        """
+        Reads the pending events, without blocking. Returns a list of (wd,
+        mask, name) tuples, where name is a byte string that is empty if
+        the event is about the watched directory itself.
+        """
+
+        rv = [ ]
+
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+
+            if not data:
+                break
+
+            pos = 0
+
+            while pos + EVENT.size <= len(data):
+                wd, mask, _cookie, length = EVENT.unpack_from(data, pos)
+                pos += EVENT.size
+
+                name = data[pos:pos + length].rstrip("\0")
+                pos += length
+
+                rv.append((wd, mask, name))
+
+        return rv
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -21,12 +21,16 @@
 
 import renpy
 import os.path
-from pickle import loads
+from cPickle import loads, dumps
 from cStringIO import StringIO
 import sys
 import types
 import threading
+import time
 import zlib
+import mmap
+import select
+import struct
 
 # Ensure the utf-8 codec is loaded, to prevent recursion when we use it
 # to look up filenames.
@@ -95,23 +99,84 @@ old_config_archives = None
 # A map from lower-case filename to regular-case filename.
 lower_map = { }
 
+# A map from archive prefix to a read-only memory map of that archive. This
+# is only filled in if config.mmap_archives is True.
+archive_maps = { }
+
+# The value of renpy.config.mmap_archives the last time index_archives was
+# run.
+old_config_mmap_archives = None
+
+def map_archive(prefix, fn):
+    """
+    Memory-maps the archive file `fn`, and stores the map in archive_maps
+    under `prefix`. If the map can't be created, files are loaded from
+    the archive using SubFile, as usual.
+    """
+
+    try:
+        with open(fn, "rb") as f:
+            archive_maps[prefix] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except:
+        archive_maps.pop(prefix, None)
+
 def index_archives():
     """
     Loads in the indexes for the archive files. Also updates the lower_map.
     """
 
+    if (old_config_archives == renpy.config.archives) and (old_config_mmap_archives == renpy.config.mmap_archives):
+        return
+
+    with renpy.startup.span("index archives"):
+        index_archives_core()
+
+# The flag given to zlib-compressed entries in an RPA-4.0 index.
+RPA4_ZLIB = 1
+
+def read_rpa4_index(data, key):
+    """
+    Decodes the binary index of an RPA-4.0 archive, returning an index in
+    the same form as the other archive formats. Entries that are stored
+    compressed have "zlib" as a fourth element of their tuple.
+    """
+
+    index = { }
+
+    count, = struct.unpack_from("<I", data, 0)
+    pos = 4
+
+    for _i in range(count):
+        namelen, flags, offset, dlen = struct.unpack_from("<HHQQ", data, pos)
+        pos += 20
+
+        name = data[pos:pos + namelen].decode("utf-8")
+        pos += namelen
+
+        if flags & RPA4_ZLIB:
+            index[name] = [ (offset ^ key, dlen ^ key, "", "zlib") ]
+        else:
+            index[name] = [ (offset ^ key, dlen ^ key, "") ]
+
+    return index
+
+def index_archives_core():
+
     # Index the archives.
 
     global old_config_archives
-
-    if old_config_archives == renpy.config.archives:
-        return
+    global old_config_mmap_archives
 
     old_config_archives = renpy.config.archives[:]
+    old_config_mmap_archives = renpy.config.mmap_archives
 
     # Update lower_map.
     lower_map.clear()
 
+    # Maps are closed when the last file using them is closed, so we just
+    # drop our references here.
+    archive_maps.clear()
+
     cleardirfiles()
 
     global archives
@@ -124,6 +189,19 @@ def index_archives():
             f = file(fn, "rb")
             l = f.readline()
 
+            # 4.0 Branch.
+            if l.startswith("RPA-4.0 "):
+                offset = int(l[8:24], 16)
+                length = int(l[25:41], 16)
+                key = int(l[42:50], 16)
+                f.seek(offset)
+                index = read_rpa4_index(f.read(length).decode("zlib"), key)
+
+                archives.append((prefix, index))
+
+                f.close()
+                continue
+
             # 3.0 Branch.
             if l.startswith("RPA-3.0 "):
                 offset = int(l[8:24], 16)
@@ -163,20 +241,130 @@ def index_archives():
         except:
             raise
 
+    if renpy.config.mmap_archives:
+        for prefix, _index in archives:
+            map_archive(prefix, transfn(prefix + ".rpa"))
+
     for dir, fn in listdirfiles(): #@ReservedAssignment
         lower_map[fn.lower()] = fn
 
-def walkdir(dir): #@ReservedAssignment
+# The file the results of scanning directories are stored in.
+SCAN_CACHE = "cache/scandir.rpyb"
+
+# The version of the scan cache.
+SCAN_CACHE_VERSION = 1
+
+# A map from directory name to an (mtime, entries) tuple, where entries is a
+# list of (name, isdir) pairs, as loaded from the scan cache. None if the
+# scan cache hasn't been loaded.
+old_scan = None
+
+# The time the scan in old_scan was made.
+old_scan_time = 0
+
+# Like old_scan, but for the directories scanned by this process.
+new_scan = { }
+
+def load_scan_cache():
+    """
+    Loads the scan cache, if it hasn't been loaded yet.
+    """
+
+    global old_scan
+    global old_scan_time
+
+    if old_scan is not None:
+        return
+
+    old_scan = { }
+
+    try:
+        with open(get_path(SCAN_CACHE), "rb") as f:
+            version, scan_time, scan = loads(zlib.decompress(f.read()))
+
+        if version == SCAN_CACHE_VERSION:
+            old_scan = scan
+            old_scan_time = scan_time
+
+    except:
+        pass
+
+def save_scan_cache():
+    """
+    Saves the scan cache, if it's changed.
+    """
+
+    global old_scan
+    global old_scan_time
+
+    if new_scan == old_scan:
+        return
+
+    scan_time = time.time()
+
+    try:
+        fn = get_path(SCAN_CACHE)
+
+        with open(fn + ".new", "wb") as f:
+            f.write(zlib.compress(dumps((SCAN_CACHE_VERSION, scan_time, new_scan), 2), 3))
+
+        if os.path.exists(fn):
+            os.unlink(fn)
+
+        os.rename(fn + ".new", fn)
+
+    except:
+        pass
+
+    old_scan = dict(new_scan)
+    old_scan_time = scan_time
+
+def listdir(dn):
+    """
+    Returns a list of (name, isdir) pairs for the entries in the directory
+    `dn`, skipping hidden files. If the mtime of the directory hasn't changed
+    since it was last scanned, the stored result is used.
+    """
+
+    mtime = os.path.getmtime(dn)
+
+    entry = old_scan.get(dn, None)
+
+    # The mtime is only trusted if it's well before the scan, as the
+    # filesystem might not have the resolution to see a later change.
+    if (entry is not None) and (entry[0] == mtime) and (mtime < old_scan_time - 2):
+        entries = entry[1]
+
+    else:
+        entries = [ ]
+
+        for i in os.listdir(dn):
+            if i[0] == ".":
+                continue
+
+            entries.append((i, os.path.isdir(dn + "/" + i)))
+
+    new_scan[dn] = (mtime, entries)
+
+    return entries
+
+def walkdir(dir, skip=()): #@ReservedAssignment
+    """
+    Returns a list of the files in `dir` and its subdirectories, except for
+    the subdirectories of `dir` named in `skip`.
+    """
+
     rv = [ ]
 
     if not os.path.exists(dir) and not renpy.config.developer:
         return rv
 
-    for i in os.listdir(dir):
-        if i[0] == ".":
-            continue
+    for i, isdir in listdir(dir):
+
+        if isdir:
+            if i in skip:
+                continue
 
-        if os.path.isdir(dir + "/" + i):
             for fn in walkdir(dir + "/" + i):
                 rv.append(i + "/" + fn)
         else:
@@ -202,15 +390,23 @@ def cleardirfiles():
     game_files = [ ]
     common_files = [ ]
 
+    resolve_cache.clear()
+    prefix_cache.clear()
+
 def scandirfiles():
     """
     Scans directories, archives, and apks and fills out game_files and
-    common_files.
+    common_files. This also fills resolve_cache with the location of each
+    file found.
     """
 
     seen = set()
 
-    def add(dn, fn):
+    # If autoreload is enabled, disk files are resolved by transfn, so it
+    # can watch the paths it checks.
+    prefill_disk = not (renpy.autoreload or renpy.config.force_archives)
+
+    def add(dn, fn, source):
         if fn in seen:
             return
 
@@ -224,6 +420,9 @@ def scandirfiles():
 
         seen.add(fn)
 
+        if source is not None:
+            resolve_cache[fn] = source
+
     for apk in apks:
 
         if apk not in game_apks:
@@ -231,13 +430,16 @@ def scandirfiles():
         else:
             files = game_files # @UnusedVariable
 
-        for f in apk.list():
+        for prefixed_name in apk.list():
 
             # Strip off the "x-" in front of each filename, which is there
             # to ensure that aapt actually includes every file.
-            f = "/".join(i[2:] for i in f.split("/"))
+            f = "/".join(i[2:] for i in prefixed_name.split("/"))
 
-            add(None, f)
+            add(None, f, ("apk", apk, prefixed_name))
+
+    load_scan_cache()
+    new_scan.clear()
 
     for i in renpy.config.searchpath:
 
@@ -247,14 +449,21 @@ def scandirfiles():
             files = game_files # @UnusedVariable
 
         i = os.path.join(renpy.config.basedir, i)
-        for j in walkdir(i):
-            add(i, j)
+        # The files in cache/ and saves/ are not added, so there's no point
+        # in scanning them.
+        for j in walkdir(i, ("cache", "saves")):
+            if prefill_disk:
+                add(i, j, ("disk", os.path.join(i, j)))
+            else:
+                add(i, j, None)
+
+    save_scan_cache()
 
     files = game_files
 
-    for _prefix, index in archives:
+    for prefix, index in archives:
         for j in index.iterkeys():
-            add(None, j)
+            add(None, j, ("archive", prefix, index))
 
 
 
@@ -425,6 +634,101 @@ class SubFile(object):
     def write(self, s):
         raise Exception("Write not supported by SubFile")
 
+
+class MMapSubFile(SubFile):
+    """
+    A SubFile that reads its data out of a memory-mapped archive, rather
+    than an open file. Reads are slices of the map, and so do not need
+    to make system calls.
+    """
+
+    def __init__(self, fn, data, base, length, start):
+        SubFile.__init__(self, fn, base, length, start)
+
+        # The memory map containing the archive.
+        self.data = data
+
+    def open(self):
+        return
+
+    def read(self, length=None):
+
+        maxlength = self.length - self.offset
+
+        if length is not None:
+            length = min(length, maxlength)
+        else:
+            length = maxlength
+
+        rv1 = self.start[self.offset:self.offset + length]
+        length -= len(rv1)
+        self.offset += len(rv1)
+
+        if length:
+            pos = self.base + self.offset - len(self.start)
+            rv2 = self.data[pos:pos + length]
+            self.offset += len(rv2)
+        else:
+            rv2 = ""
+
+        if rv1:
+            return rv1 + rv2
+        else:
+            return rv2
+
+    def readline(self, length=None):
+
+        # If we're in the start, let SubFile read the line a byte at a time.
+        if self.offset < len(self.start):
+            return SubFile.readline(self, length)
+
+        maxlength = self.length - self.offset
+
+        if length is not None:
+            length = min(length, maxlength)
+        else:
+            length = maxlength
+
+        pos = self.base + self.offset - len(self.start)
+        end = pos + length
+
+        newline = self.data.find("\n", pos, end)
+        if newline != -1:
+            end = newline + 1
+
+        rv = self.data[pos:end]
+        self.offset += len(rv)
+
+        return rv
+
+    def seek(self, offset, whence=0):
+
+        if whence == 1:
+            offset = self.offset + offset
+        elif whence == 2:
+            offset = self.length + offset
+
+        if offset > self.length:
+            offset = self.length
+
+        self.offset = offset
+
+    def close(self):
+        self.data = None
+
+    def get_buffer(self):
+        """
+        Returns a read-only buffer containing the rest of the file, without
+        copying it out of the memory map. Returns None if the file has
+        an unmapped start that hasn't been read yet.
+        """
+
+        if self.offset < len(self.start):
+            return None
+
+        pos = self.base + self.offset - len(self.start)
+        return buffer(self.data, pos, self.length - self.offset)
+
 open_file = open
 
 if "RENPY_FORCE_SUBFILE" in os.environ:
@@ -437,70 +741,228 @@ if "RENPY_FORCE_SUBFILE" in os.environ:
 
         return SubFile(f, 0, length, '')
 
-def load_core(name):
+################################################################ File Resolution
+
+# A map from a filename (with lower_map applied) to the place that file can
+# be loaded from. The values are:
+#
+# ("apk", apk, prefixed_name) for a file in an apk.
+# ("disk", fn) for a file on disk.
+# ("archive", prefix, index) for a file in an archive.
+# None for a file that can't be found.
+#
+# Entries are removed by invalidate_name when autoreload sees a file
+# created, changed, or removed.
+resolve_cache = { }
+
+# A map from (language, name) to the first prefixed name under which `name`
+# can be loaded, or None if it can't be loaded under any prefix.
+prefix_cache = { }
+
+# The value of config.search_prefixes when prefix_cache was filled.
+old_search_prefixes = None
+
+def cacheable(name):
     """
-    Returns an open python file object of the given type.
+    Returns true if where `name` can be found may be cached. Files in
+    cache/ and saves/ are written while the game runs, so they're always
+    looked for.
     """
 
-    name = lower_map.get(name.lower(), name)
+    return not (name.startswith("cache/") or name.startswith("saves/"))
 
-    if renpy.config.file_open_callback:
-        rv = renpy.config.file_open_callback(name)
-        if rv is not None:
-            return rv
+def resolve_core(name):
+    """
+    Finds where `name` can be loaded from, without using the cache.
+    """
 
     # Look for the file in the apk.
     for apk in apks:
         prefixed_name = "/".join("x-" + i for i in name.split("/"))
 
-        try:
-            return apk.open(prefixed_name)
-        except IOError:
-            pass
+        if prefixed_name in apk.info:
+            return ("apk", apk, prefixed_name)
 
     # Look for the file directly.
     if not renpy.config.force_archives:
         try:
-            fn = transfn(name)
-            return open_file(fn, "rb")
+            return ("disk", transfn(name))
         except:
             pass
 
     # Look for it in archive files.
     for prefix, index in archives:
-        if not name in index:
+        if name in index:
+            return ("archive", prefix, index)
+
+    return None
+
+def resolve(name):
+    """
+    Returns a tuple giving the place `name` can be loaded from, or None if it
+    can't be found. lower_map must already have been applied to `name`.
+    """
+
+    if name in resolve_cache:
+        return resolve_cache[name]
+
+    rv = resolve_core(name)
+
+    if cacheable(name):
+        resolve_cache[name] = rv
+
+    return rv
+
+def find_prefixed(name):
+    """
+    Returns the first of the names formed by adding each of the prefixes
+    returned by get_prefixes to `name` that is loadable, or None if none
+    of them are.
+    """
+
+    global old_search_prefixes
+
+    if old_search_prefixes != renpy.config.search_prefixes:
+        prefix_cache.clear()
+        old_search_prefixes = list(renpy.config.search_prefixes)
+
+    key = (renpy.game.preferences.language, name)
+
+    if key in prefix_cache:
+        return prefix_cache[key]
+
+    rv = None
+
+    for p in get_prefixes():
+        if loadable_core(p + name):
+            rv = p + name
+            break
+
+    if cacheable(name):
+        prefix_cache[key] = rv
+
+    return rv
+
+def invalidate_name(name):
+    """
+    Forgets where `name` was found, so it will be looked for again the
+    next time it's loaded.
+    """
+
+    resolve_cache.pop(name, None)
+    prefix_cache.clear()
+
+def invalidate(fn):
+    """
+    Called when the file at the path `fn`, which is in one of the searchpath
+    directories, has been created, changed, or removed.
+    """
+
+    for d in renpy.config.searchpath:
+        dn = os.path.join(renpy.config.basedir, d)
+
+        if not fn.startswith(dn):
             continue
 
-        afn = transfn(prefix + ".rpa")
+        name = fn[len(dn):].replace("\\", "/")
 
-        data = [ ]
+        if not name.startswith("/"):
+            continue
 
-        # Direct path.
-        if len(index[name]) == 1:
+        invalidate_name(name[1:])
+        hash_cache.pop(name[1:], None)
 
-            t = index[name][0]
-            if len(t) == 2:
-                offset, dlen = t
-                start = ''
-            else:
-                offset, dlen, start = t
 
+def load_archive(prefix, index, name):
+    """
+    Returns a file-like object for `name`, which must be in the archive
+    with `prefix` and `index`.
+    """
+
+    afn = transfn(prefix + ".rpa")
+
+    data = [ ]
+
+    # Direct path.
+    if len(index[name]) == 1:
+
+        t = index[name][0]
+        codec = None
+
+        if len(t) == 2:
+            offset, dlen = t
+            start = ''
+        elif len(t) == 3:
+            offset, dlen, start = t
+        else:
+            offset, dlen, start, codec = t
+
+        amap = archive_maps.get(prefix, None)
+
+        if amap is not None:
+            rv = MMapSubFile(afn, amap, offset, dlen, start)
+        else:
             rv = SubFile(afn, offset, dlen, start)
 
-        # Compatibility path.
+        # Compressed entries are decompressed into memory.
+        if codec == "zlib":
+            data = rv.read()
+            rv.close()
+            rv = StringIO(zlib.decompress(data))
+
+    # Compatibility path.
+    else:
+        f = file(afn, "rb")
+
+        for offset, dlen in index[name]:
+            f.seek(offset)
+            data.append(f.read(dlen))
+
+        rv = StringIO(''.join(data))
+        f.close()
+
+    return rv
+
+def load_core(name, retry=True):
+    """
+    Returns an open python file object of the given type.
+    """
+
+    name = lower_map.get(name.lower(), name)
+
+    if renpy.config.file_open_callback:
+        rv = renpy.config.file_open_callback(name)
+        if rv is not None:
+            return rv
+
+    source = resolve(name)
+
+    if source is None:
+        return None
+
+    kind = source[0]
+
+    try:
+
+        if kind == "apk":
+            return source[1].open(source[2])
+
+        elif kind == "disk":
+            return open_file(source[1], "rb")
+
         else:
-            f = file(afn, "rb")
+            return load_archive(source[1], source[2], name)
 
-            for offset, dlen in index[name]:
-                f.seek(offset)
-                data.append(f.read(dlen))
+    except IOError:
 
-            rv = StringIO(''.join(data))
-            f.close()
+        # The file went away after it was resolved. Forget where it was, and
+        # look for it again, as it may still be in an archive.
+        invalidate_name(name)
 
-        return rv
+        if retry:
+            return load_core(name, retry=False)
 
-    return None
+        return None
 
 def get_prefixes():
     """
@@ -525,15 +987,35 @@ def load(name):
     if renpy.config.reject_backslash and "\\" in name:
         raise Exception("Backslash in filename, use '/' instead: %r" % name)
 
-    for p in get_prefixes():
-        rv = load_core(p + name)
+    # The file open callback can supply files we don't know about, so
+    # it needs to be offered each prefix in turn.
+    if renpy.config.file_open_callback:
+        names = [ p + name for p in get_prefixes() ]
+    else:
+        fn = find_prefixed(name)
+
+        if fn is not None:
+            names = [ fn ]
+        else:
+            names = [ ]
+
+    for fn in names:
+        rv = load_core(fn)
         if rv is not None:
             return rv
 
-    raise IOError("Couldn't find file '%s'." % name)
+    # The file may have vanished from under the prefix it was found
+    # with, while still being available under another.
+    if names and not renpy.config.file_open_callback:
+        fn = find_prefixed(name)
+
+        if (fn is not None) and (fn not in names):
+            rv = load_core(fn)
+            if rv is not None:
+                return rv
 
+    raise IOError("Couldn't find file '%s'." % name)
 
-loadable_cache = { }
 
 def loadable_core(name):
     """
@@ -541,37 +1023,10 @@ def loadable_core(name):
     """
 
     name = lower_map.get(name.lower(), name)
-
-    if name in loadable_cache:
-        return loadable_cache[name]
-
-    for apk in apks:
-        prefixed_name = "/".join("x-" + i for i in name.split("/"))
-        if prefixed_name in apk.info:
-            return True
-
-    try:
-        transfn(name)
-        loadable_cache[name] = True
-        return True
-    except:
-        pass
-
-    for _prefix, index in archives:
-        if name in index:
-            loadable_cache[name] = True
-            return True
-
-    loadable_cache[name] = False
-    return False
+    return resolve(name) is not None
 
 def loadable(name):
-
-    for p in get_prefixes():
-        if loadable_core(p + name):
-            return True
-
-    return False
+    return find_prefixed(name) is not None
 
 
 def transfn(name):
@@ -712,9 +1167,16 @@ needs_autoreload = False
 # A map from filename to mtime, or None if the file doesn't exist.
 auto_mtimes = { }
 
+# The set of files autoreload has seen change since get_changed_files was
+# last called.
+auto_changed = set()
+
 # The thread used for autoreload.
 auto_thread = None
 
+# The watcher used by auto_thread.
+auto_watcher = None
+
 # True if auto_thread should run. False if it should quit.
 auto_quit_flag = True
 
@@ -757,6 +1219,187 @@ def add_auto(fn, force=False):
     with auto_lock:
         auto_mtimes[fn] = mtime
 
+        if auto_watcher is not None:
+            auto_watcher.watch(fn)
+
+
+class PollWatcher(object):
+    """
+    Watches files by checking the mtime of every watched file every 1.5
+    seconds. This works on every platform.
+    """
+
+    def watch(self, fn):
+        return
+
+    def wait(self):
+        """
+        Blocks until files may have changed, or wake is called. Returns a
+        list of files that may have changed.
+
+        This is called without auto_lock being held.
+        """
+
+        with auto_lock:
+            auto_lock.wait(1.5)
+            return auto_mtimes.keys()
+
+    def wake(self):
+        with auto_lock:
+            auto_lock.notify_all()
+
+    def close(self):
+        return
+
+
+from renpy.inotify import (IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_FROM,
+    IN_MOVED_TO, IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW,
+    IN_IGNORED)
+
+INOTIFY_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+
+class InotifyWatcher(object):
+    """
+    Watches files using Linux's inotify, by watching the directories that
+    contain them. Files in directories that can't be watched (generally,
+    because they don't exist yet) are polled.
+    """
+
+    def __init__(self):
+
+        self.inotify = renpy.inotify.Inotify()
+        self.fd = self.inotify.fd
+
+        # Used to wake the thread when we're quitting.
+        self.wake_read, self.wake_write = os.pipe()
+
+        # A map from watch descriptor to the directory being watched.
+        self.directories = { }
+
+        # The set of directories being watched.
+        self.watched = set()
+
+        # Files in directories we couldn't watch, which are polled. The
+        # directories are watched once they exist.
+        self.polled = set()
+
+    def watch(self, fn):
+        """
+        Watches the directory containing `fn`, or polls `fn` if that isn't
+        possible. This must be called with auto_lock held.
+        """
+
+        dn = os.path.dirname(fn)
+
+        if dn in self.watched:
+            self.polled.discard(fn)
+            return
+
+        wd = self.inotify.add_watch(dn, INOTIFY_MASK)
+
+        if wd < 0:
+            self.polled.add(fn)
+            return
+
+        self.polled.discard(fn)
+
+        self.directories[wd] = dn
+        self.watched.add(dn)
+
+    def read_events(self):
+        """
+        Reads the pending events, and returns a list of the files that may
+        have changed.
+        """
+
+        rv = [ ]
+
+        for wd, mask, name in self.inotify.read():
+
+            # We've lost events, so everything needs to be checked.
+            if mask & IN_Q_OVERFLOW:
+                with auto_lock:
+                    return auto_mtimes.keys()
+
+            dn = self.directories.get(wd, None)
+
+            if dn is None:
+                continue
+
+            # The directory was deleted, and the watch removed. Poll the
+            # files in it until it's created again.
+            if mask & (IN_DELETE_SELF | IN_IGNORED):
+
+                with auto_lock:
+                    del self.directories[wd]
+                    self.watched.discard(dn)
+
+                    files = [ i for i in auto_mtimes if os.path.dirname(i) == dn and auto_mtimes[i] is not auto_blacklisted ]
+                    self.polled.update(files)
+
+                rv.extend(files)
+                continue
+
+            # Something happened to the directory itself.
+            if not name:
+                with auto_lock:
+                    rv.extend(i for i in auto_mtimes if os.path.dirname(i) == dn)
+
+                continue
+
+            if isinstance(dn, unicode):
+                name = name.decode(sys.getfilesystemencoding() or "utf-8", "replace")
+
+            rv.append(os.path.join(dn, name))
+
+        return rv
+
+    def wait(self):
+
+        try:
+            ready = select.select([ self.fd, self.wake_read ], [ ], [ ], 1.5)[0]
+        except select.error:
+            ready = [ ]
+
+        rv = [ ]
+
+        if self.fd in ready:
+            rv.extend(self.read_events())
+
+        with auto_lock:
+            rv.extend(self.polled)
+
+            # Watch the directories that have been created.
+            for fn in list(self.polled):
+                if os.path.isdir(os.path.dirname(fn)):
+                    self.watch(fn)
+
+        return rv
+
+    def wake(self):
+        os.write(self.wake_write, "x")
+
+    def close(self):
+        self.inotify.close()
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+
+
+def make_watcher():
+    """
+    Returns the best watcher for this platform.
+    """
+
+    if renpy.linux and ("RENPY_AUTORELOAD_POLL" not in os.environ):
+        try:
+            return InotifyWatcher()
+        except:
+            pass
+
+    return PollWatcher()
+
 def auto_thread_function():
     """
     This thread sets need_autoreload when necessary.
@@ -766,16 +1409,15 @@ def auto_thread_function():
 
     while True:
 
-        with auto_lock:
-
-            auto_lock.wait(1.5)
+        candidates = auto_watcher.wait()
 
-            if auto_quit_flag:
-                return
+        if auto_quit_flag:
+            return
 
-            items = auto_mtimes.items()
+        for fn in candidates:
 
-        for fn, mtime in items:
+            with auto_lock:
+                mtime = auto_mtimes.get(fn, auto_blacklisted)
 
             if mtime is auto_blacklisted:
                 continue
@@ -785,6 +1427,33 @@ def auto_thread_function():
                 with auto_lock:
                     if auto_mtime(fn) != auto_mtimes[fn]:
                         needs_autoreload = True
+                        auto_changed.add(fn)
+                        invalidate(fn)
+
+def get_changed_files():
+    """
+    Returns a list of (filename, existed, exists) tuples, giving the files
+    autoreload has seen change since the last time this was called, and
+    clears that list. `existed` is true if the file existed before the
+    change, and `exists` is true if it exists now. The current mtimes of
+    those files are recorded, so they're only reported again if they change
+    again.
+    """
+
+    rv = [ ]
+
+    with auto_lock:
+
+        for fn in auto_changed:
+            old = auto_mtimes[fn]
+            new = auto_mtime(fn)
+
+            auto_mtimes[fn] = new
+            rv.append((fn, old is not None, new is not None))
+
+        auto_changed.clear()
+
+    return rv
 
 def auto_init():
     """
@@ -792,6 +1461,7 @@ def auto_init():
     """
 
     global auto_thread
+    global auto_watcher
     global auto_quit_flag
     global needs_autoreload
 
@@ -802,6 +1472,13 @@ def auto_init():
 
     auto_quit_flag = False
 
+    with auto_lock:
+        auto_watcher = make_watcher()
+
+        for fn, mtime in auto_mtimes.items():
+            if mtime is not auto_blacklisted:
+                auto_watcher.watch(fn)
+
     auto_thread = threading.Thread(target=auto_thread_function)
     auto_thread.daemon = True
     auto_thread.start()
@@ -811,13 +1488,17 @@ def auto_quit():
     Terminates the autoreload thread.
     """
     global auto_quit_flag
+    global auto_thread
+    global auto_watcher
 
     if auto_thread is None:
         return
 
     auto_quit_flag = True
 
-    with auto_lock:
-        auto_lock.notify_all()
-
+    auto_watcher.wake()
     auto_thread.join()
+    auto_thread = None
+
+    auto_watcher.close()
+    auto_watcher = None
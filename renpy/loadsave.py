@@ -32,6 +32,7 @@ import threading
 import types
 import shutil
 import os
+import sys
 
 import renpy
 
@@ -207,20 +208,22 @@ class SaveRecord(object):
 
         self.first_filename = None
 
-    def write_file(self, filename):
+        # The contents of the save file, once it has been compressed.
+        self.data = None
+
+    def get_data(self):
         """
-        This writes a standard-format savefile to `filename`.
+        Returns the contents of a standard-format savefile. The file is
+        compressed the first time this is called, so that it can be done
+        before the disk lock is taken.
         """
 
-        filename_new = filename + ".new"
+        if self.data is not None:
+            return self.data
 
-        # For speed, copy the file after we've written it at least once.
-        if self.first_filename is not None:
-            shutil.copyfile(self.first_filename, filename_new)
-            safe_rename(filename_new, filename)
-            return
+        f = StringIO()
 
-        zf = zipfile.ZipFile(filename_new, "w", zipfile.ZIP_DEFLATED)
+        zf = zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED)
 
         # Screenshot.
         zf.writestr("screenshot.png", self.screenshot)
@@ -239,16 +242,137 @@ class SaveRecord(object):
 
         zf.close()
 
+        self.data = f.getvalue()
+
+        return self.data
+
+    def write_file(self, filename):
+        """
+        This writes a standard-format savefile to `filename`.
+        """
+
+        filename_new = filename + ".new"
+
+        # For speed, copy the file after we've written it at least once.
+        if self.first_filename is not None:
+            shutil.copyfile(self.first_filename, filename_new)
+            safe_rename(filename_new, filename)
+            return
+
+        data = self.get_data()
+
+        with open(filename_new, "wb") as f:
+            f.write(data)
+
         safe_rename(filename_new, filename)
 
         self.first_filename = filename
 
 
 
-def save(slotname, extra_info='', mutate_flag=False):
+class SaveJob(object):
+    """
+    A save of the game to a slot. The game state is frozen and snapshotted
+    by capture(), which must be called on the thread running the game, and
+    pickled, compressed, and written to disk by write(), which may be
+    called from another thread.
+    """
+
+    def __init__(self, slotname, extra_info, mutate_flag, callback):
+        self.slotname = slotname
+        self.extra_info = extra_info
+        self.mutate_flag = mutate_flag
+        self.callback = callback
+
+        # The roots and the copy of the log returned by capture.
+        self.roots = None
+        self.log = None
+
+        # The SaveSnapshot that keeps the revertable objects as they were
+        # when the game was captured.
+        self.snapshot = None
+
+        self.screenshot = renpy.game.interface.get_screenshot()
+
+        json = { "_save_name" : extra_info }
+
+        for i in renpy.config.save_json_callbacks:
+            i(json)
+
+        self.json = json_dumps(json)
+
+    def capture(self):
+        """
+        Freezes the game state, and takes a snapshot of it that write() can
+        pickle while the game continues to run. Raises SaveAbort if
+        mutate_flag was given and the game was changed while this was
+        running.
+        """
+
+        if self.mutate_flag:
+            renpy.python.mutate_flag = False
+
+        self.snapshot = renpy.python.save_snapshot = renpy.python.SaveSnapshot()
+
+        try:
+
+            roots = renpy.game.log.freeze(None)
+
+            if renpy.config.save_dump:
+                save_dump(roots, renpy.game.log)
+
+            log = renpy.game.log.save_copy()
+
+            if self.mutate_flag and renpy.python.mutate_flag:
+                raise SaveAbort()
+
+        except:
+            self.end_snapshot()
+            raise
+
+        self.roots = roots
+        self.log = log
+
+    def end_snapshot(self):
+        """
+        Stops the snapshot from recording changes to the game.
+        """
+
+        if renpy.python.save_snapshot is self.snapshot:
+            renpy.python.save_snapshot = None
+
+        self.snapshot = None
+
+    def write(self):
+        """
+        Pickles the captured game state, compresses it, and writes it to
+        the slot.
+        """
+
+        try:
+            self.snapshot.claim()
+
+            logf = StringIO()
+            dump((self.roots, self.log), logf)
+
+        finally:
+            self.end_snapshot()
+            self.roots = None
+            self.log = None
+
+        sr = SaveRecord(self.screenshot, self.extra_info, self.json, logf.getvalue())
+        sr.get_data()
+
+        location.save(self.slotname, sr)
+
+        location.scan()
+        clear_slot(self.slotname)
+
+
+def save(slotname, extra_info='', mutate_flag=False, background=False, callback=None):
     """
     :doc: loadsave
-    :args: (filename, extra_info='')
+    :args: (filename, extra_info='', background=False, callback=None)
 
     Saves the game state to a save slot.
 
@@ -260,37 +384,124 @@ def save(slotname, extra_info='', mutate_flag=False):
         An additional string that should be saved to the save file. Usually,
         this is the value of :var:`save_name`.
 
+    `background`
+        If true, the game state is captured, and this function returns
+        while the save is pickled, compressed, and written to disk by a
+        background thread.
+
+    `callback`
+        If not None, a function that is called with the slot name and
+        None when the save completes, or the slot name and an exception if
+        it fails. For a background save, this is called from the thread
+        running the game, shortly after the save finishes.
+
     :func:`renpy.take_screenshot` should be called before this function.
     """
 
-    if mutate_flag:
-        renpy.python.mutate_flag = False
+    if background:
+        save_in_background(SaveJob(slotname, extra_info, False, callback))
+        return
+
+    # Only one save at a time can take a snapshot. (An autosave, which
+    # passes mutate_flag, is already running.)
+    if not mutate_flag:
+        autosave_not_running.wait()
+        background_save_not_running.wait()
+
+    job = SaveJob(slotname, extra_info, mutate_flag, callback)
+
+    try:
+        job.capture()
+        job.write()
+    except Exception, e:
+        if callback is not None:
+            callback(slotname, e)
+
+        raise
+
+    if callback is not None:
+        callback(slotname, None)
+
+
+# Set when a background save is not running.
+background_save_not_running = threading.Event()
+background_save_not_running.set()
+
+# A list of (job, exc_info) pairs for background saves that have finished,
+# but haven't been reported by report_background_saves. exc_info is None if
+# the save succeeded.
+finished_saves = [ ]
+
+def background_save_thread(job):
+
+    try:
+
+        try:
+            job.write()
+            finished_saves.append((job, None))
+        except Exception:
+            finished_saves.append((job, sys.exc_info()))
+
+    finally:
+        background_save_not_running.set()
+
+def save_in_background(job):
+    """
+    Captures the game state for `job` and starts a thread that pickles and
+    writes it.
+    """
+
+    # Only one save at a time can take a snapshot.
+    autosave_not_running.wait()
+    background_save_not_running.wait()
 
-    roots = renpy.game.log.freeze(None)
+    try:
+        job.capture()
+    except Exception, e:
+        if job.callback is not None:
+            job.callback(job.slotname, e)
 
-    if renpy.config.save_dump:
-        save_dump(roots, renpy.game.log)
+        raise
 
-    logf = StringIO()
-    dump((roots, renpy.game.log), logf)
+    background_save_not_running.clear()
 
-    if mutate_flag and renpy.python.mutate_flag:
-        raise SaveAbort()
+    t = threading.Thread(target=background_save_thread, args=(job,))
+    t.daemon = True
+    t.start()
 
-    screenshot = renpy.game.interface.get_screenshot()
+def report_save_error(exc_info):
+    """
+    Reports the error from a background save to the player, the same way
+    an error from a save in the foreground would be reported.
+    """
+
+    try:
+        raise exc_info[0], exc_info[1], exc_info[2]
+    except Exception, e:
+        short, full, traceback_fn = renpy.error.report_exception(e, editor=False)
 
-    json = { "_save_name" : extra_info }
+        if renpy.display.error.report_exception(short, full, traceback_fn):
+            raise
 
-    for i in renpy.config.save_json_callbacks:
-        i(json)
+def report_background_saves():
+    """
+    Called periodically on the thread running the game. This calls the
+    callbacks of background saves that have finished, and restarts the
+    interaction so the new save is displayed.
+    """
 
-    json = json_dumps(json)
+    while finished_saves:
+        job, exc_info = finished_saves.pop(0)
 
-    sr = SaveRecord(screenshot, extra_info, json, logf.getvalue())
-    location.save(slotname, sr)
+        renpy.exports.restart_interaction()
 
-    location.scan()
-    clear_slot(slotname)
+        if job.callback is not None:
+            job.callback(job.slotname, exc_info[1] if exc_info is not None else None)
+
+        # Without a callback, report the error the way a save in the
+        # foreground would.
+        elif exc_info is not None:
+            report_save_error(exc_info)
 
 
 
@@ -357,6 +568,30 @@ def autosave():
     force_autosave(True)
 
 
+# The number of objects marked each time mark_idle is called.
+IDLE_MARK_BUDGET = 2000
+
+def mark_idle():
+    """
+    Called when the interaction is idle. In the game menu, where a save is
+    likely, this spreads the walk that finds the objects reachable from the
+    game state over idle frames, so the save doesn't need to do it. Returns
+    True if there is more marking to be done.
+    """
+
+    if len(renpy.game.contexts) < 2:
+        return False
+
+    if renpy.store.main_menu:
+        return False
+
+    # Saves running in other threads use the log.
+    if not (autosave_not_running.isSet() and background_save_not_running.isSet()):
+        return False
+
+    return renpy.game.log.mark_reachable(IDLE_MARK_BUDGET)
+
+
 # This assumes a screenshot has already been taken.
 def force_autosave(take_screenshot=False):
     """
@@ -374,6 +609,10 @@ def force_autosave(take_screenshot=False):
     if not autosave_not_running.isSet():
         return
 
+    # A background save is running.
+    if not background_save_not_running.isSet():
+        return
+
     # Do not save if we're in the main menu.
     if renpy.store.main_menu:
         return
@@ -437,12 +676,7 @@ def list_saved_games(regexp=r'.', fast=False):
     """
 
     # A list of save slots.
-    slots = location.list()
-
-    if regexp is not None:
-        slots = [ i for i in slots if re.match(regexp, i) ]
-
-    slots.sort()
+    slots = matching_slots(regexp)
 
     if fast:
         return slots
@@ -477,7 +711,26 @@ def list_slots(regexp=None):
     string-order.
     """
 
-    # A list of save slots.
+    return matching_slots(regexp)
+
+# A map from regexp to a (changes, slots) tuple, where slots is the sorted
+# list of slots matching regexp when the location's change counter was
+# changes.
+slot_list_cache = { }
+
+def matching_slots(regexp):
+    """
+    Returns a sorted list of the slots matching `regexp`. The list is
+    cached until the save location changes.
+    """
+
+    changes = getattr(location, "changes", None)
+
+    cached = slot_list_cache.get(regexp, None)
+
+    if (changes is not None) and (cached is not None) and (cached[0] == changes):
+        return list(cached[1])
+
     slots = location.list()
 
     if regexp is not None:
@@ -485,7 +738,9 @@ def list_slots(regexp=None):
 
     slots.sort()
 
-    return slots
+    slot_list_cache[regexp] = (changes, slots)
+
+    return list(slots)
 
 # A cache for newest slot info.
 newest_slot_cache = { }
@@ -576,6 +831,8 @@ def load(filename):
     successfully, this function never returns.
     """
 
+    background_save_not_running.wait()
+
     roots, log = loads(location.load(filename))
     log.unfreeze(roots, label="_after_load")
 
@@ -586,6 +843,8 @@ def unlink_save(filename):
     Deletes the save slot with the given name.
     """
 
+    background_save_not_running.wait()
+
     location.unlink(filename)
     clear_slot(filename)
 
@@ -598,6 +857,8 @@ def rename_save(old, new):
     exist.)
     """
 
+    background_save_not_running.wait()
+
     location.rename(old, new)
 
     clear_slot(old)
@@ -611,6 +872,8 @@ def copy_save(old, new):
     exist.)
     """
 
+    background_save_not_running.wait()
+
     location.copy(old, new)
     clear_slot(new)
 
@@ -716,6 +979,7 @@ def clear_cache():
         c.clear()
 
     newest_slot_cache.clear()
+    slot_list_cache.clear()
 
     renpy.exports.restart_interaction()
 
@@ -41,6 +41,8 @@ def log_clock(s):
     if renpy.android and not renpy.config.log_to_stdout:
         print s
 
+    renpy.startup.phase(s, last_clock, now)
+
     last_clock = now
 
 def reset_clock():
@@ -235,6 +237,8 @@ def choose_variants():
 
 def main():
 
+    renpy.startup.init()
+
     log_clock("Bootstrap to the start of init.init")
 
     renpy.game.exception_info = 'Before loading the script.'
@@ -398,8 +402,9 @@ def main():
 
         renpy.game.exception_info = 'While executing init code:'
 
-        for _prio, node in game.script.initcode:
-            game.context().run(node)
+        for prio, node in game.script.initcode:
+            with renpy.startup.span("init", priority=prio, file=node.filename, line=node.linenumber):
+                game.context().run(node)
 
         renpy.game.exception_info = 'After initialization, but before game start.'
 
@@ -414,7 +419,7 @@ def main():
             renpy.scriptedit.lines.clear()
 
         for i in renpy.game.persistent._seen_translates:
-            if i in renpy.game.script.translator.default_translates:
+            if (i in renpy.game.script.translator.default_translates) or (i in renpy.game.script.translator.lazy_identifiers):
                 renpy.game.seen_translates_count += 1
 
         log_clock("Running init code")
@@ -482,11 +487,15 @@ def main():
                 # Give Ren'Py a couple of seconds to finish saving.
                 renpy.loadsave.autosave_not_running.wait(3.0)
 
+                # Saves the player asked for are always finished.
+                renpy.loadsave.background_save_not_running.wait()
+
     finally:
 
         renpy.loader.auto_quit()
         renpy.savelocation.quit()
         renpy.translation.write_updated_strings()
+        renpy.startup.write()
 
     # This is stuff we do on a normal, non-error return.
     if not renpy.display.error.error_handled:
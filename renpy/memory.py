@@ -315,9 +315,27 @@ def profile_rollback():
 
     write("")
     write("{} Rollback objects exist.".format(len(log)))
+    write("{:,d} bytes are used by the rollback log (estimated).".format(renpy.game.log.get_size()))
     write("")
 
 
+def get_rollback_size():
+    """
+    :doc: memory
+
+    Returns a tuple giving the number of statements in the rollback log,
+    and an estimate of the number of bytes of memory used by the rollback
+    log. The estimate counts the copies the rollback log makes of changed
+    lists, dicts, sets, and objects, but not the objects those copies refer
+    to. This is the estimate that :var:`config.rollback_size` is compared
+    against.
+    """
+
+    log = renpy.game.log
+
+    return len(log.log), log.get_size()
+
+
 ################################################################################
 # Legacy memory debug functions
 ################################################################################
@@ -22,18 +22,182 @@
 import os
 import copy
 import time
+import zlib
+import struct
+import threading
+import Queue
 
 import renpy
 
 from renpy.loadsave import dump, loads
 from cPickle import dumps
 
+
+class TrackedDict(dict):
+    """
+    A dict that notes when it has been changed, so that find_changes
+    doesn't need to keep a copy of it. This is pickled as a plain dict.
+    """
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.reset()
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def reset(self):
+        """
+        Called when the changes to this dict have been found.
+        """
+
+        self.changed = False
+
+        # The keys that have been added or changed since the last reset,
+        # or None if the dict has been changed in some other way, and
+        # has to be journaled in full.
+        self.updated = set()
+
+    def note_update(self, key):
+        self.changed = True
+
+        if self.updated is not None:
+            self.updated.add(key)
+
+    def note_change(self):
+        self.changed = True
+        self.updated = None
+
+    def __setitem__(self, key, value):
+        if (key not in self) or (dict.__getitem__(self, key) != value):
+            self.note_update(key)
+
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.note_change()
+
+    def clear(self):
+        if self:
+            self.note_change()
+
+        dict.clear(self)
+
+    def update(self, *args, **kwargs):
+        self.note_change()
+        dict.update(self, *args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.note_update(key)
+
+        return dict.setdefault(self, key, default)
+
+    def pop(self, key, *args):
+        if key in self:
+            self.note_change()
+
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        rv = dict.popitem(self)
+        self.note_change()
+        return rv
+
+
+def tracked_set_method(name):
+    """
+    Returns a TrackedSet method that calls the set method `name`, and
+    marks the set as changed.
+    """
+
+    method = getattr(set, name)
+
+    def do_mutation(self, *args):
+        self.note_change()
+        return method(self, *args)
+
+    do_mutation.__name__ = name
+
+    return do_mutation
+
+
+class TrackedSet(set):
+    """
+    A set that notes when it has been changed, so that find_changes
+    doesn't need to keep a copy of it. This is pickled as a plain set.
+    """
+
+    def __init__(self, *args):
+        set.__init__(self, *args)
+        self.reset()
+
+    def __reduce__(self):
+        return (set, (list(self),))
+
+    def reset(self):
+        """
+        Called when the changes to this set have been found.
+        """
+
+        self.changed = False
+
+        # The items that have been added since the last reset, or None
+        # if the set has been changed in some other way.
+        self.updated = set()
+
+    def note_change(self):
+        self.changed = True
+        self.updated = None
+
+    def add(self, item):
+        if item not in self:
+            self.changed = True
+
+            if self.updated is not None:
+                self.updated.add(item)
+
+            set.add(self, item)
+
+    for _name in [ "clear", "discard", "pop", "remove", "update",
+                   "difference_update", "intersection_update",
+                   "symmetric_difference_update", "__ior__", "__iand__",
+                   "__isub__", "__ixor__" ]:
+
+        locals()[_name] = tracked_set_method(_name)
+
+    del _name
+
+
+# A map from the name of a field to the type that's used to track changes
+# to it.
+tracked_fields = {
+    "_seen_ever" : TrackedDict,
+    "_seen_images" : TrackedDict,
+    "_chosen" : TrackedDict,
+    "_seen_audio" : TrackedDict,
+    "_seen_translates" : TrackedSet,
+    }
+
+
 # The class that's used to hold the persistent data.
 class Persistent(object):
 
     def __init__(self):
         self._update()
 
+    def __setattr__(self, attr, value):
+
+        # Replace the containers of tracked fields with versions that
+        # track changes.
+        tracked_type = tracked_fields.get(attr, None)
+
+        if (tracked_type is not None) and (value is not None) and (type(value) is not tracked_type):
+            value = tracked_type(value)
+
+        self.__dict__[attr] = value
+
     def __setstate__(self, data):
         self.__dict__.update(data)
 
@@ -102,6 +266,10 @@ class Persistent(object):
         if self._changed is None:
             self._changed = { }
 
+        # Ensure the tracked fields are tracked.
+        for f in tracked_fields:
+            setattr(self, f, getattr(self, f))
+
 
 renpy.game.Persistent = Persistent
 renpy.game.persistent = Persistent()
@@ -132,11 +300,33 @@ def safe_deepcopy(o):
 # object.
 backup = { }
 
+# A map from field names to the tracked container that was in that field
+# when it was last backed up. These fields are not copied into backup.
+tracked = { }
+
+def backup_field(f, value):
+    """
+    Backs up `value`, the value of field `f`.
+    """
+
+    if isinstance(value, (TrackedDict, TrackedSet)):
+        value.reset()
+        tracked[f] = value
+        backup.pop(f, None)
+    else:
+        tracked.pop(f, None)
+        backup[f] = safe_deepcopy(value)
+
+# A list of (time, field, kind, value) tuples, giving the changes found by
+# find_changes that have not been written to the journal yet. Kind is one
+# of "set", "update", or "add", as described in replay.
+journal = [ ]
+
 def find_changes():
     """
     This finds changes in the persistent object. When it finds a change, it
-    backs up that changed, and puts the current time for that field into
-    persistent._changed.
+    backs up that changed, puts the current time for that field into
+    persistent._changed, and adds the change to the journal.
 
     This returns True if there was at least one change, and False
     otherwise.
@@ -149,31 +339,170 @@ def find_changes():
     persistent = renpy.game.persistent
     pvars = vars(persistent)
 
-    fields = set(backup.keys()) | set(pvars.keys())
+    fields = set(backup.keys()) | set(tracked.keys()) | set(pvars.keys())
 
     for f in fields:
 
         if f == "_changed":
             continue
 
-        old = backup.get(f, None)
         new = pvars.get(f, None)
 
-        if not (new == old):
+        # Tracked containers know if they've been changed, and which
+        # entries have been added.
+        if (new is not None) and (tracked.get(f, None) is new):
+            if new.changed:
+
+                if new.updated is None:
+                    journal.append((now, f, "set", new))
+                elif isinstance(new, TrackedDict):
+                    journal.append((now, f, "update", dict((k, new[k]) for k in new.updated)))
+                else:
+                    journal.append((now, f, "add", list(new.updated)))
+
+                new.reset()
+                persistent._changed[f] = now
+                rv = True
+
+            continue
+
+        # A tracked container that's been replaced has changed.
+        replaced = f in tracked
+        old = backup.get(f, None)
+
+        if replaced or not (new == old):
 
             persistent._changed[f] = now
-            backup[f] = safe_deepcopy(new)
+            backup_field(f, new)
+            journal.append((now, f, "set", new))
 
             rv = True
 
     return rv
 
 
+################################################################################
+# Journal
+################################################################################
+
+# The persistent data is stored on disk as a snapshot, the zlib-compressed
+# pickle of the persistent object, and a journal of changes made since the
+# snapshot was written. The journal is a series of records, each consisting
+# of a header and the zlib-compressed pickle of a list of journal entries.
+# The header contains the magic, the length of the compressed data, and its
+# crc32.
+JOURNAL_MAGIC = "RPJ1"
+JOURNAL_HEADER = "<4sII"
+JOURNAL_HEADER_SIZE = struct.calcsize(JOURNAL_HEADER)
+
+def journal_filename(filename):
+    """
+    Returns the name of the journal that goes with the snapshot in
+    `filename`.
+    """
+
+    return filename + ".journal"
+
+def journal_record(data):
+    """
+    Returns a journal record containing `data`, a pickled list of journal
+    entries.
+    """
+
+    data = data.encode("zlib")
+    return struct.pack(JOURNAL_HEADER, JOURNAL_MAGIC, len(data), zlib.crc32(data) & 0xffffffff) + data
+
+def read_journal(filename):
+    """
+    Reads the journal in `filename`, and returns a list of the journal
+    entries in it. Reading stops at the first record that is incomplete
+    or damaged, as a record that was being appended when the game crashed
+    will be.
+    """
+
+    rv = [ ]
+
+    try:
+        with open(filename, "rb") as f:
+            data = f.read()
+    except:
+        return rv
+
+    pos = 0
+
+    while pos + JOURNAL_HEADER_SIZE <= len(data):
+        magic, length, crc = struct.unpack_from(JOURNAL_HEADER, data, pos)
+        pos += JOURNAL_HEADER_SIZE
+
+        record = data[pos:pos + length]
+        pos += length
+
+        if (magic != JOURNAL_MAGIC) or (len(record) != length):
+            break
+
+        if (zlib.crc32(record) & 0xffffffff) != crc:
+            break
+
+        try:
+            rv.extend(loads(record.decode("zlib")))
+        except:
+            break
+
+    return rv
+
+def replay(persistent, entries):
+    """
+    Applies the journal `entries` to `persistent`. An entry is a (time,
+    field, kind, value) tuple, where kind is one of:
+
+    "set"
+        The field is set to `value`. This is skipped if the field was
+        changed after `time`, which happens when the journal is replayed
+        onto a snapshot written after the journal.
+
+    "update"
+        The dict in the field is updated with `value`.
+
+    "add"
+        The items in the list `value` are added to the set in the field.
+    """
+
+    pvars = vars(persistent)
+
+    for t, f, kind, value in entries:
+
+        if kind == "set":
+
+            if t < persistent._changed.get(f, 0):
+                continue
+
+            if value is None:
+                pvars.pop(f, None)
+            else:
+                setattr(persistent, f, value)
+
+        elif kind == "update":
+
+            if pvars.get(f, None) is None:
+                setattr(persistent, f, { })
+
+            dict.update(pvars[f], value)
+
+        elif kind == "add":
+
+            if pvars.get(f, None) is None:
+                setattr(persistent, f, set())
+
+            set.update(pvars[f], value)
+
+        persistent._changed[f] = max(t, persistent._changed.get(f, 0))
+
+
 def load(filename):
     """
-    Loads persistence data from `filename`. Returns None if the data
-    could not be loaded, or a Persistent object if it could be
-    loaded.
+    Loads persistence data from `filename`, and replays the journal that
+    goes with it. Returns None if the data could not be loaded, or a
+    Persistent object if it could be loaded.
     """
 
     # Unserialize the persistent data.
@@ -187,6 +516,8 @@ def load(filename):
 
     persistent._update()
 
+    replay(persistent, read_journal(journal_filename(filename)))
+
     return persistent
 
 
@@ -205,10 +536,8 @@ def init():
         persistent = Persistent()
 
     # Create the backup of the persistent data.
-    v = vars(persistent)
-
     for k, v in vars(persistent).iteritems():
-        backup[k] = safe_deepcopy(v)
+        backup_field(k, v)
 
     return persistent
 
@@ -275,6 +604,8 @@ def merge(other):
 
     fields = set(pvars.keys()) | set(ovars.keys())
 
+    global need_snapshot
+
     for f in fields:
         pval = pvars.get(f, None)
         oval = ovars.get(f, None)
@@ -282,6 +613,11 @@ def merge(other):
         if pval == oval:
             continue
 
+        if isinstance(pval, (dict, set)):
+            plen = len(pval)
+        else:
+            plen = None
+
         ptime = persistent._changed.get(f, 0)
 
         otime = other._changed.get(f, 0)
@@ -299,10 +635,19 @@ def merge(other):
         merge_func = registry.get(f, default_merge)
 
         val = merge_func(old, new, pval)
-        pvars[f] = val
-        backup[f] = safe_deepcopy(val)
+        setattr(persistent, f, val)
+        backup_field(f, pvars[f])
         persistent._changed[f] = t
 
+        # Merged changes aren't journaled, so if the merge brought in data
+        # from the other file, the next save writes a snapshot. That
+        # copies the data to the locations that lack it.
+        if f == "_changed":
+            continue
+
+        if (new is oval) or ((plen is not None) and (len(pvars[f]) != plen)):
+            need_snapshot = True
+
 # The mtime of the most recently processed savefile.
 persistent_mtime = None
 
@@ -327,6 +672,9 @@ def update(force_save=False):
     """
     Loads the persistent data from persistent files that are newer than
     persistent_mtime, and merges it into the persistent object.
+
+    If `force_save` is true, the persistent data is saved, and this waits
+    for it to be written to disk.
     """
 
     need_save = find_changes()
@@ -358,19 +706,118 @@ def update(force_save=False):
     if need_save:
         save()
 
+    if force_save:
+        flush()
+
 should_save_persistent = True
 
+# True if the next save should write a snapshot of the persistent data,
+# rather than appending to the journal. This starts out true, so that
+# journals left behind by an earlier session are folded into the snapshot.
+need_snapshot = True
+
 def save():
     """
-    Saves the persistent data to disk.
+    Saves the persistent data to disk. The changes found by find_changes are
+    appended to the journal, unless a snapshot is needed. The data is
+    compressed and written by the persistent writer thread.
     """
 
+    global need_snapshot
+
+    entries = journal[:]
+    journal[:] = [ ]
+
     if not should_save_persistent:
         return
 
     try:
-        data = dumps(renpy.game.persistent).encode("zlib")
-        renpy.loadsave.location.save_persistent(data)
+        check_write_exception()
+
+        location = renpy.loadsave.location
+
+        if need_snapshot or location.needs_persistent_snapshot():
+            need_snapshot = False
+            write(location, "snapshot", dumps(renpy.game.persistent))
+        elif entries:
+            write(location, "journal", dumps(entries))
+
+    except:
+        if renpy.config.developer:
+            raise
+
+# A queue of (location, kind, data) tuples, giving the writes the persistent
+# writer thread should perform, in order. Kind is "snapshot" or "journal".
+write_queue = Queue.Queue()
+
+# The persistent writer thread, or None if it hasn't been started.
+write_thread = None
+
+# An exception raised by the persistent writer thread, that hasn't been
+# reported yet.
+write_exception = None
+
+def write_thread_main():
+    global write_exception
+    global need_snapshot
+
+    while True:
+        location, kind, data = write_queue.get()
+
+        try:
+            if kind == "snapshot":
+                location.save_persistent(data.encode("zlib"))
+            else:
+                location.append_persistent(journal_record(data))
+
+        except Exception, e:
+            write_exception = e
+
+            # The journal may no longer match the snapshot.
+            need_snapshot = True
+
+        finally:
+            write_queue.task_done()
+
+def write(location, kind, data):
+    """
+    Queues `data` to be written to `location` by the persistent writer
+    thread, starting it if necessary.
+    """
+
+    global write_thread
+
+    if write_thread is None:
+        write_thread = threading.Thread(target=write_thread_main, name="persistent writer")
+        write_thread.daemon = True
+        write_thread.start()
+
+    write_queue.put((location, kind, data))
+
+def check_write_exception():
+    """
+    Raises the exception that occured in the persistent writer thread, if
+    there was one.
+    """
+
+    global write_exception
+
+    e = write_exception
+    write_exception = None
+
+    if e is not None:
+        raise e
+
+def flush():
+    """
+    Waits for the persistent writer thread to write all the data that has
+    been queued.
+    """
+
+    write_queue.join()
+
+    try:
+        check_write_exception()
     except:
         if renpy.config.developer:
             raise
@@ -27,11 +27,16 @@
 ast = __import__("ast", { })
 
 import marshal
+import copy
 import random
 import weakref
 import re
 import sets
 import sys
+import thread
+import dis
+import types
+import gc
 
 import renpy.audio
 
@@ -71,10 +76,65 @@ class StoreModule(object):
 def get_store_module(name):
     return sys.modules[name]
 
+# The names that compiled code assigns to or deletes with a global
+# statement. Python changes these with the dict C API, bypassing the
+# write barrier in StoreDict, so StoreDict.begin records their values.
+unguarded_names = set()
+
+STORE_GLOBAL = dis.opmap["STORE_GLOBAL"]
+DELETE_GLOBAL = dis.opmap["DELETE_GLOBAL"]
+EXTENDED_ARG = dis.opmap["EXTENDED_ARG"]
+
+def note_global_writes(code):
+    """
+    Adds the names that `code`, a code object, or code nested inside it,
+    changes with STORE_GLOBAL or DELETE_GLOBAL to unguarded_names.
+    """
+
+    co_code = code.co_code
+
+    if (chr(STORE_GLOBAL) in co_code) or (chr(DELETE_GLOBAL) in co_code):
+
+        i = 0
+        extended = 0
+
+        while i < len(co_code):
+            op = ord(co_code[i])
+
+            if op < dis.HAVE_ARGUMENT:
+                i += 1
+                continue
+
+            arg = ord(co_code[i + 1]) + ord(co_code[i + 2]) * 256 + extended
+            extended = 0
+            i += 3
+
+            if op == EXTENDED_ARG:
+                extended = arg * 65536
+            elif (op == STORE_GLOBAL) or (op == DELETE_GLOBAL):
+                name = code.co_names[arg]
+
+                if name in unguarded_names:
+                    continue
+
+                unguarded_names.add(name)
+
+                # Start tracking the name in the current rollback period.
+                for sd in store_dicts.itervalues():
+                    sd.log_change(name)
+
+    for i in code.co_consts:
+        if isinstance(i, types.CodeType):
+            note_global_writes(i)
+
+
 class StoreDict(dict):
     """
     This class represents the dictionary of a store module. It logs
     sets and deletes.
+
+    Changes are tracked with a write barrier: the first time a key is
+    changed after begin() is called, its old value is recorded in old.
     """
 
     def __reduce__(self):
@@ -82,8 +142,9 @@ class StoreDict(dict):
 
     def __init__(self):
 
-        # The value of this dictionary at the start of the current
-        # rollback period (when begin() was last called).
+        # A map from each key that changed since the start of the current
+        # rollback period (when begin() was last called) to its value at
+        # the start of the period, or deleted if it didn't exist.
         self.old = { }
 
         # The set of variables in this StoreDict that changed since the
@@ -104,7 +165,61 @@ class StoreDict(dict):
         Called to mark the start of a rollback period.
         """
 
-        self.old = dict(self)
+        get = self.get
+        self.old = dict((k, get(k, deleted)) for k in unguarded_names)
+
+    def log_change(self, key):
+        """
+        Called before `key` is changed, to record its old value.
+        """
+
+        global mutation_serial
+        mutation_serial += 1
+
+        if key not in self.old:
+            self.old[key] = self.get(key, deleted)
+
+    def __setitem__(self, key, value):
+        global mutation_serial
+        mutation_serial += 1
+
+        if key not in self.old:
+            self.old[key] = self.get(key, deleted)
+
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.log_change(key)
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+
+        for k in other:
+            self.log_change(k)
+
+        dict.update(self, other)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+
+        return dict.__getitem__(self, key)
+
+    def pop(self, key, *args):
+        self.log_change(key)
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        rv = dict.popitem(self)
+        self.old.setdefault(rv[0], rv[1])
+        return rv
+
+    def clear(self):
+        for k in self:
+            self.log_change(k)
+
+        dict.clear(self)
 
     def get_changes(self):
         """
@@ -117,10 +232,6 @@ class StoreDict(dict):
 
         rv = { }
 
-        for k in self:
-            if k not in self.old:
-                rv[k] = deleted
-
         for k, v in self.old.iteritems():
 
             new_v = self.get(k, deleted)
@@ -258,63 +369,185 @@ class NoRollback(object):
     pass
 
 
-# parents = [ ]
+# This is incremented whenever a revertable object or a store is changed, or
+# a new rollback period begins. It's used to tell if a reachability walk
+# is still valid.
+mutation_serial = 0
 
-def reached(obj, reachable, wait):
+def no_children(obj):
+    return ()
+
+def norollback_children(obj):
+    return ()
+
+def make_strategy(t):
+    """
+    Returns a function that returns the objects that an object of type `t`
+    refers to, for the purpose of finding reachable objects. Objects are
+    treated as fields indexed by strings, as iterables, and as dicts, with
+    the parts that don't apply to the type skipped.
+    """
+
+    if issubclass(t, NoRollback):
+        return norollback_children
+
+    # Since the store module is the roots, there's no need to
+    # look into it.
+    if issubclass(t, StoreModule):
+        return no_children
+
+    iterable = hasattr(t, "__iter__") and not issubclass(t, basestring)
+    dictlike = hasattr(t, "itervalues")
+
+    def children(obj):
+
+        rv = [ ]
+
+        try:
+            rv.extend(vars(obj).itervalues())
+        except:
+            pass
+
+        if iterable:
+            try:
+                rv.extend(obj.__iter__())
+            except:
+                pass
+
+        if dictlike:
+            try:
+                rv.extend(obj.itervalues())
+            except:
+                pass
+
+        return rv
+
+    return children
+
+# A map from type to a function that returns the objects that objects of
+# that type refer to. Types that aren't here get a function from
+# make_strategy the first time an object of that type is reached.
+reach_strategies = { }
+
+for _t in (int, long, float, complex, bool, str, unicode, type(None)):
+    reach_strategies[_t] = no_children
+
+# The builtin containers refer to exactly the objects they contain, so the
+# gc module can find them quickly.
+for _t in (list, tuple, dict, set, frozenset):
+    reach_strategies[_t] = gc.get_referents
+
+
+class Marker(object):
     """
-    @param obj: The object that was reached.
-    @param path: The path from the store via which it was reached.
+    Marks the objects that are reachable from a set of roots. Marking
+    uses an explicit worklist rather than recursion, and so can be
+    stopped and resumed.
 
     `reachable`
         A map from id(obj) to int. The int is 1 if the object was reached
         normally, and 0 if it was reached, but inherits from NoRollback.
 
+    `wait`
+        If not None, a function that's called before each object is
+        marked.
     """
 
-    if wait:
-        wait()
+    def __init__(self, reachable=None, wait=None):
 
-    idobj = id(obj)
+        if reachable is None:
+            reachable = { }
 
-    if idobj in reachable:
-        return
+        self.reachable = reachable
+        self.wait = wait
 
-    if isinstance(obj, NoRollback):
-        reachable[idobj] = 0
-        return
+        # Objects that have been reached, but not marked.
+        self.worklist = [ ]
 
-    reachable[idobj] = 1
+    def add(self, obj):
+        """
+        Adds `obj` as a root.
+        """
 
-    # Since the store module is the roots, there's no need to
-    # look into it.
-    if isinstance(obj, StoreModule):
-        return
+        self.worklist.append(obj)
 
-    # parents.append(obj)
+    def run(self, budget=None):
+        """
+        Marks objects until every reachable object has been marked, or
+        `budget` objects have been processed, if `budget` is not None.
+        Returns True if marking is finished, or False if run needs to be
+        called again.
+        """
 
-    try:
-        # Treat as fields, indexed by strings.
-        for v in vars(obj).itervalues():
-            reached(v, reachable, wait)
-    except:
-        pass
+        reachable = self.reachable
+        worklist = self.worklist
+        wait = self.wait
+        strategies = reach_strategies
 
-    try:
-        # Treat as iterable
-        if not isinstance(obj, basestring):
-            for v in obj.__iter__():
-                reached(v, reachable, wait)
-    except:
-        pass
+        while worklist:
 
-    try:
-        # Treat as dict.
-        for v in obj.itervalues():
-            reached(v, reachable, wait)
-    except:
-        pass
+            if budget is not None:
+                if budget <= 0:
+                    return False
+
+                budget -= 1
+
+            obj = worklist.pop()
+
+            if wait:
+                wait()
+
+            idobj = id(obj)
+
+            if idobj in reachable:
+                continue
+
+            t = type(obj)
+
+            strategy = strategies.get(t, None)
+
+            if strategy is None:
+                strategy = strategies[t] = make_strategy(t)
+
+            if strategy is norollback_children:
+                reachable[idobj] = 0
+                continue
+
+            reachable[idobj] = 1
+
+            worklist.extend(strategy(obj))
+
+        return True
+
+
+def reached(obj, reachable, wait):
+    """
+    Marks `obj`, and everything reachable from it, as reachable.
+
+    `reachable`
+        A map from id(obj) to int. The int is 1 if the object was reached
+        normally, and 0 if it was reached, but inherits from NoRollback.
+    """
+
+    marker = Marker(reachable, wait)
+    marker.add(obj)
+    marker.run()
 
-    # parents.pop()
+def add_roots(marker, store):
+    """
+    Adds the variables in the store, and the objects reachable from the
+    contexts, to `marker` as roots.
+    """
+
+    for v in store.itervalues():
+        marker.add(v)
+
+    for c in renpy.game.contexts:
+        marker.add(c.info)
+        marker.add(c.music)
+        for d in c.dynamic_stack:
+            for v in d.itervalues():
+                marker.add(v)
 
 def reached_vars(store, reachable, wait):
     """
@@ -326,15 +559,9 @@ def reached_vars(store, reachable, wait):
     the path by which the object was reached.
     """
 
-    for v in store.itervalues():
-        reached(v, reachable, wait)
-
-    for c in renpy.game.contexts:
-        reached(c.info, reachable, wait)
-        reached(c.music, reachable, wait)
-        for d in c.dynamic_stack:
-            for v in d.itervalues():
-                reached(v, reachable, wait)
+    marker = Marker(reachable, wait)
+    add_roots(marker, store)
+    marker.run()
 
 
 ##### Code that replaces literals will calls to magic constructors.
@@ -477,7 +704,10 @@ def py_compile(source, mode, filename='<none>', lineno=1, ast_node=False):
     """
 
     if isinstance(source, ast.Module):
-        return compile(source, filename, mode)
+        rv = compile(source, filename, mode)
+        note_global_writes(rv)
+
+        return rv
 
     if isinstance(source, renpy.ast.PyExpr):
         filename = source.filename
@@ -502,7 +732,10 @@ def py_compile(source, mode, filename='<none>', lineno=1, ast_node=False):
         if ast_node:
             return tree.body
 
-        return compile(tree, filename, mode)
+        rv = compile(tree, filename, mode)
+        note_global_writes(rv)
+
+        return rv
 
     except SyntaxError, e:
 
@@ -536,6 +769,12 @@ def mutator(method):
     def do_mutation(self, *args, **kwargs):
 
         global mutate_flag
+        global mutation_serial
+
+        mutation_serial += 1
+
+        if save_snapshot is not None:
+            save_snapshot.before_change(self)
 
         mutated = renpy.game.log.mutated #@UndefinedVariable
 
@@ -547,8 +786,267 @@ def mutator(method):
 
     return do_mutation
 
+
+# The SaveSnapshot being pickled by a save, or None.
+save_snapshot = None
+
+def copy_reduction(rv):
+    """
+    Given `rv`, the result of calling __reduce_ex__ on an object with
+    protocol 2, returns a 5-tuple with the state, list items, and dict
+    items copied, so later changes to the object don't change it.
+    """
+
+    func, args, state, listitems, dictitems = tuple(rv) + (None,) * (5 - len(rv))
+
+    if isinstance(state, dict):
+        state = dict(state)
+    elif isinstance(state, tuple):
+        state = tuple(dict(i) if isinstance(i, dict) else i for i in state)
+
+    if listitems is not None:
+        listitems = list(listitems)
+
+    if dictitems is not None:
+        dictitems = list(dictitems)
+
+    return (func, args, state, listitems, dictitems)
+
+class SaveSnapshot(object):
+    """
+    Lets a thread pickle the revertable objects as they were when this was
+    created, while the game keeps running. The first time each revertable
+    object is changed after that, its state is copied, and the copy is
+    pickled in place of the object's current state.
+    """
+
+    def __init__(self):
+
+        # A map from the id of a changed object to an (object, reduction)
+        # tuple, where reduction is the copy_reduction of the object from
+        # before it was changed.
+        self.saved = { }
+
+        # The thread that pickles this snapshot.
+        self.ident = None
+
+    def before_change(self, obj):
+        """
+        Called on the thread running the game before `obj` is changed.
+        """
+
+        if id(obj) not in self.saved:
+            self.saved[id(obj)] = (obj, copy_reduction(object.__reduce_ex__(obj, 2)))
+
+    def claim(self):
+        """
+        Called by the thread that pickles this snapshot, before it starts.
+        """
+
+        self.ident = thread.get_ident()
+
+    def reduce(self, obj, rv):
+        """
+        Returns the reduction of `obj` that's pickled, given `rv`, the
+        reduction of its current state.
+        """
+
+        # The current state is copied before looking for a saved state, as
+        # the state is saved before a change is made. If there's no saved
+        # state now, obj hadn't been changed when it was copied.
+        rv = copy_reduction(rv)
+
+        saved = self.saved.get(id(obj), None)
+
+        if saved is not None:
+            rv = saved[1]
+
+        func, args, state, listitems, dictitems = rv
+
+        if listitems is not None:
+            listitems = iter(listitems)
+
+        if dictitems is not None:
+            dictitems = iter(dictitems)
+
+        return (func, args, state, listitems, dictitems)
+
+def revertable_reduce_ex(self, protocol):
+    """
+    The __reduce_ex__ method of the revertable classes. When called from
+    the thread pickling a SaveSnapshot, this returns the state the object
+    had when the snapshot was taken.
+    """
+
+    rv = object.__reduce_ex__(self, protocol)
+
+    snapshot = save_snapshot
+
+    if (snapshot is None) or (protocol < 2) or (snapshot.ident != thread.get_ident()):
+        return rv
+
+    return snapshot.reduce(self, rv)
+
+
+class UndoLog(renpy.object.Object):
+    """
+    The rollback information for a RevertableList or RevertableDict. Rather
+    than copying the container the first time it's changed in a statement,
+    each change adds a record that undoes it, and rollback undoes the
+    records in reverse order.
+
+    @ivar records: A list of tuples, each giving a change that undoes a
+    change to the container. A ("replace", copy) record replaces the
+    contents of the container with a copy made by get_rollback.
+
+    @ivar complete: True if the first record is a replace record. As that
+    restores the container to its state at the start of the statement, no
+    more records are needed.
+
+    Not serialized:
+
+    @ivar keys: For dicts, the set of keys with a record. Only the first
+    change to a key needs to be undone.
+    """
+
+    nosave = [ 'keys' ]
+
+    def __init__(self):
+        self.records = [ ]
+        self.complete = False
+        self.keys = set()
+
+    def after_setstate(self):
+        self.keys = set()
+
+    def replace(self, copy):
+        """
+        Adds a record that replaces the contents of the container with
+        `copy`.
+        """
+
+        if not self.records:
+            self.complete = True
+
+        self.records.append(("replace", copy))
+
+    def save_copy(self):
+        """
+        Returns a copy of this log, which doesn't change when records are
+        added to this one.
+        """
+
+        rv = UndoLog()
+        rv.records = list(self.records)
+        rv.complete = self.complete
+
+        return rv
+
+    def truncate(self, length):
+        """
+        Adds a record that truncates a list to `length`.
+        """
+
+        records = self.records
+
+        # An earlier truncate, with nothing in between, undoes this one.
+        if records and records[-1][0] == "truncate" and records[-1][1] <= length:
+            return
+
+        records.append(("truncate", length))
+
+    def key(self, d, key):
+        """
+        Adds a record that restores `key` in the dict `d` to its current
+        value or absence.
+        """
+
+        if key in self.keys:
+            return
+
+        self.keys.add(key)
+
+        if key in d:
+            self.records.append(("set", key, dict.__getitem__(d, key)))
+        else:
+            self.records.append(("del", key))
+
+# A map from a revertable container class to True if its changes can be
+# recorded in an UndoLog, or False if it overrides get_rollback or
+# rollback.
+undo_classes = { }
+
+def get_undo(self, base):
+    """
+    Called before `self`, an instance of `base` or a subclass, is changed.
+    Returns the UndoLog the change should be recorded in, or None if the
+    change doesn't need to be recorded.
+    """
+
+    global mutate_flag
+    global mutation_serial
+
+    mutation_serial += 1
+
+    if save_snapshot is not None:
+        save_snapshot.before_change(self)
+
+    mutated = renpy.game.log.mutated #@UndefinedVariable
+
+    cls = type(self)
+    use_undo = undo_classes.get(cls, None)
+
+    if use_undo is None:
+        use_undo = undo_classes[cls] = (
+            (cls.get_rollback.im_func is base.__dict__["get_rollback"]) and
+            (cls.rollback.im_func is base.__dict__["rollback"]))
+
+    v = mutated.get(id(self), False)
+
+    if v is False:
+
+        if use_undo:
+            rv = UndoLog()
+        else:
+            rv = self.get_rollback()
+
+        mutated[id(self)] = ( weakref.ref(self), rv )
+        mutate_flag = True
+
+    elif v is None:
+        return None
+
+    else:
+        rv = v[1]
+
+    if use_undo and not rv.complete:
+        return rv
+    else:
+        return None
+
+
+def list_index(l, index):
+    """
+    Returns `index` as a non-negative index into the list `l`, or None if
+    it isn't a valid index.
+    """
+
+    if not isinstance(index, (int, long)):
+        return None
+
+    if index < 0:
+        index += len(l)
+
+    if 0 <= index < len(l):
+        return index
+
+    return None
+
+
 class RevertableList(list):
 
+    __reduce_ex__ = revertable_reduce_ex
+
     def __init__(self, *args):
         log = renpy.game.log
 
@@ -557,18 +1055,137 @@ class RevertableList(list):
 
         list.__init__(self, *args)
 
-    __delitem__ = mutator(list.__delitem__)
-    __delslice__ = mutator(list.__delslice__)
-    __setitem__ = mutator(list.__setitem__)
-    __iadd__ = mutator(list.__iadd__)
-    __imul__ = mutator(list.__imul__)
-    append = mutator(list.append)
-    extend = mutator(list.extend)
-    insert = mutator(list.insert)
-    pop = mutator(list.pop)
-    remove = mutator(list.remove)
-    reverse = mutator(list.reverse)
-    sort = mutator(list.sort)
+    def __delitem__(self, index):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            i = list_index(self, index)
+
+            if i is not None:
+                undo.records.append(("insert", i, list.__getitem__(self, i)))
+            else:
+                undo.replace(self.get_rollback())
+
+        list.__delitem__(self, index)
+
+    def __setitem__(self, index, value):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            i = list_index(self, index)
+
+            if i is not None:
+                undo.records.append(("set", i, list.__getitem__(self, i)))
+            else:
+                undo.replace(self.get_rollback())
+
+        list.__setitem__(self, index, value)
+
+    def __delslice__(self, i, j):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            undo.replace(self.get_rollback())
+
+        list.__delslice__(self, i, j)
+
+    def __setslice__(self, i, j, sequence):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            undo.replace(self.get_rollback())
+
+        list.__setslice__(self, i, j, sequence)
+
+    def __iadd__(self, other):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            undo.truncate(len(self))
+
+        return list.__iadd__(self, other)
+
+    def __imul__(self, n):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            if isinstance(n, (int, long)) and n >= 1:
+                undo.truncate(len(self))
+            else:
+                undo.replace(self.get_rollback())
+
+        return list.__imul__(self, n)
+
+    def append(self, value):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            undo.truncate(len(self))
+
+        list.append(self, value)
+
+    def extend(self, values):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            undo.truncate(len(self))
+
+        list.extend(self, values)
+
+    def insert(self, index, value):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            if isinstance(index, (int, long)):
+                i = index
+
+                if i < 0:
+                    i = max(0, i + len(self))
+
+                undo.records.append(("delete", min(i, len(self))))
+            else:
+                undo.replace(self.get_rollback())
+
+        list.insert(self, index, value)
+
+    def pop(self, index=-1):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            i = list_index(self, index)
+
+            if i is not None:
+                undo.records.append(("insert", i, list.__getitem__(self, i)))
+
+        return list.pop(self, index)
+
+    def remove(self, value):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            try:
+                i = list.index(self, value)
+                undo.records.append(("insert", i, list.__getitem__(self, i)))
+            except ValueError:
+                pass
+
+        list.remove(self, value)
+
+    def reverse(self):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            undo.records.append(("reverse", ))
+
+        list.reverse(self)
+
+    def sort(self, *args, **kwargs):
+        undo = get_undo(self, RevertableList)
+
+        if undo is not None:
+            undo.replace(self.get_rollback())
+
+        list.sort(self, *args, **kwargs)
 
     def wrapper(method): # E0213 @NoSelf
         def newmethod(*args, **kwargs):
@@ -587,7 +1204,26 @@ class RevertableList(list):
         return self[:]
 
     def rollback(self, old):
-        self[:] = old
+
+        if not isinstance(old, UndoLog):
+            list.__setslice__(self, 0, sys.maxint, old)
+            return
+
+        for r in reversed(old.records):
+            op = r[0]
+
+            if op == "truncate":
+                list.__delslice__(self, r[1], sys.maxint)
+            elif op == "insert":
+                list.insert(self, r[1], r[2])
+            elif op == "delete":
+                list.__delitem__(self, r[1])
+            elif op == "set":
+                list.__setitem__(self, r[1], r[2])
+            elif op == "reverse":
+                list.reverse(self)
+            elif op == "replace":
+                list.__setslice__(self, 0, sys.maxint, r[1])
 
 def revertable_range(*args):
     return RevertableList(range(*args))
@@ -597,6 +1233,8 @@ def revertable_sorted(*args, **kwargs):
 
 class RevertableDict(dict):
 
+    __reduce_ex__ = revertable_reduce_ex
+
     def __init__(self, *args, **kwargs):
         log = renpy.game.log
 
@@ -605,12 +1243,70 @@ class RevertableDict(dict):
 
         dict.__init__(self, *args, **kwargs)
 
-    __delitem__ = mutator(dict.__delitem__)
-    __setitem__ = mutator(dict.__setitem__)
-    clear = mutator(dict.clear)
-    pop = mutator(dict.pop)
-    popitem = mutator(dict.popitem)
-    setdefault = mutator(dict.setdefault)
+    def __delitem__(self, key):
+        undo = get_undo(self, RevertableDict)
+
+        if undo is not None:
+            undo.key(self, key)
+
+        dict.__delitem__(self, key)
+
+    def __setitem__(self, key, value):
+        undo = get_undo(self, RevertableDict)
+
+        if undo is not None:
+            undo.key(self, key)
+
+        dict.__setitem__(self, key, value)
+
+    def clear(self):
+        undo = get_undo(self, RevertableDict)
+
+        if undo is not None:
+            undo.replace(self.get_rollback())
+
+        dict.clear(self)
+
+    def pop(self, key, *args):
+        undo = get_undo(self, RevertableDict)
+
+        if undo is not None:
+            undo.key(self, key)
+
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        undo = get_undo(self, RevertableDict)
+
+        rv = dict.popitem(self)
+
+        if (undo is not None) and (rv[0] not in undo.keys):
+            undo.keys.add(rv[0])
+            undo.records.append(("set", rv[0], rv[1]))
+
+        return rv
+
+    def setdefault(self, key, default=None):
+        undo = get_undo(self, RevertableDict)
+
+        if undo is not None:
+            undo.key(self, key)
+
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        undo = get_undo(self, RevertableDict)
+
+        if undo is None:
+            dict.update(self, *args, **kwargs)
+            return
+
+        other = dict(*args, **kwargs)
+
+        for k in other:
+            undo.key(self, k)
+
+        dict.update(self, other)
 
     def list_wrapper(method): # E0213 @NoSelf
         def newmethod(*args, **kwargs):
@@ -633,13 +1329,27 @@ class RevertableDict(dict):
         return self.items()
 
     def rollback(self, old):
-        self.clear()
 
-        for k, v in old:
-            self[k] = v
+        if not isinstance(old, UndoLog):
+            dict.clear(self)
+            dict.update(self, old)
+            return
+
+        for r in reversed(old.records):
+            op = r[0]
+
+            if op == "set":
+                dict.__setitem__(self, r[1], r[2])
+            elif op == "del":
+                dict.pop(self, r[1], None)
+            elif op == "replace":
+                dict.clear(self)
+                dict.update(self, r[1])
 
 class RevertableSet(sets.Set):
 
+    __reduce_ex__ = revertable_reduce_ex
+
     def __init__(self, *args):
         log = renpy.game.log
 
@@ -697,6 +1407,8 @@ class RevertableSet(sets.Set):
 
 class RevertableObject(object):
 
+    __reduce_ex__ = revertable_reduce_ex
+
     def __new__(cls, *args, **kwargs):
         self = super(RevertableObject, cls).__new__(cls)
 
@@ -804,10 +1516,17 @@ class Rollback(renpy.object.Object):
 
     @ivar random: A list of random numbers that were generated during the
     execution of this element.
+
+    Not serialized:
+
+    @ivar size: The estimated size of this rollback, in bytes, or None if
+    it hasn't been computed.
     """
 
     __version__ = 4
 
+    nosave = [ 'size' ]
+
     def __init__(self):
 
         super(Rollback, self).__init__()
@@ -831,6 +1550,10 @@ class Rollback(renpy.object.Object):
         # decreases.
         self.hard_checkpoint = False
 
+        self.size = None
+
+    def after_setstate(self):
+        self.size = None
 
     def after_upgrade(self, version):
 
@@ -852,11 +1575,12 @@ class Rollback(renpy.object.Object):
             self.hard_checkpoint = self.checkpoint
 
 
-    def purge_unreachable(self, reachable, wait):
+    def purge_unreachable(self, marker):
         """
         Adds objects that are reachable from the store of this
-        rollback to the set of reachable objects, and purges
-        information that is stored about totally unreachable objects.
+        rollback to the set of reachable objects, using `marker`, and
+        purges information that is stored about totally unreachable
+        objects.
 
         Returns True if this is the first time this method has been
         called, or False if it has already been called once before.
@@ -867,21 +1591,25 @@ class Rollback(renpy.object.Object):
 
         self.purged = True
 
+        reachable = marker.reachable
+
         # Add objects reachable from the stores. (Objects that might be
         # unreachable at the moment.)
         for changes in self.stores.itervalues():
             for _k, v in changes.iteritems():
                 if v is not deleted:
-                    reached(v, reachable, wait)
+                    marker.add(v)
 
         # Add in objects reachable through the context.
-        reached(self.context.info, reachable, wait)
+        marker.add(self.context.info)
         for d in self.context.dynamic_stack:
             for v in d.itervalues():
-                reached(v, reachable, wait)
+                marker.add(v)
 
         # Add in objects reachable through displayables.
-        reached(self.context.scene_lists.get_all_displayables(), reachable, wait)
+        marker.add(self.context.scene_lists.get_all_displayables())
+
+        marker.run()
 
         # Purge object update information for unreachable objects.
         new_objects = [ ]
@@ -889,7 +1617,8 @@ class Rollback(renpy.object.Object):
         for o, rb in self.objects:
             if reachable.get(id(o), 0):
                 new_objects.append((o, rb))
-                reached(rb, reachable, wait)
+                marker.add(rb)
+                marker.run()
             else:
                 if renpy.config.debug:
                     print "Removing unreachable:", o
@@ -897,9 +1626,77 @@ class Rollback(renpy.object.Object):
                     pass
 
         self.objects = new_objects
+        self.size = None
 
         return True
 
+    def get_size(self, cache=True):
+        """
+        Returns an estimate of the number of bytes of memory used by this
+        rollback. This counts the containers holding the changes to the
+        stores and the rollback information of mutated objects, but not
+        the objects they refer to, which are usually shared with the store
+        or with other rollbacks.
+
+        If `cache` is true, the estimate is stored, and returned by later
+        calls. This should only be used once the rollback is complete.
+        """
+
+        if self.size is not None:
+            return self.size
+
+        getsizeof = sys.getsizeof
+
+        rv = getsizeof(self.stores) + getsizeof(self.objects) + getsizeof(self.random)
+
+        for changes in self.stores.itervalues():
+            rv += getsizeof(changes)
+
+        def roll_size(roll):
+            rv = getsizeof(roll)
+
+            # The rollback information of a RevertableDict is a list of
+            # (key, value) tuples.
+            if isinstance(roll, list) and roll and isinstance(roll[0], tuple):
+                rv += len(roll) * getsizeof(roll[0])
+
+            return rv
+
+        for _o, roll in self.objects:
+
+            if isinstance(roll, UndoLog):
+                rv += getsizeof(roll) + getsizeof(roll.records)
+
+                for r in roll.records:
+                    rv += getsizeof(r)
+
+                    if r[0] == "replace":
+                        rv += roll_size(r[1])
+
+            else:
+                rv += roll_size(roll)
+
+        if cache:
+            self.size = rv
+
+        return rv
+
+    def save_copy(self, current):
+        """
+        Returns a copy of this rollback, which doesn't change as the game
+        continues to run. `current` should be true if this is the current
+        rollback, which may still be changing.
+        """
+
+        rv = copy.copy(self)
+        rv.stores = dict(self.stores)
+        rv.random = list(self.random)
+
+        if current:
+            rv.objects = [ (o, roll.save_copy() if isinstance(roll, UndoLog) else roll) for o, roll in self.objects ]
+
+        return rv
+
 
     def rollback(self):
         """
@@ -909,6 +1706,10 @@ class Rollback(renpy.object.Object):
 
         for obj, roll in reversed(self.objects):
             if roll is not None:
+
+                if save_snapshot is not None:
+                    save_snapshot.before_change(obj)
+
                 obj.rollback(roll)
 
         for name, changes in self.stores.iteritems():
@@ -959,7 +1760,7 @@ class RollbackLog(renpy.object.Object):
 
     __version__ = 4
 
-    nosave = [ 'old_store', 'mutated' ]
+    nosave = [ 'old_store', 'mutated', 'marker', 'reachable_cache', 'idle_key_cache' ]
 
     def __init__(self):
 
@@ -985,9 +1786,24 @@ class RollbackLog(renpy.object.Object):
         # on load.
         self.retain_after_load_flag = False
 
+        # A (key, Marker, idle_key) tuple for a reachability walk started
+        # when the game was idle, or None.
+        self.marker = None
+
+        # A (key, reachable) tuple, giving the objects that were reachable
+        # when the state of the game was described by key, or None.
+        self.reachable_cache = None
+
+        # The idle_key() when reachable_cache was last found to be current
+        # by mark_reachable, or None.
+        self.idle_key_cache = None
+
     def after_setstate(self):
         self.mutated = { }
         self.rolled_forward = False
+        self.marker = None
+        self.reachable_cache = None
+        self.idle_key_cache = None
 
     def after_upgrade(self, version):
         if version < 2:
@@ -1019,6 +1835,10 @@ class RollbackLog(renpy.object.Object):
         if len(self.log) > renpy.config.rollback_length:
             self.log = self.log[-renpy.config.rollback_length:]
 
+        # If the log uses too much memory, prune it.
+        if renpy.config.rollback_size is not None:
+            self.prune_size(renpy.config.rollback_size)
+
         # check for the end of fixed rollback
         if self.log and self.log[-1] == self.current:
 
@@ -1040,7 +1860,9 @@ class RollbackLog(renpy.object.Object):
         # Flag a mutation as having happened. This is used by the
         # save code.
         global mutate_flag
+        global mutation_serial
         mutate_flag = True
+        mutation_serial += 1
 
         self.rolled_forward = False
 
@@ -1048,6 +1870,40 @@ class RollbackLog(renpy.object.Object):
         for sd in store_dicts.itervalues():
             sd.begin()
 
+    def get_size(self):
+        """
+        Returns an estimate of the number of bytes of memory used by the
+        rollbacks in the log.
+        """
+
+        rv = 0
+
+        for rb in self.log:
+            rv += rb.get_size(rb is not self.current)
+
+        return rv
+
+    def prune_size(self, size):
+        """
+        Removes the oldest rollbacks from the log, until the rollbacks in
+        the log use less than `size` bytes, or only the current rollback
+        is left.
+        """
+
+        total = self.get_size()
+
+        count = 0
+
+        for rb in self.log:
+            if (total <= size) or (rb is self.current):
+                break
+
+            total -= rb.get_size()
+            count += 1
+
+        if count:
+            self.log = self.log[count:]
+
     def complete(self):
         """
         Called after a node is finished executing, before a save
@@ -1120,17 +1976,102 @@ class RollbackLog(renpy.object.Object):
         are no changes queued up.
         """
 
-        reachable = { }
+        key = self.reachable_key(roots)
 
-        reached_vars(roots, reachable, wait)
+        # Objects that were reachable when nothing has changed since are
+        # still reachable, so the walk from the roots can be skipped.
+        cache = self.reachable_cache
+
+        if (cache is not None) and (cache[0] == key):
+            marker = Marker(cache[1], wait)
+        else:
+            marker = Marker(None, wait)
+            add_roots(marker, roots)
+            marker.run()
 
         revlog = self.log[:]
         revlog.reverse()
 
         for i in revlog:
-            if not i.purge_unreachable(reachable, wait):
+            if not i.purge_unreachable(marker):
                 break
 
+        self.reachable_cache = (key, marker.reachable)
+        self.marker = None
+
+    def reachable_key(self, roots):
+        """
+        Returns a key that describes the state of the game, as far as
+        the objects reachable from `roots` are concerned. If the key is
+        unchanged, the same objects are reachable.
+        """
+
+        return (
+            mutation_serial,
+            id(self.current),
+            len(self.log),
+            tuple(id(i) for i in renpy.game.contexts),
+            frozenset((k, id(v)) for k, v in roots.iteritems()),
+            )
+
+    def idle_key(self):
+        """
+        Returns a key that changes whenever reachable_key might, but that
+        can be computed without looking at every variable in the store.
+        """
+
+        return (
+            mutation_serial,
+            id(self.current),
+            len(self.log),
+            tuple(id(i) for i in renpy.game.contexts),
+            tuple(id(sd.get(k, deleted)) for sd in store_dicts.itervalues() for k in unguarded_names),
+            )
+
+    def mark_reachable(self, budget):
+        """
+        Called when the game is idle, to mark up to `budget` objects as
+        reachable from the roots, so that the marking can be skipped by
+        the next save. Returns True if there is more marking to do.
+        """
+
+        idle_key = self.idle_key()
+
+        # Nothing has changed since the last call, so the store doesn't
+        # need to be looked at.
+        if idle_key == self.idle_key_cache:
+            return False
+
+        if (self.marker is not None) and (self.marker[2] == idle_key):
+            key, marker, _idle_key = self.marker
+
+        else:
+            self.complete()
+            roots = self.get_roots()
+
+            key = self.reachable_key(roots)
+
+            if (self.reachable_cache is not None) and (self.reachable_cache[0] == key):
+                self.idle_key_cache = idle_key
+                return False
+
+            if (self.marker is None) or (self.marker[0] != key):
+                marker = Marker()
+                add_roots(marker, roots)
+            else:
+                marker = self.marker[1]
+
+            self.marker = (key, marker, idle_key)
+
+        if not marker.run(budget):
+            return True
+
+        self.reachable_cache = (key, marker.reachable)
+        self.idle_key_cache = idle_key
+        self.marker = None
+
+        return False
+
     def in_rollback(self):
         if self.forward:
             return True
@@ -1395,6 +2336,29 @@ class RollbackLog(renpy.object.Object):
 
         return roots
 
+    def save_copy(self):
+        """
+        Returns a copy of this log and the rollbacks in it, which can be
+        pickled by another thread while the game continues to run. This
+        should be called right after freeze.
+        """
+
+        rv = copy.copy(self)
+
+        copies = { }
+
+        for rb in self.log:
+            copies[id(rb)] = rb.save_copy(rb is self.current)
+
+        rv.log = [ copies[id(rb)] for rb in self.log ]
+
+        if self.current is not None:
+            rv.current = copies.get(id(self.current), None) or self.current.save_copy(True)
+
+        rv.forward = list(self.forward)
+
+        return rv
+
     def discard_freeze(self):
         """
         Called to indicate that we will not be restoring from the
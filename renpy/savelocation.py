@@ -27,8 +27,11 @@
 import os
 import zipfile
 import json
+import cPickle
+import select
 
 import renpy.display
+import renpy.inotify
 import threading
 
 from renpy.loadsave import clear_slot, safe_rename
@@ -36,6 +39,69 @@ import shutil
 
 disk_lock = threading.RLock()
 
+# The version of the slot index format. An index with a different version is
+# ignored.
+INDEX_VERSION = 2
+
+# The number of out of date records the slot index can hold, beyond the
+# number of slots, before it's rewritten.
+INDEX_SLACK = 32
+
+from renpy.inotify import (IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO,
+    IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_IGNORED)
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+
+class Watcher(object):
+    """
+    Uses inotify to watch a directory for changes. This raises an exception
+    if inotify isn't available.
+    """
+
+    def __init__(self, directory):
+
+        self.inotify = renpy.inotify.Inotify()
+
+        if self.inotify.add_watch(directory, WATCH_MASK) < 0:
+            self.inotify.close()
+            raise OSError("inotify_add_watch failed.")
+
+        self.fd = self.inotify.fd
+
+        # False if the watch has been removed, and the directory has to be
+        # scanned instead.
+        self.valid = True
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        """
+        Reads the pending events. Returns a set of changed filenames, or
+        None if the directory has to be rescanned completely.
+        """
+
+        rv = set()
+
+        for _wd, mask, name in self.inotify.read():
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                self.valid = False
+
+            if mask & IN_Q_OVERFLOW:
+                rv = None
+
+            if rv is not None:
+                rv.add(name)
+
+        return rv
+
+    def close(self):
+        self.inotify.close()
+        self.fd = None
+
 class FileLocation(object):
     """
     A location that saves files to a directory on disk.
@@ -69,12 +135,50 @@ class FileLocation(object):
         # The persistent file.
         self.persistent = os.path.join(self.directory, "persistent")
 
-        # The mtime of the persistent file.
+        # The journal of changes made to the persistent data since the
+        # persistent file was written.
+        self.persistent_journal = renpy.persistent.journal_filename(self.persistent)
+
+        # The size of the journal, in bytes.
+        self.journal_size = 0
+
+        # The mtime of the persistent file or its journal, whichever is
+        # newer.
         self.persistent_mtime = 0
 
         # The data loaded from the persistent file.
         self.persistent_data = None
 
+        # The slot index, which caches the json and screenshot of each
+        # slot, so the file pages don't have to open every save file.
+        self.index_filename = os.path.join(self.directory, "slotindex")
+
+        # The number of records in the slot index file, or None if the file
+        # has to be rewritten before records can be appended to it.
+        self.index_records = None
+
+        # A map from slotname to a dict giving the mtime, json, screenshot
+        # name and data, and Ren'Py version of the save in that slot.
+        self.index = self.load_index()
+
+        # The slots whose index entries have changed since the index was
+        # last written.
+        self.index_changed = set()
+
+        # This is incremented each time a change to a slot or the persistent
+        # file is noticed.
+        self.changes = 0
+
+        # The watcher that tells us which files in the directory have changed,
+        # or None if the directory has to be scanned periodically.
+        self.watcher = None
+
+        if self.active:
+            try:
+                self.watcher = Watcher(self.directory)
+            except:
+                self.watcher = None
+
 
     def filename(self, slotname):
         """
@@ -94,7 +198,6 @@ class FileLocation(object):
 
         with disk_lock:
 
-            old_mtimes = self.mtimes
             new_mtimes = { }
 
             suffix = renpy.savegame_suffix
@@ -111,23 +214,143 @@ class FileLocation(object):
                 except:
                     pass
 
+            self.update_slots(new_mtimes)
+            self.scan_persistent()
+
+    def update_slots(self, new_mtimes, slotnames=None):
+        """
+        Updates the mtimes of the slots in `slotnames` to those found in
+        `new_mtimes`, and invalidates the slots that changed. If `slotnames`
+        is None, all slots are updated.
+        """
+
+        old_mtimes = self.mtimes
+
+        if slotnames is None:
+            slotnames = set(old_mtimes) | set(new_mtimes)
             self.mtimes = new_mtimes
+        else:
+            self.mtimes = dict(old_mtimes)
+
+            for slotname in slotnames:
+                if slotname in new_mtimes:
+                    self.mtimes[slotname] = new_mtimes[slotname]
+                else:
+                    self.mtimes.pop(slotname, None)
+
+        for slotname in slotnames:
+            mtime = new_mtimes.get(slotname, None)
+
+            if old_mtimes.get(slotname, None) != mtime:
+                clear_slot(slotname)
+                self.changes += 1
+
+            entry = self.index.get(slotname, None)
+
+            if (entry is not None) and (entry["mtime"] != mtime):
+                del self.index[slotname]
+                self.index_changed.add(slotname)
+
+        if self.index_changed:
+            self.save_index()
+
+    def scan_persistent(self):
+        """
+        Loads the persistent file, if it or its journal has changed.
+        """
+
+        if os.path.exists(self.persistent):
+            mtime = os.path.getmtime(self.persistent)
+
+            try:
+                self.journal_size = os.path.getsize(self.persistent_journal)
+                mtime = max(mtime, os.path.getmtime(self.persistent_journal))
+            except:
+                self.journal_size = 0
+
+            if mtime != self.persistent_mtime:
+                data = renpy.persistent.load(self.persistent)
+                self.persistent_mtime = mtime
+                self.persistent_data = data
+                self.changes += 1
+
+    def poll(self):
+        """
+        Called periodically by the scan thread. If the directory is being
+        watched, this only updates the files that changed. Otherwise, the
+        directory is rescanned.
+        """
+
+        if not self.active:
+            return
+
+        watcher = self.watcher
+
+        if (watcher is None) or (not watcher.valid):
+            self.scan()
+            return
+
+        with disk_lock:
+
+            try:
+                names = watcher.read()
+            except:
+                names = None
+
+            if (names is None) or (not watcher.valid):
+                self.scan()
+                return
+
+            if not names:
+                return
+
+            suffix = renpy.savegame_suffix
+            suffix_len = len(suffix)
+
+            new_mtimes = { }
+            slotnames = set()
+
+            for fn in names:
+
+                if fn.endswith(suffix):
+                    slotname = fn[:-suffix_len]
+                    slotnames.add(slotname)
+
+                    try:
+                        new_mtimes[slotname] = os.path.getmtime(os.path.join(self.directory, fn))
+                    except:
+                        pass
+
+            if slotnames:
+                self.update_slots(new_mtimes, slotnames)
+
+            if (os.path.basename(self.persistent) in names) or (os.path.basename(self.persistent_journal) in names):
+                self.scan_persistent()
 
-            for slotname, mtime in new_mtimes.iteritems():
-                if old_mtimes.get(slotname, None) != mtime:
-                    clear_slot(slotname)
+    def watch_fileno(self):
+        """
+        Returns the file descriptor that becomes readable when this location
+        changes, or None if this location has to be polled.
+        """
+
+        if not self.active:
+            return None
 
-            for slotname in old_mtimes:
-                if slotname not in new_mtimes:
-                    clear_slot(slotname)
+        watcher = self.watcher
 
-            if os.path.exists(self.persistent):
-                mtime = os.path.getmtime(self.persistent)
+        if (watcher is None) or (not watcher.valid) or (watcher.fd is None):
+            return None
 
-                if mtime != self.persistent_mtime:
-                    data = renpy.persistent.load(self.persistent)
-                    self.persistent_mtime = mtime
-                    self.persistent_data = data
+        return watcher.fd
+
+    def close(self):
+        """
+        Stops watching the directory.
+        """
+
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
 
 
     def save(self, slotname, record):
@@ -140,6 +363,21 @@ class FileLocation(object):
         with disk_lock:
             record.write_file(filename)
 
+            try:
+                data = json.loads(record.json)
+            except:
+                data = { }
+
+            self.index[slotname] = {
+                "mtime" : os.path.getmtime(filename),
+                "json" : data,
+                "screenshot_name" : "screenshot.png",
+                "screenshot" : record.screenshot,
+                "version" : renpy.version,
+                }
+
+            self.index_changed.add(slotname)
+
         self.scan()
 
     def list(self):
@@ -162,45 +400,102 @@ class FileLocation(object):
         return self.mtimes.get(slotname, None)
 
 
-    def json(self, slotname):
+    def load_index(self):
         """
-        Returns the JSON data for slotname.
+        Loads the slot index from disk, returning an empty index if it
+        doesn't exist or can't be read.
 
-        Returns None if the slot is empty.
+        The index file contains INDEX_VERSION, followed by a series of
+        (slotname, entry) records. A later record for a slot replaces an
+        earlier one, and a record with an entry of None removes the slot.
+        """
+
+        index = { }
+
+        try:
+            with open(self.index_filename, "rb") as f:
+
+                if cPickle.load(f) != INDEX_VERSION:
+                    return index
+
+                records = 0
+
+                while True:
+                    pos = f.tell()
+
+                    try:
+                        slotname, entry = cPickle.load(f)
+                    except:
+                        break
+
+                    records += 1
+
+                    if entry is None:
+                        index.pop(slotname, None)
+                    else:
+                        index[slotname] = entry
+
+                # A record that was being written when the game quit is
+                # left at the end of the file, so it has to be rewritten.
+                f.seek(0, 2)
+
+                if f.tell() == pos:
+                    self.index_records = records
+
+        except:
+            pass
+
+        return index
+
+    def save_index(self):
+        """
+        Writes the changes to the slot index to disk. Usually, this appends
+        a record for each changed slot to the index file. When most of the
+        records in the file are out of date, the file is rewritten.
         """
 
         with disk_lock:
 
-            try:
-                filename = self.filename(slotname)
-                zf = zipfile.ZipFile(filename, "r")
-            except:
-                return None
+            changed = self.index_changed
+            self.index_changed = set()
 
-            try:
+            fn = self.index_filename
 
-                try:
-                    data = zf.read("json")
-                    data = json.loads(data)
-                    return data
-                except:
-                    pass
+            if (self.index_records is not None) and (self.index_records + len(changed) <= 2 * len(self.index) + INDEX_SLACK):
 
                 try:
-                    extra_info = zf.read("extra_info").decode("utf-8")
-                    return { "_save_name" : extra_info }
+                    with open(fn, "ab") as f:
+                        for slotname in changed:
+                            cPickle.dump((slotname, self.index.get(slotname, None)), f, cPickle.HIGHEST_PROTOCOL)
+
+                    self.index_records += len(changed)
+                    return
+
                 except:
                     pass
 
-                return { }
+            self.index_records = None
 
-            finally:
-                zf.close()
+            fn_new = fn + ".new"
+
+            try:
+                with open(fn_new, "wb") as f:
+                    cPickle.dump(INDEX_VERSION, f, cPickle.HIGHEST_PROTOCOL)
 
+                    for slotname, entry in self.index.iteritems():
+                        cPickle.dump((slotname, entry), f, cPickle.HIGHEST_PROTOCOL)
 
-    def screenshot(self, slotname):
+                safe_rename(fn_new, fn)
+
+                self.index_records = len(self.index)
+
+            except:
+                pass
+
+    def index_entry(self, slotname):
         """
-        Returns a displayable that show the screenshot for this slot.
+        Returns the slot index entry for `slotname`, reading it from the
+        save file if it isn't in the index already.
 
         Returns None if the slot is empty.
         """
@@ -212,6 +507,11 @@ class FileLocation(object):
             if mtime is None:
                 return None
 
+            entry = self.index.get(slotname, None)
+
+            if (entry is not None) and (entry["mtime"] == mtime):
+                return entry
+
             try:
                 filename = self.filename(slotname)
                 zf = zipfile.ZipFile(filename, "r")
@@ -219,20 +519,80 @@ class FileLocation(object):
                 return None
 
             try:
-                png = False
-                zf.getinfo('screenshot.tga')
-            except:
-                png = True
-                zf.getinfo('screenshot.png')
 
-            zf.close()
+                try:
+                    data = json.loads(zf.read("json"))
+                except:
+                    try:
+                        extra_info = zf.read("extra_info").decode("utf-8")
+                        data = { "_save_name" : extra_info }
+                    except:
+                        data = { }
+
+                screenshot_name = None
+                screenshot = None
+
+                for i in [ "screenshot.tga", "screenshot.png" ]:
+                    try:
+                        screenshot = zf.read(i)
+                        screenshot_name = i
+                        break
+                    except:
+                        pass
+
+                try:
+                    version = zf.read("renpy_version")
+                except:
+                    version = None
+
+            finally:
+                zf.close()
+
+            entry = {
+                "mtime" : mtime,
+                "json" : data,
+                "screenshot_name" : screenshot_name,
+                "screenshot" : screenshot,
+                "version" : version,
+                }
 
-            if png:
-                screenshot = renpy.display.im.ZipFileImage(filename, "screenshot.png", mtime)
-            else:
-                screenshot = renpy.display.im.ZipFileImage(filename, "screenshot.tga", mtime)
+            self.index[slotname] = entry
+            self.index_changed.add(slotname)
 
-            return screenshot
+            return entry
+
+    def json(self, slotname):
+        """
+        Returns the JSON data for slotname.
+
+        Returns None if the slot is empty.
+        """
+
+        entry = self.index_entry(slotname)
+
+        if entry is None:
+            return None
+
+        return entry["json"]
+
+
+    def screenshot(self, slotname):
+        """
+        Returns a displayable that show the screenshot for this slot.
+
+        Returns None if the slot is empty.
+        """
+
+        entry = self.index_entry(slotname)
+
+        if (entry is None) or (entry["screenshot"] is None):
+            return None
+
+        return renpy.display.im.ZipFileImage(
+            self.filename(slotname),
+            entry["screenshot_name"],
+            entry["mtime"],
+            data=entry["screenshot"])
 
     def load(self, slotname):
         """
@@ -261,6 +621,9 @@ class FileLocation(object):
             if os.path.exists(filename):
                 os.unlink(filename)
 
+            if self.index.pop(slotname, None) is not None:
+                self.index_changed.add(slotname)
+
             self.scan()
 
 
@@ -271,6 +634,9 @@ class FileLocation(object):
 
         with disk_lock:
 
+            old_slotname = old
+            new_slotname = new
+
             old = self.filename(old)
             new = self.filename(new)
 
@@ -282,6 +648,15 @@ class FileLocation(object):
 
             os.rename(old, new)
 
+            entry = self.index.pop(old_slotname, None)
+            self.index.pop(new_slotname, None)
+
+            if entry is not None:
+                self.index[new_slotname] = entry
+
+            self.index_changed.add(old_slotname)
+            self.index_changed.add(new_slotname)
+
             self.scan()
 
     def copy(self, old, new):
@@ -290,6 +665,10 @@ class FileLocation(object):
         """
 
         with disk_lock:
+
+            old_slotname = old
+            new_slotname = new
+
             old = self.filename(old)
             new = self.filename(new)
 
@@ -298,6 +677,16 @@ class FileLocation(object):
 
             shutil.copyfile(old, new)
 
+            entry = self.index.get(old_slotname, None)
+            self.index.pop(new_slotname, None)
+
+            if entry is not None:
+                entry = dict(entry)
+                entry["mtime"] = os.path.getmtime(new)
+                self.index[new_slotname] = entry
+
+            self.index_changed.add(new_slotname)
+
             self.scan()
 
     def load_persistent(self):
@@ -315,7 +704,8 @@ class FileLocation(object):
     def save_persistent(self, data):
         """
         Saves `data` as the persistent data. Data is a binary string giving
-        the persistent data in python format.
+        the persistent data in python format. As the data includes all
+        the changes in the journal, the journal is removed.
         """
 
         with disk_lock:
@@ -328,9 +718,52 @@ class FileLocation(object):
 
             with open(fn_new, "wb") as f:
                 f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
 
             safe_rename(fn_new, fn)
 
+            try:
+                os.unlink(self.persistent_journal)
+            except:
+                pass
+
+            self.journal_size = 0
+
+    def append_persistent(self, record):
+        """
+        Appends `record`, a binary string containing changes to the
+        persistent data, to the journal.
+        """
+
+        with disk_lock:
+
+            if not self.active:
+                return
+
+            with open(self.persistent_journal, "ab") as f:
+                f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.journal_size += len(record)
+
+    def needs_persistent_snapshot(self):
+        """
+        Returns True if the next save of the persistent data should write
+        the persistent file, rather than appending to the journal. That's
+        the case when the persistent file doesn't exist, or the journal
+        has grown larger than config.persistent_journal_size.
+        """
+
+        if not self.active:
+            return False
+
+        if not os.path.exists(self.persistent):
+            return True
+
+        return self.journal_size > renpy.config.persistent_journal_size
+
     def unlink_persistent(self):
 
         if not self.active:
@@ -341,6 +774,11 @@ class FileLocation(object):
         except:
             pass
 
+        try:
+            os.unlink(self.persistent_journal)
+        except:
+            pass
+
     def __eq__(self, other):
         if not isinstance(other, FileLocation):
             return False
@@ -463,6 +901,19 @@ class MultiLocation(object):
         for l in self.active_locations():
             l.save_persistent(data)
 
+    def append_persistent(self, record):
+
+        for l in self.active_locations():
+            l.append_persistent(record)
+
+    def needs_persistent_snapshot(self):
+
+        for l in self.active_locations():
+            if l.needs_persistent_snapshot():
+                return True
+
+        return False
+
     def unlink_persistent(self):
 
         for l in self.active_locations():
@@ -475,6 +926,34 @@ class MultiLocation(object):
         for l in self.locations:
             l.scan()
 
+    def poll(self):
+        for l in self.locations:
+            l.poll()
+
+    def watch_fileno(self):
+        # Returns a list of file descriptors to wait on, or None if a
+        # location has to be polled.
+
+        rv = [ ]
+
+        for l in self.active_locations():
+            fd = l.watch_fileno()
+
+            if fd is None:
+                return None
+
+            rv.append(fd)
+
+        return rv
+
+    def close(self):
+        for l in self.locations:
+            l.close()
+
+    @property
+    def changes(self):
+        return sum(l.changes for l in self.locations)
+
     def __eq__(self, other):
         if not isinstance(other, MultiLocation):
             return False
@@ -491,6 +970,9 @@ quit_scan_thread = False
 # The condition we wait on.
 scan_thread_condition = threading.Condition()
 
+# A pipe that's written to to wake up a scan thread waiting on watchers.
+quit_pipe = None
+
 def run_scan_thread():
     global quit_scan_thread
 
@@ -499,24 +981,49 @@ def run_scan_thread():
     while not quit_scan_thread:
 
         try:
-            renpy.loadsave.location.scan()  # @UndefinedVariable
+            renpy.loadsave.location.poll()  # @UndefinedVariable
         except:
             pass
 
-        with scan_thread_condition:
-            scan_thread_condition.wait(5.0)
+        try:
+            fds = renpy.loadsave.location.watch_fileno()  # @UndefinedVariable
+        except:
+            fds = None
+
+        if fds is None:
+            with scan_thread_condition:
+                if not quit_scan_thread:
+                    scan_thread_condition.wait(5.0)
+
+        else:
+            try:
+                select.select(fds + [ quit_pipe[0] ], [ ], [ ], 60.0)
+            except:
+                with scan_thread_condition:
+                    if not quit_scan_thread:
+                        scan_thread_condition.wait(5.0)
 
 def quit():  # @ReservedAssignment
     global quit_scan_thread
+    global quit_pipe
 
     with scan_thread_condition:
         quit_scan_thread = True
         scan_thread_condition.notifyAll()
 
+    os.write(quit_pipe[1], "q")
+
     scan_thread.join()
 
+    os.close(quit_pipe[0])
+    os.close(quit_pipe[1])
+    quit_pipe = None
+
+    renpy.loadsave.location.close()  # @UndefinedVariable
+
 def init():
     global scan_thread
+    global quit_pipe
 
     location = MultiLocation()
 
@@ -533,6 +1040,8 @@ def init():
 
     renpy.loadsave.location = location
 
+    quit_pipe = os.pipe()
+
     scan_thread = threading.Thread(target=run_scan_thread)
     scan_thread.start()
 
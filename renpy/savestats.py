@@ -0,0 +1,426 @@
+# Copyright 2004-2015 Tom Rothamel <pytom@bishoujo.us>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# This file contains code that measures what takes up space in a save file,
+# by pickling the game state the way a save does and accounting the bytes
+# written to the objects that wrote them, and the savestats command that
+# reports this as JSON.
+
+import heapq
+import json
+import pickle
+import sys
+
+import renpy
+
+
+class Counter(object):
+    """
+    A file-like object that counts the bytes written to it, and discards
+    them.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def write(self, s):
+        self.count += len(s)
+
+
+class Frame(object):
+    """
+    An object that is being pickled.
+    """
+
+    def __init__(self, path, kind):
+
+        # The path to the object, from the root.
+        self.path = path
+
+        # "list" if the children of the object are items in a sequence,
+        # "dict" if they are alternating keys and values, "attrs" if they
+        # are the keys and values of an object's state, and "object" if the
+        # children are part of the object's reduction.
+        self.kind = kind
+
+        # True if the object is pickled by reduction, in which case state
+        # is the state from the reduction.
+        self.reduced = False
+        self.state = None
+
+        # The number of children that have been pickled so far.
+        self.index = 0
+
+        # The most recently pickled key, for dicts.
+        self.key = None
+
+        # The number of bytes written by children of the object.
+        self.children = 0
+
+
+class SizePickler(pickle.Pickler):
+    """
+    A pickler that accounts the bytes it writes to the objects being
+    pickled. Each object is charged for the bytes written while pickling
+    it, and the objects it refers to that haven't been pickled before.
+    """
+
+    def __init__(self, top=50, rollbacks=[ ]):
+
+        self.counter = Counter()
+        pickle.Pickler.__init__(self, self.counter, pickle.HIGHEST_PROTOCOL)
+
+        # A list of frames, for the objects being pickled.
+        self.stack = [ ]
+
+        # The path of the root that's being pickled.
+        self.root = ""
+
+        # The number of paths to report.
+        self.top = top
+
+        # A heap of (size, path, type) tuples, giving the heaviest paths.
+        self.heaviest = [ ]
+
+        # A map from type name to the number of bytes written by objects of
+        # that type, not including the objects they refer to.
+        self.types = { }
+
+        # A map from id(rollback) to the index of that rollback in the log.
+        self.rollback_index = dict((id(rb), i) for i, rb in enumerate(rollbacks))
+
+        # A map from the index of a rollback to the number of bytes it is
+        # charged.
+        self.rollback_sizes = { }
+
+    def dump_root(self, name, o):
+        """
+        Pickles `o`, the root called `name`, and returns the number of bytes
+        it's charged.
+        """
+
+        self.root = name
+
+        start = self.counter.count
+        self.dump(o)
+
+        return self.counter.count - start
+
+    def child_path(self, o):
+        """
+        Returns the path to `o`, which is about to be pickled, and the kind
+        of the frame for `o`.
+        """
+
+        if isinstance(o, tuple):
+            kind = "list"
+        else:
+            kind = "object"
+
+        if not self.stack:
+            return self.root, kind
+
+        parent = self.stack[-1]
+        index = parent.index
+        parent.index += 1
+
+        if parent.kind == "list":
+            return u"{}[{}]".format(parent.path, index), kind
+
+        elif parent.kind in ("dict", "attrs"):
+
+            # Keys are charged to the dict.
+            if index % 2 == 0:
+                parent.key = o
+                return parent.path, kind
+
+            key = parent.key
+
+            if (parent.kind == "attrs") and isinstance(key, basestring):
+                return u"{}.{}".format(parent.path, key), kind
+            else:
+                return u"{}[{!r}]".format(parent.path, key), kind
+
+        else:
+
+            # The parts of an object's reduction are charged to the object,
+            # except for its state, which is a dict of its fields.
+            if parent.reduced and (o is not parent.state):
+                return parent.path, "object"
+
+            if type(o) is dict:
+                kind = "attrs"
+            elif isinstance(o, tuple):
+                kind = "object"
+
+            return parent.path, kind
+
+    def save(self, o):
+
+        path, kind = self.child_path(o)
+
+        frame = Frame(path, kind)
+        self.stack.append(frame)
+
+        start = self.counter.count
+
+        try:
+            pickle.Pickler.save(self, o)
+        finally:
+            self.stack.pop()
+
+        size = self.counter.count - start
+
+        if not size:
+            return
+
+        if self.stack:
+            parent = self.stack[-1]
+            parent.children += size
+            parent_path = parent.path
+        else:
+            parent_path = None
+
+        t = type(o)
+
+        if t.__module__ == "__builtin__":
+            type_name = t.__name__
+        else:
+            type_name = t.__module__ + "." + t.__name__
+
+        self.types[type_name] = self.types.get(type_name, 0) + size - frame.children
+
+        if path != parent_path:
+            entry = (size, path, type_name)
+
+            if len(self.heaviest) < self.top:
+                heapq.heappush(self.heaviest, entry)
+            else:
+                heapq.heappushpop(self.heaviest, entry)
+
+        index = self.rollback_index.get(id(o), None)
+
+        if index is not None:
+            self.rollback_sizes[index] = self.rollback_sizes.get(index, 0) + size
+
+    def save_reduce(self, func, args, state=None, listitems=None, dictitems=None, obj=None):
+        frame = self.stack[-1]
+        frame.reduced = True
+        frame.state = state
+
+        pickle.Pickler.save_reduce(self, func, args, state, listitems, dictitems, obj)
+
+    def _batch_appends(self, items):
+        frame = self.stack[-1]
+        old_kind = frame.kind
+
+        # The items are counted from 0, even if the reduction of a list
+        # subclass was pickled first.
+        frame.kind = "list"
+        frame.index = 0
+
+        try:
+            pickle.Pickler._batch_appends(self, items)
+        finally:
+            frame.kind = old_kind
+
+    def _batch_setitems(self, items):
+        frame = self.stack[-1]
+        old_kind = frame.kind
+
+        if frame.kind != "attrs":
+            frame.kind = "dict"
+
+        frame.index = 0
+
+        try:
+            pickle.Pickler._batch_setitems(self, items)
+        finally:
+            frame.kind = old_kind
+
+
+def statement_name(name):
+    """
+    Returns the name of a statement in a form that can be stored in JSON.
+    """
+
+    if isinstance(name, basestring):
+        return name
+
+    return repr(name)
+
+
+def stats(roots, log, top=50):
+    """
+    Pickles `roots` and `log` as a save of the game does, and returns a
+    dictionary, suitable for conversion to JSON, describing how many of the
+    pickled bytes are used by each root, type, path, and rollback.
+
+    Each object is charged to the first root or path it's pickled under,
+    and to the first rollback that refers to it. Objects shared with the
+    roots are charged to the roots, as they're pickled first.
+    """
+
+    pickler = SizePickler(top, log.log)
+
+    root_sizes = { }
+
+    for name, o in roots.iteritems():
+        root_sizes[name] = pickler.dump_root(name, o)
+
+    root_sizes["log"] = pickler.dump_root("log", log)
+
+    heaviest = sorted(pickler.heaviest, reverse=True)
+
+    rollbacks = [ ]
+
+    for i, rb in enumerate(log.log):
+        rollbacks.append({
+            "index" : i,
+            "statement" : statement_name(rb.context.current),
+            "checkpoint" : rb.checkpoint,
+            "bytes" : pickler.rollback_sizes.get(i, 0),
+            })
+
+    return {
+        "total" : pickler.counter.count,
+        "roots" : root_sizes,
+        "types" : pickler.types,
+        "heaviest" : [ { "path" : path, "type" : t, "bytes" : size } for size, path, t in heaviest ],
+        "rollback" : rollbacks,
+        }
+
+
+class MissingSlot(Exception):
+    """
+    Raised by slot_stats when the slot is empty.
+    """
+
+
+def slot_stats(slotname, top=50):
+    """
+    Returns the statistics described in stats for the save in `slotname`,
+    without loading the game from it. The size of the pickled data in the
+    save file is given as "save_bytes".
+
+    Raises MissingSlot if there is no save in `slotname`.
+    """
+
+    if renpy.loadsave.location.mtime(slotname) is None:
+        raise MissingSlot("There is no save in slot {!r}.".format(slotname))
+
+    data = renpy.loadsave.location.load(slotname)
+    roots, log = renpy.loadsave.loads(data)
+
+    rv = stats(roots, log, top)
+    rv["slot"] = slotname
+    rv["save_bytes"] = len(data)
+
+    return rv
+
+
+def current_stats(top=50):
+    """
+    Returns the statistics described in stats for the current state of the
+    game, as it would be saved.
+    """
+
+    renpy.loadsave.background_save_not_running.wait()
+
+    roots = renpy.game.log.freeze(None)
+
+    try:
+        rv = stats(roots, renpy.game.log, top)
+    finally:
+        renpy.game.log.discard_freeze()
+
+    rv["slot"] = None
+
+    return rv
+
+
+def diff_sizes(a, b):
+    """
+    Given two maps from name to size, returns a map from each name with a
+    different size to a dict giving the old size, new size, and change.
+    """
+
+    rv = { }
+
+    for k in set(a) | set(b):
+        old = a.get(k, 0)
+        new = b.get(k, 0)
+
+        if old != new:
+            rv[k] = { "a" : old, "b" : new, "change" : new - old }
+
+    return rv
+
+
+def diff(a, b):
+    """
+    Given `a` and `b`, two dictionaries returned by stats, returns a
+    dictionary describing how the sizes changed from `a` to `b`.
+    """
+
+    return {
+        "a" : a.get("slot", None),
+        "b" : b.get("slot", None),
+        "total" : { "a" : a["total"], "b" : b["total"], "change" : b["total"] - a["total"] },
+        "roots" : diff_sizes(a["roots"], b["roots"]),
+        "types" : diff_sizes(a["types"], b["types"]),
+        "rollback" : { "a" : len(a["rollback"]), "b" : len(b["rollback"]) },
+        }
+
+
+def savestats_command():
+    """
+    The savestats command. This reports what takes up space in a save
+    slot, or how two save slots differ, as JSON.
+    """
+
+    ap = renpy.arguments.ArgumentParser(description="Reports what takes up space in a save file, as JSON.")
+    ap.add_argument("slot", help="The save slot to report on.")
+    ap.add_argument("--diff", dest="other", default=None, metavar="SLOT", help="Reports how SLOT differs from the first slot, instead.")
+    ap.add_argument("--top", type=int, default=50, help="The number of heaviest paths to report. Defaults to 50.")
+    ap.add_argument("--json", dest="json_file", default=None, metavar="FILE", help="Writes the report to FILE, rather than standard output.")
+
+    args = ap.parse_args()
+
+    try:
+        rv = slot_stats(args.slot, args.top)
+
+        if args.other is not None:
+            rv = diff(rv, slot_stats(args.other, args.top))
+
+    except MissingSlot as e:
+        ap.error(str(e))
+
+    if args.json_file:
+        with open(args.json_file, "w") as f:
+            json.dump(rv, f, indent=2, sort_keys=True)
+    else:
+        json.dump(rv, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+    return False
+
+renpy.arguments.register_command("savestats", savestats_command)
@@ -25,6 +25,7 @@
 import renpy
 
 import os
+import re
 import imp
 import difflib
 import md5
@@ -32,6 +33,7 @@ import time
 import marshal
 import struct
 import zlib
+import threading
 
 from cPickle import loads, dumps
 import shutil
@@ -48,15 +50,273 @@ MAGIC = imp.get_magic()
 # A string at the start of each rpycv2 file.
 RPYC2_HEADER = "RENPY RPC2"
 
+# A string at the start of each rpycv3 file. Version 3 files give the codec
+# used for each slot, and contain slot 2 and the lazy loading index in slot 3.
+# Slot 1 is recovered from slot 2 with renpy.translation.unrestructure.
+RPYC3_HEADER = "RENPY RPC3"
+
+# The codecs a slot of an rpycv3 file can be stored with.
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+
+# The zlib level .rpyc files are compressed with, unless --rpyc-compression
+# is given.
+RPYC_COMPRESSION = 1
+
+# The maximum number of threads writing .rpyc files at once.
+RPYC_WRITE_THREADS = 4
+
 # A string
 BYTECODE_FILE = "cache/bytecode.rpyb"
 
+# The pattern used to name the shards of the bytecode cache. Each shard
+# holds the entries whose keys have a given first hash byte.
+BYTECODE_SHARD = "cache/bytecode-%02x.rpyb"
+
+# The number of chunks that can be appended to a shard before it is
+# compacted.
+BYTECODE_COMPACT_CHUNKS = 8
+
 class ScriptError(Exception):
     """
     Exception that is raised if the script is somehow inconsistent,
     or otherwise wrong.
     """
 
+# Matches the first word of a logical line.
+first_word_re = re.compile(r"\s*(" + renpy.parser.word_regexp + ")")
+
+def first_words(fn):
+    """
+    Returns the set of words that begin the logical lines of the .rpy file
+    `fn`.
+    """
+
+    rv = set()
+
+    for _filename, _linenumber, text in renpy.parser.list_logical_lines(fn):
+        m = first_word_re.match(text)
+
+        if m:
+            rv.add(m.group(1))
+
+    return rv
+
+def parse_worker(fn):
+    """
+    Parses the .rpy file `fn` in a worker process. Returns a pickled
+    (stmts, lines, missing, words) tuple, where `lines` and `missing` are
+    the entries the parse added to renpy.scriptedit.lines and
+    renpy.add_from.missing, respectively, and `words` is the set of words
+    that begin the logical lines of the file.
+
+    Returns None if the file could not be parsed, in which case the main
+    process should parse it itself, to report the errors in order.
+    """
+
+    try:
+
+        renpy.parser.parse_errors = [ ]
+        renpy.scriptedit.lines.clear()
+        renpy.add_from.missing.clear()
+
+        stmts = renpy.parser.parse(fn)
+
+        if stmts is None:
+            return None
+
+        words = first_words(fn)
+
+        return dumps((stmts, dict(renpy.scriptedit.lines), dict(renpy.add_from.missing), words), 2)
+
+    except:
+        return None
+
+
+class BytecodeShard(object):
+    """
+    A shard of the bytecode cache. On disk, a shard is a series of chunks,
+    each a length followed by a compressed pickle of a (version, entries)
+    tuple. New entries are appended to the shard as a new chunk, and the
+    shard is rewritten with only the entries in use when it has
+    accumulated too many chunks or unused entries.
+    """
+
+    def __init__(self, index):
+
+        self.filename = BYTECODE_SHARD % index
+
+        # A map from key to marshalled code object.
+        self.entries = { }
+
+        # The number of chunks in the file.
+        self.chunks = 0
+
+        # Entries that have not been written to disk.
+        self.new = { }
+
+        # The keys that have been looked up.
+        self.used = set()
+
+        self.load()
+
+    def load(self):
+
+        try:
+            f = renpy.loader.load(self.filename)
+            data = f.read()
+            f.close()
+        except:
+            return
+
+        pos = 0
+
+        while pos + 4 <= len(data):
+            length, = struct.unpack("<I", data[pos:pos + 4])
+            pos += 4
+
+            chunk = data[pos:pos + length]
+            pos += length
+
+            # A partial chunk, left by an interrupted append.
+            if len(chunk) != length:
+                break
+
+            try:
+                version, entries = loads(zlib.decompress(chunk))
+            except:
+                break
+
+            self.chunks += 1
+
+            if version == BYTECODE_VERSION:
+                self.entries.update(entries)
+
+    def get(self, key):
+        """
+        Returns the code for `key`, or None if it isn't in the shard.
+        """
+
+        self.used.add(key)
+        return self.entries.get(key, None)
+
+    def add(self, key, code):
+        self.used.add(key)
+        self.entries[key] = code
+        self.new[key] = code
+
+    def needs_compact(self, prune):
+        if self.chunks >= BYTECODE_COMPACT_CHUNKS:
+            return True
+
+        return prune and (len(self.entries) > 2 * len(self.used))
+
+    def chunk(self, entries):
+        data = zlib.compress(dumps((BYTECODE_VERSION, entries), 2), 3)
+        return struct.pack("<I", len(data)) + data
+
+    def save(self, prune=True):
+        """
+        Writes any new entries to disk, compacting the shard if necessary.
+        If `prune` is true, compaction drops the entries that haven't been
+        used.
+        """
+
+        compact = self.needs_compact(prune)
+
+        if not (compact or self.new):
+            return
+
+        fn = renpy.loader.get_path(self.filename)
+
+        # If the shard was loaded from an archive, appending to the file on
+        # disk would lose the entries in the archive.
+        if self.chunks and not os.path.exists(fn):
+            compact = True
+
+        if compact:
+            if prune:
+                entries = dict((k, v) for k, v in self.entries.iteritems() if k in self.used)
+            else:
+                entries = self.entries
+
+            with open(fn + ".new", "wb") as f:
+                f.write(self.chunk(entries))
+
+            renpy.loadsave.safe_rename(fn + ".new", fn)
+
+            self.entries = entries
+            self.chunks = 1
+
+        else:
+
+            with open(fn, "ab") as f:
+                f.write(self.chunk(self.new))
+
+            self.chunks += 1
+
+        self.new = { }
+
+
+def make_lazy_index(stmts):
+    """
+    Returns the lazy loading index of a file containing `stmts`. This is a
+    dict with the following keys:
+
+    `init`
+        True if the file contains statements that must be run or taken when
+        the script is loaded, and so can't be loaded lazily.
+
+    `labels`
+        A list of the labels defined in the file.
+
+    `prefixes`
+        A list of the (filename, version) prefixes of the names Ren'Py
+        generated for statements in the file.
+
+    `translates`
+        A list of (identifier, language) pairs, one for each translate
+        statement in the file.
+    """
+
+    init = False
+    labels = [ ]
+    prefixes = set()
+    translates = [ ]
+
+    for node in collapse_stmts(stmts):
+
+        name = node.name
+
+        if isinstance(name, basestring):
+            labels.append(name)
+        elif isinstance(name, tuple):
+            prefixes.add(name[:2])
+
+        if node.get_init is not None:
+            init = True
+
+        elif isinstance(node, (renpy.ast.TranslateBlock, renpy.ast.TranslatePython)):
+            init = True
+
+        elif node.early_execute is not None:
+
+            # Python statements create their store when loaded, which only
+            # matters for stores other than the default one.
+            if not (isinstance(node, renpy.ast.Python) and node.store == "store"):
+                init = True
+
+        if isinstance(node, renpy.ast.Translate):
+            translates.append((node.identifier, node.language))
+
+    return {
+        "init" : init,
+        "labels" : labels,
+        "prefixes" : list(prefixes),
+        "translates" : translates,
+        }
+
+
 def collapse_stmts(stmts):
     """
     Returns a flat list containing every statement in the tree
@@ -116,10 +376,13 @@ class Script(object):
 
         self.record_pycode = True
 
-        # Bytecode caches.
-        self.bytecode_oldcache = { }
-        self.bytecode_newcache = { }
-        self.bytecode_dirty = False
+        # A map from shard index to the BytecodeShard, for the shards of
+        # the bytecode cache that have been loaded.
+        self.bytecode_shards = { }
+
+        # The monolithic bytecode cache written by older versions of Ren'Py,
+        # or None if it hasn't been loaded.
+        self.bytecode_legacy = None
 
         self.translator = renpy.translation.ScriptTranslator()
 
@@ -135,6 +398,32 @@ class Script(object):
         self.loaded_rpy = False
         self.backup_list = [ ]
 
+        # A map from the full path of a .rpy file to the result of parsing
+        # that file in a worker process.
+        self.parse_results = { }
+
+        # The names of the creator-defined statements that were registered
+        # when the parse pool was started.
+        self.parse_pool_statements = set()
+
+        # A map from the full path of a .rpy file to its digest, computed
+        # while deciding which files to parse in worker processes.
+        self.rpy_digests = { }
+
+        # Threads that are compressing and writing .rpyc files.
+        self.write_threads = [ ]
+
+        # A map from the (fn, dir) of a script file that is being loaded
+        # lazily, and hasn't been loaded yet, to its lazy loading index.
+        self.lazy_files = { }
+
+        # Maps from a label, a (filename, version) name prefix, and an
+        # (identifier, language) pair to the (fn, dir) of the lazy file
+        # that defines it.
+        self.lazy_labels = { }
+        self.lazy_prefixes = { }
+        self.lazy_translates = { }
+
     def choose_backupdir(self):
 
         if renpy.mobile:
@@ -246,6 +535,133 @@ class Script(object):
             if (fn, dir) not in target:
                 target.append((fn, dir))
 
+    def needs_compile(self, dir, fn): #@ReservedAssignment
+        """
+        Returns true if the .rpy file `fn` in `dir` will be parsed when the
+        script is loaded, because its .rpyc file is missing or out of date.
+        """
+
+        if dir is None:
+            return False
+
+        rpyfn = dir + "/" + fn + ".rpy"
+        rpycfn = dir + "/" + fn + ".rpyc"
+
+        if not os.path.exists(rpyfn):
+            return False
+
+        if renpy.game.args.compile: # @UndefinedVariable
+            return True
+
+        try:
+            with open(rpycfn, "rb") as f:
+                f.seek(-md5.digest_size, 2)
+                rpycdigest = f.read(md5.digest_size)
+        except:
+            return True
+
+        with open(rpyfn, "rU") as f:
+            rpydigest = md5.md5(f.read()).digest()
+
+        self.rpy_digests[rpyfn] = rpydigest
+
+        return rpydigest != rpycdigest
+
+    def start_parse_pool(self, script_files):
+        """
+        Starts parsing the .rpy files in `script_files` that need to be
+        compiled in a pool of worker processes, and returns the pool, or
+        None if the files will be parsed in this process.
+
+        The statements are parsed in the workers, but names are assigned and
+        the files are loaded in this process, in order, as load_file is
+        called on each.
+
+        The workers only know the creator-defined statements registered
+        before the pool is started. A file that might use a statement
+        registered later, by python early, is parsed again in this process.
+        """
+
+        if renpy.windows or renpy.mobile:
+            return None
+
+        processes = int(os.environ.get("RENPY_PARSE_PROCESSES", "0"))
+
+        if processes == 1:
+            return None
+
+        stale = [ dir + "/" + fn + ".rpy" for fn, dir in script_files if self.needs_compile(dir, fn) ]
+
+        if len(stale) < 2:
+            return None
+
+        try:
+            import multiprocessing
+
+            if not processes:
+                processes = multiprocessing.cpu_count()
+
+            pool = multiprocessing.Pool(min(processes, len(stale)))
+        except:
+            return None
+
+        self.parse_pool_statements = set(renpy.statements.registry)
+
+        for fn in stale:
+            self.parse_results[fn] = pool.apply_async(parse_worker, (fn,))
+
+        return pool
+
+    def uses_new_statements(self, words):
+        """
+        Returns true if a file whose logical lines begin with `words` might
+        use a creator-defined statement that was registered after the parse
+        pool was started. The workers would have parsed such a statement as
+        something else, most likely a say statement.
+        """
+
+        for name in set(renpy.statements.registry) - self.parse_pool_statements:
+
+            # A new default statement changes how say statements are parsed.
+            if not name:
+                return True
+
+            if name[0] in words:
+                return True
+
+        return False
+
+    def parse(self, fn):
+        """
+        Parses the .rpy file `fn`, using the result from a worker process if
+        one is available.
+        """
+
+        result = self.parse_results.pop(fn, None)
+
+        if result is not None:
+
+            try:
+                bindata = result.get()
+            except:
+                bindata = None
+
+            if bindata is not None:
+                stmts, lines, missing, words = loads(bindata)
+
+                if self.uses_new_statements(words):
+                    return renpy.parser.parse(fn)
+
+                if renpy.game.context().init_phase:
+                    renpy.scriptedit.lines.update(lines)
+
+                for k, v in missing.iteritems():
+                    renpy.add_from.missing[k].extend(v)
+
+                return stmts
+
+        return renpy.parser.parse(fn)
+
     def load_script(self):
 
         script_files = self.script_files
@@ -255,8 +671,24 @@ class Script(object):
 
         initcode = [ ]
 
-        for fn, dir in script_files: #@ReservedAssignment
-            self.load_appropriate_file(".rpyc", ".rpy", dir, fn, initcode)
+        pool = self.start_parse_pool(script_files)
+
+        lazy = renpy.config.lazy_script and (renpy.game.args.command == "run") and not renpy.game.args.compile # @UndefinedVariable
+
+        try:
+            for fn, dir in script_files: #@ReservedAssignment
+                with renpy.startup.span("load script file", file=fn):
+                    self.load_appropriate_file(".rpyc", ".rpy", dir, fn, initcode, lazy)
+
+        finally:
+            self.parse_results.clear()
+            self.rpy_digests.clear()
+
+            self.finish_writes()
+
+            if pool is not None:
+                pool.terminate()
+                pool.join()
 
         # Make the sort stable.
         initcode = [ (prio, index, code) for index, (prio, code) in
@@ -281,6 +713,7 @@ class Script(object):
         initcode = [ ]
 
         self.load_appropriate_file(".rpymc", ".rpym", dir, fn, initcode)
+        self.finish_writes()
 
         if renpy.parser.report_parse_errors():
             raise SystemExit(-1)
@@ -440,29 +873,49 @@ class Script(object):
 
     def write_rpyc_header(self, f):
         """
-        Writes an empty version 2 .rpyc header to the open binary file `f`.
+        Writes an empty version 3 .rpyc header to the open binary file `f`.
         """
 
-        f.write(RPYC2_HEADER)
+        f.write(RPYC3_HEADER)
 
         for _i in range(3):
-            f.write(struct.pack("III", 0, 0, 0))
+            f.write(struct.pack("IIII", 0, 0, 0, 0))
 
 
     def write_rpyc_data(self, f, slot, data):
         """
-        Writes data into `slot` of a .rpyc file. The data should be a binary
-        string, and is compressed before being written.
+        Writes data into `slot` of a .rpyc file, which must be open for
+        reading and writing. The data should be a binary string, and is
+        compressed before being written.
         """
 
+        level = renpy.game.args.rpyc_compression # @UndefinedVariable
+
+        if level is None:
+            level = RPYC_COMPRESSION
+
+        if level > 0:
+            codec = CODEC_ZLIB
+            data = zlib.compress(data, level)
+        else:
+            codec = CODEC_NONE
+
+        # Find the first unused entry in the header.
+        f.seek(len(RPYC3_HEADER), 0)
+        entries = f.read(16 * 3)
+
+        entry = 0
+
+        while struct.unpack("IIII", entries[entry * 16:entry * 16 + 16])[0]:
+            entry += 1
+
         f.seek(0, 2)
 
         start = f.tell()
-        data = zlib.compress(data, 9)
         f.write(data)
 
-        f.seek(len(RPYC2_HEADER) + 12 * (slot - 1), 0)
-        f.write(struct.pack("III", slot, start, len(data)))
+        f.seek(len(RPYC3_HEADER) + 16 * entry, 0)
+        f.write(struct.pack("IIII", slot, start, len(data), codec))
 
         f.seek(0, 2)
 
@@ -474,10 +927,47 @@ class Script(object):
         f.seek(0, 2)
         f.write(digest)
 
+    def write_rpyc(self, rpycfn, bindata, digest, lazydata):
+        """
+        Writes the .rpyc file `rpycfn`, containing `bindata` in slot 2,
+        `lazydata` in slot 3, and ending with `digest`. Compression and
+        writing happen in a background thread, which is waited for by
+        finish_writes.
+        """
+
+        def write():
+            try:
+                with open(rpycfn, "w+b") as f:
+                    self.write_rpyc_header(f)
+                    self.write_rpyc_data(f, 2, bindata)
+                    self.write_rpyc_data(f, 3, lazydata)
+                    self.write_rpyc_md5(f, digest)
+            except:
+                pass
+
+        if len(self.write_threads) >= RPYC_WRITE_THREADS:
+            self.write_threads.pop(0).join()
+
+        t = threading.Thread(target=write)
+        t.start()
+
+        self.write_threads.append(t)
+
+    def finish_writes(self):
+        """
+        Waits for all .rpyc files to be written.
+        """
+
+        for t in self.write_threads:
+            t.join()
+
+        self.write_threads = [ ]
+
     def read_rpyc_data(self, f, slot):
         """
-        Reads the binary data from `slot` in a .rpyc (v1 or v2) file. Returns
-        the data if the slot exists, or None if the slot does not exist.
+        Reads the binary data from `slot` in a .rpyc (v1, v2, or v3) file.
+        Returns the data if the slot exists, or None if the slot does not
+        exist.
         """
 
         # f.seek(0)
@@ -485,6 +975,32 @@ class Script(object):
 
         # header = f.read(len(RPYC2_HEADER))
 
+        if header_data[:len(RPYC3_HEADER)] == RPYC3_HEADER:
+
+            # RPYC3 path.
+            pos = len(RPYC3_HEADER)
+
+            while True:
+                header_slot, start, length, codec = struct.unpack("IIII", header_data[pos:pos+16])
+
+                if slot == header_slot:
+                    break
+
+                if header_slot == 0:
+                    return None
+
+                pos += 16
+
+            f.seek(start)
+            data = f.read(length)
+
+            if codec == CODEC_ZLIB:
+                return zlib.decompress(data)
+            elif codec == CODEC_NONE:
+                return data
+            else:
+                raise Exception("Unknown rpyc codec %d." % codec)
+
         # Legacy path.
         if header_data[:len(RPYC2_HEADER)] != RPYC2_HEADER:
             if slot != 1:
@@ -535,7 +1051,8 @@ class Script(object):
             fullfn = dir + "/" + fn
             rpycfn = fullfn + "c"
 
-            stmts = renpy.parser.parse(fullfn)
+            with renpy.startup.span("parse", file=fn):
+                stmts = self.parse(fullfn)
 
             data = { }
             data['version'] = script_version
@@ -549,11 +1066,21 @@ class Script(object):
             try:
                 self.record_pycode = False
 
+                restructured = False
+
                 with open(rpycfn, "rb") as rpycf:
                     bindata = self.read_rpyc_data(rpycf, 1)
 
+                    if bindata is None:
+                        rpycf.seek(0)
+                        bindata = self.read_rpyc_data(rpycf, 2)
+                        restructured = True
+
                 old_data, old_stmts = loads(bindata)
 
+                if restructured:
+                    renpy.translation.unrestructure(old_stmts)
+
                 self.merge_names(old_stmts, stmts)
 
                 del old_data
@@ -564,26 +1091,18 @@ class Script(object):
                 self.record_pycode = True
 
             self.assign_names(stmts, fullfn)
-
-            try:
-                f = file(rpycfn, "wb")
-
-                self.write_rpyc_header(f)
-                self.write_rpyc_data(f, 1, dumps((data, stmts), 2))
-            except:
-                pass
-
             self.static_transforms(stmts)
 
+            # The statements are only pickled once, into slot 2. Slot 1 is
+            # recovered from it when needed.
             try:
-                self.write_rpyc_data(f, 2, dumps((data, stmts), 2))
+                bindata = dumps((data, stmts), 2)
+                lazydata = dumps(make_lazy_index(stmts), 2)
 
                 with open(fullfn, "rU") as fullf:
                     rpydigest = md5.md5(fullf.read()).digest()
 
-                self.write_rpyc_md5(f, rpydigest)
-
-                f.close()
+                self.write_rpyc(rpycfn, bindata, rpydigest, lazydata)
             except:
                 pass
 
@@ -600,10 +1119,13 @@ class Script(object):
 
                 for slot in [ 2, 1 ]:
                     try:
-                        bindata = self.read_rpyc_data(f, slot)
+                        with renpy.startup.span("load rpyc", file=fn, slot=slot):
+                            bindata = self.read_rpyc_data(f, slot)
+
+                            if bindata:
+                                data, stmts = loads(bindata)
 
                         if bindata:
-                            data, stmts = loads(bindata)
                             break
 
                     except:
@@ -638,7 +1160,7 @@ class Script(object):
 
         return data, stmts
 
-    def load_appropriate_file(self, compiled, source, dir, fn, initcode): #@ReservedAssignment
+    def load_appropriate_file(self, compiled, source, dir, fn, initcode, lazy=False): #@ReservedAssignment
         # This can only be a .rpyc file, since we're loading it
         # from an archive.
 
@@ -646,16 +1168,20 @@ class Script(object):
 
             rpyfn = fn + source
             lastfn = fn + compiled
-            data, stmts = self.load_file(dir, fn + compiled)
-
-            if data is None:
-                raise Exception("Could not load from archive %s." % (lastfn,))
 
             f = renpy.loader.load(fn + compiled)
             f.seek(-md5.digest_size, 2)
             digest = f.read(md5.digest_size)
             f.close()
 
+            if lazy and self.defer_file(fn, dir, compiled, digest):
+                return
+
+            data, stmts = self.load_file(dir, fn + compiled)
+
+            if data is None:
+                raise Exception("Could not load from archive %s." % (lastfn,))
+
         else:
 
             # Otherwise, we're loading from disk. So we need to decide if
@@ -665,7 +1191,9 @@ class Script(object):
 
             renpy.loader.add_auto(rpyfn)
 
-            if os.path.exists(rpyfn):
+            if rpyfn in self.rpy_digests:
+                rpydigest = self.rpy_digests.pop(rpyfn)
+            elif os.path.exists(rpyfn):
                 with open(rpyfn, "rU") as f:
                     rpydigest = md5.md5(f.read()).digest()
             else:
@@ -681,6 +1209,12 @@ class Script(object):
             except:
                 rpycdigest = None
 
+            # Defer loading an up-to-date .rpyc file, if we can.
+            if lazy and (rpycdigest is not None) and (rpydigest in (None, rpycdigest)):
+                if self.defer_file(fn, dir, compiled, rpycdigest):
+                    self.backup_list.append((rpyfn, rpycdigest))
+                    return
+
             if os.path.exists(rpyfn) and os.path.exists(rpycfn):
 
                 # Are we forcing a compile?
@@ -739,19 +1273,181 @@ class Script(object):
 
         self.digest.update(digest)
 
-
-    def init_bytecode(self):
+    def defer_file(self, fn, dir, compiled, digest): #@ReservedAssignment
         """
-        Init/Loads the bytecode cache.
+        Tries to defer loading the compiled script file `fn` until it is
+        first used. Returns true if the file has been deferred, or false if
+        it has no lazy loading index or contains init code, and so has to be
+        loaded now.
         """
 
-        # Load the oldcache.
         try:
-            version, cache = loads(renpy.loader.load(BYTECODE_FILE).read().decode("zlib"))
-            if version == BYTECODE_VERSION:
-                self.bytecode_oldcache = cache
+            f = renpy.loader.load(fn + compiled)
+
+            try:
+                lazydata = self.read_rpyc_data(f, 3)
+            finally:
+                f.close()
+
+            if lazydata is None:
+                return False
+
+            index = loads(lazydata)
         except:
-            pass
+            return False
+
+        if index["init"]:
+            return False
+
+        key = (fn, dir)
+
+        self.lazy_files[key] = index
+
+        for i in index["labels"]:
+            self.lazy_labels[i] = key
+
+        for i in index["prefixes"]:
+            self.lazy_prefixes[i] = key
+
+        for identifier, language in index["translates"]:
+            self.lazy_translates[identifier, language] = key
+
+            if language is None:
+                self.translator.lazy_identifiers.add(identifier)
+            else:
+                self.translator.languages.add(language)
+
+        self.digest.update(digest)
+
+        return True
+
+    def load_lazy(self, key):
+        """
+        Loads the lazy file with `key`, a (fn, dir) tuple, if it hasn't
+        been loaded yet.
+        """
+
+        if self.lazy_files.pop(key, None) is None:
+            return
+
+        fn, dir = key #@ReservedAssignment
+
+        old_ei = renpy.game.exception_info
+        renpy.game.exception_info = "While loading %s." % (fn + ".rpyc")
+
+        try:
+            data, stmts = self.load_file(dir, fn + ".rpyc")
+
+            if data is None:
+                raise Exception("Could not load file %s." % (fn + ".rpyc"))
+
+            initcode = [ ]
+            self.finish_load(stmts, initcode, filename=fn + ".rpy")
+
+            self.translator.chain_translates()
+
+            # Statements loaded after the init phase have missed the analysis
+            # done at its end, so they're analyzed here.
+            if not renpy.game.context().init_phase:
+                self.analyze()
+                renpy.atl.compile_all()
+
+            self.save_bytecode()
+
+        finally:
+            renpy.game.exception_info = old_ei
+
+    def load_lazy_name(self, name):
+        """
+        Loads the lazy file defining `name`, a label or statement name, if
+        there is one. Returns the node with that name, or None if it can't
+        be found.
+        """
+
+        if isinstance(name, basestring):
+            key = self.lazy_labels.get(name, None)
+        elif isinstance(name, tuple):
+            key = self.lazy_prefixes.get(name[:2], None)
+        else:
+            key = None
+
+        if key in self.lazy_files:
+            self.load_lazy(key)
+
+        return self.namemap.get(name, None)
+
+    def load_lazy_translate(self, identifier, language):
+        """
+        Loads the lazy file containing the translate statement with
+        `identifier` and `language`, if there is one.
+        """
+
+        key = self.lazy_translates.get((identifier, language), None)
+
+        if key in self.lazy_files:
+            self.load_lazy(key)
+
+    def load_all_lazy(self):
+        """
+        Loads every lazy file that hasn't been loaded yet. This is used by
+        code that needs to see the whole script.
+        """
+
+        for key in sorted(self.lazy_files):
+            self.load_lazy(key)
+
+
+    def init_bytecode(self):
+        """
+        Init/Loads the bytecode cache. The shards of the cache are loaded
+        as they are needed, by get_bytecode.
+        """
+
+        self.bytecode_shards = { }
+        self.bytecode_legacy = None
+
+    def get_bytecode(self, key):
+        """
+        Returns the marshalled code for `key` from the bytecode cache, or
+        None if it's not in the cache.
+        """
+
+        index = ord(key[1])
+
+        shard = self.bytecode_shards.get(index, None)
+
+        if shard is None:
+            shard = self.bytecode_shards[index] = BytecodeShard(index)
+
+        rv = shard.get(key)
+
+        if rv is not None:
+            return rv
+
+        # Fall back to the cache written by older versions.
+        if self.bytecode_legacy is None:
+            self.bytecode_legacy = { }
+
+            try:
+                version, cache = loads(renpy.loader.load(BYTECODE_FILE).read().decode("zlib"))
+                if version == BYTECODE_VERSION:
+                    self.bytecode_legacy = cache
+            except:
+                pass
+
+        rv = self.bytecode_legacy.get(key, None)
+
+        if rv is not None:
+            shard.add(key, rv)
+
+        return rv
+
+    def add_bytecode(self, key, code):
+        """
+        Adds the marshalled `code` to the bytecode cache, under `key`.
+        """
+
+        self.bytecode_shards[ord(key[1])].add(key, code)
 
     def update_bytecode(self):
         """
@@ -765,21 +1461,20 @@ class Script(object):
 
             key = i.get_hash() + MAGIC
 
-            code = self.bytecode_oldcache.get(key, None)
+            code = self.get_bytecode(key)
 
             if code is None:
 
-                self.bytecode_dirty = True
-
                 old_ei = renpy.game.exception_info
                 renpy.game.exception_info = "While compiling python block starting at line %d of %s." % (i.location[1], i.location[0])
 
                 try:
 
-                    if i.mode == 'exec':
-                        code = renpy.python.py_compile_exec_bytecode(i.source, filename=i.location[0], lineno=i.location[1])
-                    elif i.mode == 'eval':
-                        code = renpy.python.py_compile_eval_bytecode(i.source, filename=i.location[0], lineno=i.location[1])
+                    with renpy.startup.span("compile bytecode", file=i.location[0], line=i.location[1]):
+                        if i.mode == 'exec':
+                            code = renpy.python.py_compile_exec_bytecode(i.source, filename=i.location[0], lineno=i.location[1])
+                        elif i.mode == 'eval':
+                            code = renpy.python.py_compile_eval_bytecode(i.source, filename=i.location[0], lineno=i.location[1])
 
                 except SyntaxError, e:
 
@@ -806,20 +1501,33 @@ class Script(object):
 
                 renpy.game.exception_info = old_ei
 
-            self.bytecode_newcache[key] = code
+                self.add_bytecode(key, code)
+
             i.bytecode = marshal.loads(code)
+            renpy.python.note_global_writes(i.bytecode)
 
         self.all_pycode = [ ]
 
 
     def save_bytecode(self):
-        if self.bytecode_dirty:
+        """
+        Writes the new entries in the bytecode cache to disk. Only the shards
+        that have changed are written. Unused entries are only pruned once
+        every lazy file has been loaded, as until then the bytecode of the
+        remaining files hasn't been looked up.
+        """
+
+        for shard in self.bytecode_shards.itervalues():
             try:
-                fn = renpy.loader.get_path(BYTECODE_FILE)
+                shard.save(not self.lazy_files)
+            except:
+                pass
 
-                with open(fn, "wb") as f:
-                    data = (BYTECODE_VERSION, self.bytecode_newcache)
-                    f.write(dumps(data, 2).encode("zlib"))
+        # Once the shards have been written, the legacy cache is no longer
+        # needed.
+        if self.bytecode_legacy:
+            try:
+                os.unlink(renpy.loader.get_path(BYTECODE_FILE))
             except:
                 pass
 
@@ -835,14 +1543,20 @@ class Script(object):
 
         rv = self.namemap.get(label, None)
 
+        if (rv is None) and self.lazy_files:
+            rv = self.load_lazy_name(label)
+
         if (rv is None) and (renpy.config.missing_label_callback is not None):
             label = renpy.config.missing_label_callback(label)
             rv = self.namemap.get(label, None)
 
+            if (rv is None) and self.lazy_files:
+                rv = self.load_lazy_name(label)
+
         if rv is None:
             raise ScriptError("could not find label '%s'." % str(original))
 
-        return self.namemap[label]
+        return rv
 
     def has_label(self, label):
         """
@@ -851,7 +1565,13 @@ class Script(object):
 
         label = renpy.config.label_overrides.get(label, label)
 
-        return label in self.namemap
+        if label in self.namemap:
+            return True
+
+        if self.lazy_files:
+            return self.load_lazy_name(label) is not None
+
+        return False
 
     def analyze(self):
         """
@@ -186,6 +186,8 @@ def nodes_on_line(filename, linenumber):
 
     rv = [ ]
 
+    renpy.game.script.load_all_lazy()
+
     for i in renpy.game.script.all_stmts:
         if (i.filename == filename) and (i.linenumber == linenumber):
             rv.append(i)
@@ -239,6 +241,8 @@ def adjust_ast_linenumbers(filename, linenumber, offset):
         The amount to adjust by. Positive numbers increase the line
     """
 
+    renpy.game.script.load_all_lazy()
+
     for i in renpy.game.script.all_stmts:
         if (i.filename == filename) and (i.linenumber >= linenumber):
             i.linenumber += offset
@@ -0,0 +1,304 @@
+# Copyright 2004-2015 Tom Rothamel <pytom@bishoujo.us>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# This file contains code that traces Ren'Py startup, writing the result
+# out in the Chrome trace event format, and the startup-benchmark command
+# that uses those traces.
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import renpy
+
+# The time this module was imported, which trace timestamps are relative to.
+start_time = time.time()
+
+# True if we're recording a trace.
+enabled = False
+
+# The file the trace will be written to.
+filename = None
+
+# A list of trace events, in the Chrome trace format.
+events = [ ]
+
+# True once the trace has been written.
+written = False
+
+
+def record(name, start, end, category, args):
+    """
+    Records a complete event called `name`, lasting from `start` to `end`.
+    """
+
+    event = {
+        "name" : name,
+        "cat" : category,
+        "ph" : "X",
+        "ts" : int((start - start_time) * 1000000),
+        "dur" : int((end - start) * 1000000),
+        "pid" : os.getpid(),
+        "tid" : threading.current_thread().ident,
+        }
+
+    if args:
+        event["args"] = args
+
+    events.append(event)
+
+
+class Span(object):
+    """
+    A context manager that records the time spent inside it as a trace
+    event. Spans entered inside other spans nest inside them.
+    """
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        record(self.name, self.start, time.time(), self.category, self.args)
+        return False
+
+
+class NullSpan(object):
+    """
+    The context manager returned by span when tracing is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+null_span = NullSpan()
+
+
+def span(name, category="startup", **args):
+    """
+    Returns a context manager that records a span called `name`. Keyword
+    arguments are stored with the span.
+    """
+
+    if not enabled:
+        return null_span
+
+    return Span(name, category, args)
+
+def phase(name, start, end):
+    """
+    Records a startup phase, as logged by renpy.main.log_clock.
+    """
+
+    if enabled:
+        record(name, start, end, "phase", None)
+
+
+def init():
+    """
+    Called at the start of renpy.main.main, to start tracing if it has been
+    requested.
+    """
+
+    global enabled
+    global filename
+
+    filename = renpy.game.args.trace_startup or os.environ.get("RENPY_TRACE_STARTUP", None) # @UndefinedVariable
+
+    if filename:
+        enabled = True
+
+def write():
+    """
+    Writes the trace to the trace file, and stops tracing.
+    """
+
+    global enabled
+    global written
+
+    if not enabled or written:
+        return
+
+    enabled = False
+    written = True
+
+    with open(filename, "w") as f:
+        json.dump({ "traceEvents" : events, "displayTimeUnit" : "ms" }, f)
+
+def first_frame():
+    """
+    Called when the first frame has been drawn. This ends the trace, and if
+    we're being run by startup-benchmark, quits.
+    """
+
+    if not enabled:
+        return
+
+    record("first frame", start_time, time.time(), "phase", None)
+    write()
+
+    if "RENPY_STARTUP_BENCHMARK" in os.environ:
+        raise renpy.game.QuitException()
+
+
+################################################################################
+# The startup-benchmark command.
+
+def percentile(values, p):
+    """
+    Returns the `p`th percentile of `values`, using the nearest rank.
+    """
+
+    values = sorted(values)
+
+    if not values:
+        return 0.0
+
+    rank = int(round(p / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+def summarize(times):
+    """
+    Returns a dict giving the percentiles of `times`.
+    """
+
+    return {
+        "runs" : len(times),
+        "min" : min(times) if times else 0.0,
+        "p50" : percentile(times, 50),
+        "p90" : percentile(times, 90),
+        "p99" : percentile(times, 99),
+        "max" : max(times) if times else 0.0,
+        }
+
+def run_once(cold, run):
+    """
+    Starts the game once in a new process, and returns a (wall time, phase
+    durations) tuple. The phase durations map the name of each startup phase
+    to the time it took, in seconds. `run` describes the start, and is used
+    in the exception raised if it fails.
+    """
+
+    if cold:
+        shutil.rmtree(os.path.join(renpy.config.gamedir, "cache"), True)
+
+    fd, trace_fn = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+
+    env = dict(os.environ)
+    env["RENPY_STARTUP_BENCHMARK"] = "1"
+    env["SDL_VIDEODRIVER"] = "dummy"
+    env["SDL_AUDIODRIVER"] = "dummy"
+    env["RENPY_RENDERER"] = "sw"
+    env["RENPY_DISABLE_SOUND"] = "pss"
+
+    cmd = [ sys.executable, "-EO", sys.argv[0], renpy.config.basedir, "run", "--trace-startup", trace_fn ]
+
+    try:
+        start = time.time()
+        status = subprocess.call(cmd, env=env)
+        wall = time.time() - start
+
+        if status != 0:
+            raise Exception("The {} failed, exiting with status {}.".format(run, status))
+
+        with open(trace_fn, "r") as f:
+            try:
+                trace = json.load(f)
+            except ValueError:
+                raise Exception("The {} exited without writing a startup trace.".format(run))
+
+    finally:
+        os.unlink(trace_fn)
+
+    phases = { }
+
+    for i in trace["traceEvents"]:
+        if i["cat"] == "phase":
+            phases[i["name"]] = phases.get(i["name"], 0) + i["dur"] / 1000000.0
+
+    return wall, phases
+
+def benchmark():
+    """
+    The startup-benchmark command. This starts the game repeatedly without
+    a visible window, and reports how long startup took.
+    """
+
+    ap = renpy.arguments.ArgumentParser(description="Measures how long the game takes to start.")
+    ap.add_argument("--runs", type=int, default=5, help="The number of times to start the game. Defaults to 5.")
+    ap.add_argument("--cold", action="store_true", help="Also measure cold starts, where the cache directory is removed before each start.")
+    ap.add_argument("--json", dest="json_file", default=None, metavar="FILE", help="Writes the results to FILE, as JSON.")
+
+    args = ap.parse_args()
+
+    modes = [ "warm" ]
+
+    if args.cold:
+        modes.insert(0, "cold")
+
+    results = { }
+
+    for mode in modes:
+
+        walls = [ ]
+        phases = { }
+
+        # A warm start needs a start to warm up the caches first.
+        if mode == "warm":
+            run_once(False, "warm-up start")
+
+        for i in range(args.runs):
+            wall, run_phases = run_once(mode == "cold", "{} start {} of {}".format(mode, i + 1, args.runs))
+
+            walls.append(wall)
+
+            for k, v in run_phases.iteritems():
+                phases.setdefault(k, [ ]).append(v)
+
+        results[mode] = {
+            "total" : summarize(walls),
+            "phases" : dict((k, summarize(v)) for k, v in phases.iteritems()),
+            }
+
+        print "{} starts ({} runs):".format(mode.capitalize(), args.runs)
+
+        for name, summary in [ ("Total", results[mode]["total"]) ] + sorted(results[mode]["phases"].items()):
+            print "    {:<40} p50 {:7.3f}s  p90 {:7.3f}s  max {:7.3f}s".format(name, summary["p50"], summary["p90"], summary["max"])
+
+    if args.json_file:
+        with open(args.json_file, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    return False
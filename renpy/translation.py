@@ -57,6 +57,10 @@ class ScriptTranslator(object):
         # A map from language to the StringTranslator for that language.
         self.strings = collections.defaultdict(StringTranslator)
 
+        # The identifiers of default translates in script files that are
+        # being loaded lazily, and haven't been loaded yet.
+        self.lazy_identifiers = set()
+
         # A map from language to a list of TranslateBlock objects for
         # that language.
         self.block = collections.defaultdict(list)
@@ -74,7 +78,7 @@ class ScriptTranslator(object):
         Return the number of dialogue blocks in the game.
         """
 
-        return len(self.default_translates)
+        return len(self.default_translates) + len(self.lazy_identifiers)
 
     def take_translates(self, nodes):
         """
@@ -128,6 +132,7 @@ class ScriptTranslator(object):
 
                 if n.language is None:
                     self.default_translates[n.identifier] = n
+                    self.lazy_identifiers.discard(n.identifier)
                     self.file_translates[filename].append((label, n))
                 else:
                     self.languages.add(n.language)
@@ -160,6 +165,10 @@ class ScriptTranslator(object):
 
         if language is not None:
             tl = self.language_translates.get((identifier, language), None)
+
+            if (tl is None) and renpy.game.script.lazy_files:
+                renpy.game.script.load_lazy_translate(identifier, language)
+                tl = self.language_translates.get((identifier, language), None)
         else:
             tl = None
 
@@ -194,6 +203,9 @@ class Restructurer(object):
         if identifier in renpy.game.script.translator.default_translates:
             return True
 
+        if identifier in renpy.game.script.translator.lazy_identifiers:
+            return True
+
         return False
 
     def create_translate(self, block):
@@ -283,6 +295,44 @@ def restructure(children):
     Restructurer(children)
 
 
+def generated_by_restructure(node):
+    """
+    Returns true if `node` is a Translate or EndTranslate statement that was
+    created by restructure, rather than being in the script.
+    """
+
+    if not isinstance(node, (renpy.ast.Translate, renpy.ast.EndTranslate)):
+        return False
+
+    name = node.name
+
+    return isinstance(name, tuple) and (name[-1] == "translate" or name[-1] == "end_translate")
+
+def unrestructure(children):
+    """
+    Undoes restructure, removing the Translate and EndTranslate statements
+    it created from `children` and the blocks they contain.
+    """
+
+    new_children = [ ]
+
+    for i in children:
+
+        if generated_by_restructure(i):
+            if isinstance(i, renpy.ast.Translate):
+                new_children.extend(i.block)
+
+            continue
+
+        new_children.append(i)
+
+    for i in new_children:
+        if not isinstance(i, renpy.ast.Translate):
+            i.restructure(unrestructure)
+
+    children[:] = new_children
+
+
 ################################################################################
 # String Translation
 ################################################################################
@@ -711,7 +711,8 @@ class ChoiceReturn(ChoiceActionBase):
 
     def __call__(self):
         if self.chosen is not None:
-            self.chosen[(self.location, self.label)] = True
+            key = (self.location, self.label)
+            self.chosen[key] = self.chosen.get(key, 0) + 1
 
         return self.value
 
@@ -764,7 +765,8 @@ class ChoiceJump(ChoiceActionBase):
 
     def __call__(self):
         if self.chosen is not None:
-            self.chosen[(self.location, self.label)] = True
+            key = (self.location, self.label)
+            self.chosen[key] = self.chosen.get(key, 0) + 1
 
         renpy.exports.jump(self.value)
 
@@ -56,6 +56,8 @@ def warp():
 
     prev = { }
 
+    renpy.game.script.load_all_lazy()
+
     workset = sets.Set([ n for n in renpy.game.script.namemap.itervalues() if isinstance(n, renpy.ast.Scene) ])
     seenset = sets.Set(workset)
 
@@ -0,0 +1,78 @@
+#@PydevCodeAnalysisIgnore
+import unittest
+
+import renpy
+renpy.import_all()
+
+import renpy.display.diskcache
+import renpy.display.im as im
+
+
+class TestDiskCacheKey(unittest.TestCase):
+
+    def setUp(self):
+        self.old_size = renpy.config.image_disk_cache_size_mb
+        self.old_less_memory = renpy.game.less_memory
+        self.old_version = renpy.version
+
+        renpy.config.image_disk_cache_size_mb = 100
+        renpy.game.less_memory = False
+
+        self.hashes = dict(renpy.loader.hash_cache)
+        renpy.loader.hash_cache.update({ "body.png" : 1, "face.png" : 2, "mask.png" : 3 })
+
+    def tearDown(self):
+        renpy.config.image_disk_cache_size_mb = self.old_size
+        renpy.game.less_memory = self.old_less_memory
+        renpy.version = self.old_version
+
+        renpy.loader.hash_cache.clear()
+        renpy.loader.hash_cache.update(self.hashes)
+
+    def changes_key(self, image, fn):
+        """
+        Returns True if changing the contents of `fn` changes the key of
+        `image`.
+        """
+
+        before = renpy.display.diskcache.key(image)
+        assert before is not None
+
+        renpy.loader.hash_cache[fn] += 100
+
+        return renpy.display.diskcache.key(image) != before
+
+    def test_composite_filenames(self):
+        composite = im.Composite((10, 10), (0, 0), "body.png", (0, 0), "face.png")
+
+        assert self.changes_key(composite, "body.png")
+        assert self.changes_key(composite, "face.png")
+
+    def test_alpha_mask_filenames(self):
+        mask = im.AlphaMask("body.png", "mask.png")
+
+        assert self.changes_key(mask, "body.png")
+        assert self.changes_key(mask, "mask.png")
+
+    def test_nested(self):
+        scale = im.Scale(im.Composite((10, 10), (0, 0), "body.png"), 5, 5)
+
+        assert self.changes_key(scale, "body.png")
+        assert not self.changes_key(scale, "face.png")
+
+    def test_missing_file(self):
+        composite = im.Composite((10, 10), (0, 0), "body.png", (0, 0), "missing.png")
+        renpy.loader.hash_cache["missing.png"] = 0
+
+        assert renpy.display.diskcache.key(composite) is None
+
+    def test_version(self):
+        composite = im.Composite((10, 10), (0, 0), "body.png")
+
+        before = renpy.display.diskcache.key(composite)
+        renpy.version = renpy.version + ".test"
+
+        assert renpy.display.diskcache.key(composite) != before
+
+    def test_images_not_cached(self):
+        assert renpy.display.diskcache.key(im.Image("body.png")) is None
@@ -0,0 +1,130 @@
+#@PydevCodeAnalysisIgnore
+import unittest
+
+import renpy
+renpy.import_all()
+
+import renpy.display.im as im
+
+
+def apply_luts(luts, color):
+    return tuple(ord(lut[c]) for lut, c in zip(luts, color))
+
+
+def apply_matrix(m, color):
+    """
+    Applies the 20 element matrix `m` to `color`, a tuple of four
+    components between 0.0 and 1.0, as im.MatrixColor does.
+    """
+
+    rv = [ ]
+
+    for row in range(4):
+        c = sum(m[row * 5 + i] * color[i] for i in range(4)) + m[row * 5 + 4]
+        rv.append(min(max(c, 0.0), 1.0))
+
+    return rv
+
+
+COLORS = [ (r, g, b, a) for r in (0, 64, 200, 255) for g in (0, 128, 255) for b in (0, 99, 255) for a in (0, 255) ]
+
+
+class TestOptimize(unittest.TestCase):
+
+    def setUp(self):
+        self.old_optimize = renpy.config.optimize_image_manipulators
+        renpy.config.optimize_image_manipulators = True
+
+        self.image = im.Image("a.png")
+
+    def tearDown(self):
+        renpy.config.optimize_image_manipulators = self.old_optimize
+
+    def test_luts(self):
+        inner = im.Twocolor(self.image, (255, 200, 100, 255), (20, 30, 40, 255))
+        outer = im.Recolor(inner, 128, 255, 64, 200)
+
+        fused = im.optimize(outer)
+
+        assert type(fused) is im.Map
+        assert fused.image is self.image
+
+        inner_luts = im.color_luts(inner)
+        outer_luts = im.color_luts(outer)
+        fused_luts = im.color_luts(fused)
+
+        for color in COLORS:
+            expected = apply_luts(outer_luts, apply_luts(inner_luts, color))
+            assert apply_luts(fused_luts, color) == expected
+
+    def test_matrix(self):
+        inner = im.Sepia(self.image)
+        outer = im.MatrixColor(inner, im.matrix.brightness(.2) * im.matrix.contrast(1.5))
+
+        fused = im.optimize(outer)
+
+        assert type(fused) is im.MatrixColor
+        assert fused.image is self.image
+
+        for color in COLORS:
+            color = [ i / 255.0 for i in color ]
+
+            expected = apply_matrix(outer.matrix, apply_matrix(inner.matrix, color))
+            actual = apply_matrix(fused.matrix, color)
+
+            for e, a in zip(expected, actual):
+                assert abs(e - a) < .0001
+
+    def test_matrix_out_of_range(self):
+        # The inner matrix is clamped, so it can't be multiplied.
+        inner = im.MatrixColor(self.image, im.matrix.contrast(3))
+        outer = im.MatrixColor(inner, im.matrix.invert())
+
+        assert im.optimize(outer) is outer
+
+    def test_crop(self):
+        crop = im.Crop(im.Grayscale(self.image), (1, 2, 3, 4))
+
+        rv = im.optimize(crop)
+
+        assert type(rv) is im.MatrixColor
+        assert type(rv.image) is im.Crop
+        assert rv.image.image is self.image
+        assert (rv.image.x, rv.image.y, rv.image.w, rv.image.h) == (1, 2, 3, 4)
+
+    def test_scale_down(self):
+        rv = im.optimize(im.Scale(im.Scale(self.image, 100, 80), 50, 40))
+
+        assert type(rv) is im.Scale
+        assert rv.image is self.image
+        assert (rv.width, rv.height) == (50, 40)
+
+        rv = im.optimize(im.FactorScale(im.Scale(self.image, 100, 80), .5))
+
+        assert type(rv) is im.Scale
+        assert rv.image is self.image
+        assert (rv.width, rv.height) == (50, 40)
+
+    def test_scale_up(self):
+        # Scaling down and back up pixelates the image, so it has to be
+        # done in two steps.
+        pixelate = im.Scale(im.Scale(self.image, 10, 8), 100, 80)
+        assert im.optimize(pixelate) is pixelate
+
+        pixelate = im.FactorScale(im.Scale(self.image, 10, 8), 10)
+        assert im.optimize(pixelate) is pixelate
+
+        # Only one dimension is enlarged.
+        stretch = im.Scale(im.Scale(self.image, 100, 8), 50, 80)
+        assert im.optimize(stretch) is stretch
+
+    def test_scale_factor_scale(self):
+        # The size of the FactorScale isn't known until it's loaded.
+        scale = im.Scale(im.FactorScale(self.image, .1), 100, 100)
+        assert im.optimize(scale) is scale
+
+    def test_disabled(self):
+        renpy.config.optimize_image_manipulators = False
+
+        scale = im.Scale(im.Scale(self.image, 100, 80), 50, 40)
+        assert im.optimize(scale) is scale
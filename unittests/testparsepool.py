@@ -0,0 +1,74 @@
+#@PydevCodeAnalysisIgnore
+import os
+import shutil
+import tempfile
+import unittest
+
+import renpy
+renpy.import_all()
+
+import renpy.script
+
+
+SCRIPT = """\
+label start:
+    play music "theme.ogg"
+    voice "a.ogg"
+    e "Hello."
+"""
+
+
+class TestParsePool(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.dir, "script.rpy")
+
+        with open(self.fn, "w") as f:
+            f.write(SCRIPT)
+
+        self.registry = dict(renpy.statements.registry)
+
+    def tearDown(self):
+        renpy.statements.registry.clear()
+        renpy.statements.registry.update(self.registry)
+
+        shutil.rmtree(self.dir)
+
+    def test_first_words(self):
+        words = renpy.script.first_words(self.fn)
+        assert words == { "label", "play", "voice", "e" }
+
+    def test_uses_new_statements(self):
+        script = renpy.script.Script.__new__(renpy.script.Script)
+        script.parse_pool_statements = set(renpy.statements.registry)
+
+        words = renpy.script.first_words(self.fn)
+
+        # Nothing has been registered since the pool started.
+        assert not script.uses_new_statements(words)
+
+        # A statement the file doesn't use.
+        renpy.statements.registry[("unused", "statement")] = { }
+        assert not script.uses_new_statements(words)
+
+        # A statement the file uses, which the worker would have parsed as
+        # a say statement.
+        renpy.statements.registry[("voice",)] = { }
+        assert script.uses_new_statements(words)
+
+    def test_new_default_statement(self):
+        script = renpy.script.Script.__new__(renpy.script.Script)
+        script.parse_pool_statements = set(renpy.statements.registry)
+
+        renpy.statements.registry[()] = { }
+        assert script.uses_new_statements(set())
+
+    def test_worker_result(self):
+        result = renpy.script.parse_worker(self.fn)
+        assert result is not None
+
+        stmts, _lines, _missing, words = renpy.script.loads(result)
+
+        assert stmts
+        assert "play" in words
@@ -0,0 +1,142 @@
+#@PydevCodeAnalysisIgnore
+import os
+import shutil
+import tempfile
+import unittest
+
+import renpy
+renpy.import_all()
+
+import renpy.persistent
+from renpy.persistent import dumps
+
+
+class TestPersistentJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.dir, "persistent")
+
+        self.old_persistent = renpy.game.persistent
+        self.old_backup = dict(renpy.persistent.backup)
+        self.old_tracked = dict(renpy.persistent.tracked)
+
+        renpy.persistent.backup.clear()
+        renpy.persistent.tracked.clear()
+        renpy.persistent.journal[:] = [ ]
+
+        p = renpy.persistent.Persistent()
+        p.score = 1
+        p.name = "before"
+
+        for k, v in vars(p).iteritems():
+            renpy.persistent.backup_field(k, v)
+
+        renpy.game.persistent = p
+        self.p = p
+
+        self.snapshot()
+
+    def tearDown(self):
+        renpy.game.persistent = self.old_persistent
+
+        renpy.persistent.backup.clear()
+        renpy.persistent.backup.update(self.old_backup)
+        renpy.persistent.tracked.clear()
+        renpy.persistent.tracked.update(self.old_tracked)
+        renpy.persistent.journal[:] = [ ]
+
+        shutil.rmtree(self.dir)
+
+    def snapshot(self):
+        with open(self.fn, "wb") as f:
+            f.write(dumps(self.p).encode("zlib"))
+
+        try:
+            os.unlink(renpy.persistent.journal_filename(self.fn))
+        except OSError:
+            pass
+
+    def append(self, data):
+        with open(renpy.persistent.journal_filename(self.fn), "ab") as f:
+            f.write(data)
+
+    def journal(self):
+        """
+        Appends the changes to the persistent data to the journal, as
+        the persistent writer thread does.
+        """
+
+        renpy.persistent.find_changes()
+
+        entries = renpy.persistent.journal[:]
+        renpy.persistent.journal[:] = [ ]
+
+        self.append(renpy.persistent.journal_record(dumps(entries)))
+
+    def check(self, loaded):
+        p = self.p
+
+        assert loaded.score == p.score
+        assert loaded.name == p.name
+        assert loaded.gone is None
+        assert dict(loaded._seen_ever) == dict(p._seen_ever)
+        assert set(loaded._seen_translates) == set(p._seen_translates)
+
+    def test_replay(self):
+        p = self.p
+
+        p.score = 5
+        p._seen_ever["a"] = True
+        p._seen_translates.add("t1")
+        p.gone = [ 1 ]
+        self.journal()
+
+        p.name = "after"
+        p._seen_ever["b"] = True
+        p._seen_translates.add("t2")
+        p.gone = None
+        self.journal()
+
+        # Replacing a tracked dict journals it in full.
+        p._seen_ever = { "c" : True }
+        self.journal()
+
+        self.check(renpy.persistent.load(self.fn))
+
+    def test_damaged_record(self):
+        p = self.p
+
+        p.score = 2
+        self.journal()
+
+        expected = p.score
+        p.score = 3
+        renpy.persistent.find_changes()
+        record = renpy.persistent.journal_record(dumps(renpy.persistent.journal))
+
+        # A record that was being appended when the game quit.
+        self.append(record[:-3])
+
+        loaded = renpy.persistent.load(self.fn)
+        assert loaded.score == expected
+
+    def test_stale_journal(self):
+        p = self.p
+
+        p.score = 2
+        self.journal()
+
+        # A snapshot written after the journal, without removing it.
+        p.score = 3
+        renpy.persistent.find_changes()
+        p._changed["score"] += 1
+
+        journal = renpy.persistent.journal_filename(self.fn)
+        with open(journal, "rb") as f:
+            data = f.read()
+
+        self.snapshot()
+        self.append(data)
+
+        assert renpy.persistent.load(self.fn).score == 3
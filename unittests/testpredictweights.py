@@ -0,0 +1,44 @@
+#@PydevCodeAnalysisIgnore
+import unittest
+
+import renpy
+renpy.import_all()
+
+import renpy.execution
+
+
+class Node(object):
+    filename = "game/script.rpy"
+    linenumber = 10
+
+    def predict_weights(self, successors):
+        return [ 1.0 ] * len(successors)
+
+
+class TestPredictWeights(unittest.TestCase):
+
+    def setUp(self):
+        self.old_callback = renpy.config.predict_weights_callback
+
+    def tearDown(self):
+        renpy.config.predict_weights_callback = self.old_callback
+
+    def weights(self, callback):
+        renpy.config.predict_weights_callback = callback
+        return renpy.execution.predict_weights(Node(), [ "a", "b", "c", "d" ])
+
+    def test_default(self):
+        assert self.weights(None) == [ .25, .25, .25, .25 ]
+
+    def test_callback(self):
+        assert self.weights(lambda fn, line, weights : [ 1, 0, 3, 0 ]) == [ .25, 0.0, .75, 0.0 ]
+
+    def test_callback_none(self):
+        assert self.weights(lambda fn, line, weights : None) == [ .25, .25, .25, .25 ]
+
+    def test_wrong_length(self):
+        assert self.weights(lambda fn, line, weights : [ 1, 0 ]) == [ .25, .25, .25, .25 ]
+        assert self.weights(lambda fn, line, weights : [ 1 ] * 5) == [ .25, .25, .25, .25 ]
+
+    def test_zero(self):
+        assert self.weights(lambda fn, line, weights : [ 0, 0, 0, 0 ]) == [ 0.0, 0.0, 0.0, 0.0 ]
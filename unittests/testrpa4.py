@@ -0,0 +1,157 @@
+#@PydevCodeAnalysisIgnore
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+import renpy
+renpy.import_all()
+
+import renpy.loader
+
+
+KEY = 0x42424242
+
+
+def write_rpa4(fn, files):
+    """
+    Writes an RPA-4.0 archive to `fn`, in the format the launcher's
+    archiver uses. `files` is a list of (name, data, compress) tuples.
+    Files with the same data are stored once.
+    """
+
+    with open(fn, "wb") as f:
+        f.write("RPA-4.0 XXXXXXXXXXXXXXXX XXXXXXXXXXXXXXXX XXXXXXXX\n")
+
+        index = [ ]
+        stored = { }
+
+        for name, data, compress in files:
+
+            if data in stored:
+                index.append((name, ) + stored[data])
+                continue
+
+            if compress:
+                flags = renpy.loader.RPA4_ZLIB
+                stored_data = zlib.compress(data, 9)
+            else:
+                flags = 0
+                stored_data = data
+
+                pos = f.tell()
+                if pos % 4096:
+                    f.write("\0" * (4096 - pos % 4096))
+
+            offset = f.tell()
+            f.write(stored_data)
+
+            stored[data] = (flags, offset, len(stored_data))
+            index.append((name, flags, offset, len(stored_data)))
+
+        indexoff = f.tell()
+
+        table = [ struct.pack("<I", len(index)) ]
+
+        for name, flags, offset, dlen in index:
+            table.append(struct.pack("<HHQQ", len(name), flags, offset ^ KEY, dlen ^ KEY))
+            table.append(name)
+
+        table = zlib.compress("".join(table), 9)
+        f.write(table)
+
+        f.seek(0)
+        f.write("RPA-4.0 %016x %016x %08x\n" % (indexoff, len(table), KEY))
+
+
+class TestRPA4(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.basedir, "game"))
+
+        self.old_config = (renpy.config.basedir, renpy.config.searchpath, renpy.config.archives)
+
+        renpy.config.basedir = self.basedir
+        renpy.config.searchpath = [ "game" ]
+        renpy.config.archives = [ "test" ]
+
+        self.files = [
+            ("script.rpy", "label start:\n    return\n" * 100, True),
+            ("image.png", "\x89PNG" + "".join(chr(i % 256) for i in range(5000)), False),
+            ("copy.png", "\x89PNG" + "".join(chr(i % 256) for i in range(5000)), False),
+            (u"été.txt".encode("utf-8"), "summer", False),
+            ]
+
+        write_rpa4(os.path.join(self.basedir, "game", "test.rpa"), self.files)
+
+        renpy.loader.index_archives_core()
+        renpy.loader.cleardirfiles()
+
+    def tearDown(self):
+        renpy.config.basedir, renpy.config.searchpath, renpy.config.archives = self.old_config
+        renpy.loader.index_archives_core()
+        renpy.loader.cleardirfiles()
+
+        shutil.rmtree(self.basedir)
+
+    def test_index(self):
+        _prefix, index = renpy.loader.archives[0]
+
+        assert set(index) == { "script.rpy", "image.png", "copy.png", u"été.txt" }
+
+        # The compressed entry is marked as such.
+        assert index["script.rpy"][0][3] == "zlib"
+        assert len(index["image.png"][0]) == 3
+
+        # Identical files share storage.
+        assert index["image.png"][0][:2] == index["copy.png"][0][:2]
+
+    def test_load(self):
+        prefix, index = renpy.loader.archives[0]
+
+        for name, data, _compress in self.files:
+            name = name.decode("utf-8")
+
+            f = renpy.loader.load_archive(prefix, index, name)
+            assert f.read() == data
+            f.close()
+
+    def test_aligned(self):
+        _prefix, index = renpy.loader.archives[0]
+
+        offset = index["image.png"][0][0]
+        assert offset % 4096 == 0
+
+    def test_missing_cached(self):
+        assert not renpy.loader.loadable("missing.txt")
+        assert renpy.loader.resolve_cache["missing.txt"] is None
+
+        fn = os.path.join(self.basedir, "game", "missing.txt")
+
+        with open(fn, "wb") as f:
+            f.write("found")
+
+        # Autoreload invalidates files it sees created.
+        renpy.loader.invalidate(fn)
+
+        assert renpy.loader.loadable("missing.txt")
+
+    def test_vanished(self):
+        fn = os.path.join(self.basedir, "game", "script.rpy")
+
+        with open(fn, "wb") as f:
+            f.write("on disk")
+
+        f = renpy.loader.load("script.rpy")
+        assert f.read() == "on disk"
+        f.close()
+
+        os.unlink(fn)
+
+        # The file is still in the archive.
+        f = renpy.loader.load("script.rpy")
+        assert f.read() == self.files[0][1]
+        f.close()
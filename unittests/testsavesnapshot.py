@@ -0,0 +1,126 @@
+#@PydevCodeAnalysisIgnore
+import cPickle
+import threading
+import unittest
+
+import renpy
+renpy.import_all()
+
+from renpy.python import RevertableList, RevertableDict, RevertableSet, RevertableObject, SaveSnapshot
+
+
+class Log(object):
+    """
+    Stands in for the rollback log, which records the objects changed in
+    each statement in mutated.
+    """
+
+    def __init__(self):
+        self.mutated = { }
+
+
+class Thing(RevertableObject):
+    pass
+
+
+def pickle_in_thread(snapshot, o):
+    """
+    Pickles `o` in a new thread that claims `snapshot`, and returns the
+    unpickled result.
+    """
+
+    rv = [ ]
+
+    def run():
+        snapshot.claim()
+        rv.append(cPickle.dumps(o, cPickle.HIGHEST_PROTOCOL))
+
+    t = threading.Thread(target=run)
+    t.start()
+    t.join()
+
+    return cPickle.loads(rv[0])
+
+
+class TestSaveSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.old_log = renpy.game.log
+        renpy.game.log = Log()
+
+        self.thing = Thing()
+        self.thing.name = "before"
+
+        self.state = (
+            RevertableList([ 1, 2, 3 ]),
+            RevertableDict(a=1, b=2),
+            RevertableSet([ 1, 2 ]),
+            self.thing,
+            )
+
+        self.snapshot = renpy.python.save_snapshot = SaveSnapshot()
+
+    def tearDown(self):
+        renpy.python.save_snapshot = None
+        renpy.game.log = self.old_log
+
+    def change(self):
+        l, d, s, thing = self.state
+
+        renpy.game.log.mutated = { }
+
+        l.append(4)
+        l[0] = 0
+        d["c"] = 3
+        del d["a"]
+        s.add(3)
+        thing.name = "after"
+        thing.extra = True
+
+    def test_snapshot(self):
+        self.change()
+
+        l, d, s, thing = pickle_in_thread(self.snapshot, self.state)
+
+        assert l == [ 1, 2, 3 ]
+        assert d == { "a" : 1, "b" : 2 }
+        assert set(s) == set([ 1, 2 ])
+        assert thing.name == "before"
+        assert not hasattr(thing, "extra")
+
+        assert type(l) is RevertableList
+        assert type(thing) is Thing
+
+    def test_unchanged(self):
+        l, d, s, thing = pickle_in_thread(self.snapshot, self.state)
+
+        assert l == [ 1, 2, 3 ]
+        assert d == { "a" : 1, "b" : 2 }
+        assert set(s) == set([ 1, 2 ])
+        assert thing.name == "before"
+
+    def test_other_thread(self):
+        self.change()
+
+        # Pickling on a thread that hasn't claimed the snapshot sees the
+        # current state.
+        l, d, s, thing = cPickle.loads(cPickle.dumps(self.state, cPickle.HIGHEST_PROTOCOL))
+
+        assert l == [ 0, 2, 3, 4 ]
+        assert d == { "b" : 2, "c" : 3 }
+        assert set(s) == set([ 1, 2, 3 ])
+        assert thing.name == "after"
+
+    def test_undo_log_copy(self):
+        l = self.state[0]
+
+        renpy.game.log.mutated = { }
+        l.append(4)
+
+        undo = renpy.game.log.mutated[id(l)][1]
+        copy = undo.save_copy()
+
+        l[0] = 9
+
+        assert len(copy.records) == 1
+        assert len(undo.records) == 2
@@ -0,0 +1,82 @@
+#@PydevCodeAnalysisIgnore
+import shutil
+import tempfile
+import unittest
+
+import renpy
+renpy.import_all()
+
+import renpy.savestats
+
+
+class Items(list):
+    pass
+
+
+class Table(dict):
+    pass
+
+
+class Bag(object):
+
+    def __init__(self, items):
+        self.items = Items(items)
+
+
+def paths(roots):
+    """
+    Pickles `roots`, and returns the set of paths that are charged for
+    some bytes.
+    """
+
+    pickler = renpy.savestats.SizePickler(top=1000)
+
+    for name, o in roots.iteritems():
+        pickler.dump_root(name, o)
+
+    return set(path for _size, path, _type in pickler.heaviest)
+
+
+class TestSaveStats(unittest.TestCase):
+
+    def test_list_subclass(self):
+        inventory = Items([ Bag([ "a" * 100, "b" * 200 ]), Bag([ "c" * 300, "d" * 400 ]) ])
+
+        p = paths({ "store.inventory" : inventory })
+
+        assert "store.inventory[0].items[1]" in p
+        assert "store.inventory[1].items[1]" in p
+        assert "store.inventory[2]" not in p
+        assert "store.inventory[1].items[3]" not in p
+
+    def test_dict_subclass(self):
+        table = Table(a="x" * 100)
+        table.note = "y" * 200
+
+        p = paths({ "store.table" : table })
+
+        assert "store.table['a']" in p
+        assert "store.table.note" in p
+
+    def test_fields(self):
+        bag = Bag([ "e" * 100 ])
+
+        p = paths({ "store.bag" : bag })
+
+        assert "store.bag.items" in p
+        assert "store.bag.items[0]" in p
+
+    def test_missing_slot(self):
+        old_location = renpy.loadsave.location
+        d = tempfile.mkdtemp()
+
+        try:
+            renpy.loadsave.location = renpy.savelocation.FileLocation(d)
+            renpy.loadsave.location.scan()
+
+            self.assertRaises(renpy.savestats.MissingSlot, renpy.savestats.slot_stats, "1-1")
+
+        finally:
+            renpy.loadsave.location.close()
+            renpy.loadsave.location = old_location
+            shutil.rmtree(d)
@@ -0,0 +1,94 @@
+#@PydevCodeAnalysisIgnore
+import os
+import shutil
+import tempfile
+import unittest
+
+import renpy
+renpy.import_all()
+
+import renpy.savelocation
+
+
+def entry(mtime):
+    return {
+        "mtime" : mtime,
+        "json" : { "_save_name" : "Save %d" % mtime },
+        "screenshot_name" : "screenshot.png",
+        "screenshot" : "png" * 1000,
+        "version" : renpy.version,
+        }
+
+
+class TestSlotIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def location(self):
+        rv = renpy.savelocation.FileLocation(self.dir)
+        rv.close()
+        return rv
+
+    def change(self, location, slotname, e):
+        if e is None:
+            location.index.pop(slotname, None)
+        else:
+            location.index[slotname] = e
+
+        location.index_changed.add(slotname)
+        location.save_index()
+
+    def test_round_trip(self):
+        l = self.location()
+
+        self.change(l, "1-1", entry(1))
+        self.change(l, "1-2", entry(2))
+        self.change(l, "1-1", entry(3))
+        self.change(l, "1-2", None)
+
+        assert self.location().index == { "1-1" : entry(3) }
+
+    def test_append(self):
+        l = self.location()
+
+        for i in range(10):
+            self.change(l, "1-%d" % i, entry(i))
+
+        size = os.path.getsize(l.index_filename)
+
+        # Changing one slot appends one record, rather than rewriting the
+        # screenshots of the other slots.
+        self.change(l, "1-0", entry(100))
+        assert os.path.getsize(l.index_filename) < size + 2 * len(entry(100)["screenshot"])
+
+        assert self.location().index["1-0"] == entry(100)
+
+    def test_compact(self):
+        l = self.location()
+
+        for i in range(200):
+            self.change(l, "1-1", entry(i))
+
+        assert l.index_records <= 2 + renpy.savelocation.INDEX_SLACK
+        assert self.location().index == { "1-1" : entry(199) }
+
+    def test_truncated(self):
+        l = self.location()
+
+        self.change(l, "1-1", entry(1))
+        self.change(l, "1-2", entry(2))
+
+        # Simulate a record that was being written when the game quit.
+        with open(l.index_filename, "ab") as f:
+            f.write("\x80\x02(U\x03")
+
+        l = self.location()
+        assert l.index == { "1-1" : entry(1), "1-2" : entry(2) }
+        assert l.index_records is None
+
+        self.change(l, "1-3", entry(3))
+        assert self.location().index == { "1-1" : entry(1), "1-2" : entry(2), "1-3" : entry(3) }
@@ -0,0 +1,179 @@
+#@PydevCodeAnalysisIgnore
+import cPickle
+import random
+import unittest
+
+import renpy
+renpy.import_all()
+
+from renpy.python import RevertableList, RevertableDict, UndoLog
+
+
+class Log(object):
+    """
+    Stands in for the rollback log, which records the objects changed in
+    each statement in mutated.
+    """
+
+    def __init__(self):
+        self.mutated = { }
+
+
+def list_op(r, l):
+    """
+    Performs a random change to the list `l`.
+    """
+
+    n = len(l)
+    v = r.randint(0, 1000)
+
+    op = r.choice([
+        "append", "extend", "iadd", "imul", "insert", "pop", "remove",
+        "setitem", "delitem", "setslice", "delslice", "reverse", "sort",
+        ])
+
+    if op == "append":
+        l.append(v)
+    elif op == "extend":
+        l.extend([ v, v + 1 ])
+    elif op == "iadd":
+        l += [ v ]
+    elif op == "imul":
+        l *= r.choice([ 0, 1, 2 ])
+    elif op == "insert":
+        l.insert(r.randint(-n - 2, n + 2), v)
+    elif op == "pop" and n:
+        l.pop(r.randint(-n, n - 1))
+    elif op == "remove" and n:
+        l.remove(r.choice(l))
+    elif op == "setitem" and n:
+        l[r.randint(-n, n - 1)] = v
+    elif op == "delitem" and n:
+        del l[r.randint(-n, n - 1)]
+    elif op == "setslice":
+        l[r.randint(0, n):r.randint(0, n)] = [ v, v + 1 ]
+    elif op == "delslice":
+        del l[r.randint(0, n):r.randint(0, n)]
+    elif op == "reverse":
+        l.reverse()
+    elif op == "sort":
+        l.sort()
+
+
+def dict_op(r, d):
+    """
+    Performs a random change to the dict `d`.
+    """
+
+    k = r.randint(0, 20)
+    v = r.randint(0, 1000)
+
+    op = r.choice([
+        "setitem", "delitem", "pop", "popitem", "setdefault", "update",
+        "clear",
+        ])
+
+    if op == "setitem":
+        d[k] = v
+    elif op == "delitem" and k in d:
+        del d[k]
+    elif op == "pop":
+        d.pop(k, None)
+    elif op == "popitem" and d:
+        d.popitem()
+    elif op == "setdefault":
+        d.setdefault(k, v)
+    elif op == "update":
+        d.update({ k : v, k + 1 : v + 1 }, extra=v)
+    elif op == "clear" and r.random() < .1:
+        d.clear()
+
+
+class TestUndoLog(unittest.TestCase):
+
+    def setUp(self):
+        self.old_log = renpy.game.log
+        renpy.game.log = Log()
+
+    def tearDown(self):
+        renpy.game.log = self.old_log
+
+    def statements(self, r, o, op, count, pickled):
+        """
+        Runs `count` statements that each make random changes to `o` with
+        `op`, then rolls them back, checking that each rollback restores
+        the state from before the statement.
+        """
+
+        log = renpy.game.log
+
+        history = [ ]
+
+        for _i in range(count):
+            before = o.copy() if isinstance(o, dict) else list(o)
+
+            log.mutated = { }
+
+            for _j in range(r.randint(0, 10)):
+                op(r, o)
+
+            entry = log.mutated.get(id(o), None)
+
+            if entry is None:
+                rollback = None
+            else:
+                rollback = entry[1]
+
+                if pickled:
+                    rollback = cPickle.loads(cPickle.dumps(rollback, cPickle.HIGHEST_PROTOCOL))
+
+            history.append((before, rollback))
+
+        for before, rollback in reversed(history):
+            if rollback is not None:
+                o.rollback(rollback)
+
+            assert o == before, (o, before)
+
+    def test_list(self):
+        for seed in range(200):
+            r = random.Random(seed)
+            self.statements(r, RevertableList(range(r.randint(0, 8))), list_op, 10, seed % 2)
+
+    def test_dict(self):
+        for seed in range(200):
+            r = random.Random(seed)
+            d = RevertableDict((i, i) for i in range(r.randint(0, 8)))
+            self.statements(r, d, dict_op, 10, seed % 2)
+
+    def test_undo_log(self):
+        l = RevertableList([ 1, 2, 3 ])
+
+        renpy.game.log.mutated = { }
+        l.append(4)
+
+        undo = renpy.game.log.mutated[id(l)][1]
+        assert isinstance(undo, UndoLog)
+        assert not undo.complete
+
+    def test_legacy_list(self):
+        l = RevertableList([ 1, 2, 3 ])
+        l.rollback([ 4, 5 ])
+        assert l == [ 4, 5 ]
+
+    def test_legacy_dict(self):
+        d = RevertableDict(a=1, b=2)
+        d.rollback([ ("c", 3) ])
+        assert d == { "c" : 3 }
+
+    def test_legacy_pickled(self):
+        l = RevertableList([ 1, 2, 3 ])
+        d = RevertableDict(a=1)
+
+        old_list, old_dict = cPickle.loads(cPickle.dumps(([ 7 ], [ ("b", 2) ]), cPickle.HIGHEST_PROTOCOL))
+
+        l.rollback(old_list)
+        d.rollback(old_dict)
+
+        assert l == [ 7 ]
+        assert d == { "b" : 2 }